@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+import os
+import json
+import gzip
+import time
+import shutil
+import argparse
+import subprocess
+
+"""
+ARCHIVE OF THE LARGE FORT.* FILES
+
+Instead of deleting the wavefunction files (see positions.clean --archive)
+each file is compressed separately into the archive directory, so any
+single block can be restored or streamed without touching the others:
+
+    archive/
+        catalog.json
+        jki_0100f/fort.26.zst
+        jki_1010f/fort.8.zst
+
+The catalog keeps the codec, the original size and mtime and the
+compressed size of each file. The external compressors are used when
+available, they run multithreaded and do not occupy the Python process:
+
+    zstd:  zstd -T<threads> (preferred)
+    xz:    xz -T<threads>
+    gzip:  Python gzip module, single thread (always available)
+
+Archived files can be fed to DIPOLE3B without restoring them to the
+shared storage: the starter decompresses the file to the job folder
+(or to a named pipe, FIFO mode) right before the run, see get_stream_command.
+"""
+
+CATALOG_FILE = 'catalog.json'
+
+CODECS = {
+    'zstd': {'ext':'.zst','compress':['zstd','-q','-c','-T{threads}','-{level}'],
+             'decompress':['zstd','-q','-d','-c']},
+    'xz':   {'ext':'.xz','compress':['xz','-z','-c','-T{threads}','-{level}'],
+             'decompress':['xz','-d','-c']},
+    'gzip': {'ext':'.gz','compress':None,'decompress':['gzip','-d','-c']},
+}
+DEFAULT_LEVELS = {'zstd':3,'xz':1,'gzip':1}
+
+def get_codec(codec=None):
+    """ Return the requested codec, or the best available one if None. """
+    if codec:
+        codec = codec.lower()
+        if codec not in CODECS:
+            raise Exception('unknown archive codec "%s" (expected one of: %s)'%\
+                (codec,', '.join(CODECS)))
+        compress = CODECS[codec]['compress']
+        if compress and not shutil.which(compress[0]):
+            raise Exception('archive codec "%s" is requested, but %s is not found'%\
+                (codec,compress[0]))
+        return codec
+    for codec in ['zstd','xz']:
+        if shutil.which(codec):
+            return codec
+    return 'gzip'
+
+def load_catalog(archive):
+    path = os.path.join(archive,CATALOG_FILE)
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_catalog(archive,catalog):
+    path = os.path.join(archive,CATALOG_FILE)
+    tmppath = path+'.tmp'
+    with open(tmppath,'w') as f:
+        json.dump(catalog,f,indent=1,sort_keys=True)
+    os.replace(tmppath,path)
+
+def get_key(block,file):
+    return '%s/%s'%(block,file)
+
+def compress_file(src,dst,codec,level=None,threads=0):
+    """ Compress src to dst, dst appears only when the compression succeeded. """
+    level = level or DEFAULT_LEVELS[codec]
+    tmpdst = dst+'.tmp'
+    if codec=='gzip':
+        with open(src,'rb') as fin, gzip.open(tmpdst,'wb',compresslevel=level) as fout:
+            shutil.copyfileobj(fin,fout,1<<24)
+    else:
+        command = [arg.format(threads=threads,level=level) for arg in CODECS[codec]['compress']]
+        with open(src,'rb') as fin, open(tmpdst,'wb') as fout:
+            result = subprocess.run(command,stdin=fin,stdout=fout,
+                stderr=subprocess.PIPE,universal_newlines=True)
+        if result.returncode:
+            os.remove(tmpdst)
+            raise Exception('%s failed on %s: %s'%(codec,src,result.stderr.strip()))
+    os.replace(tmpdst,dst)
+
+def archive_file(archive,block,file,codec,level=None,threads=0,catalog=None):
+    """
+    Compress block/file into the archive and remove the original.
+    Return the catalog entry. The catalog is updated in place
+    (if given) and should be saved by the caller.
+    """
+    src = os.path.join(block,file)
+    os.makedirs(os.path.join(archive,block),exist_ok=True)
+    dst = os.path.join(archive,block,file+CODECS[codec]['ext'])
+    st = os.stat(src)
+    start = time.time()
+    compress_file(src,dst,codec,level,threads)
+    old = (catalog or {}).get(get_key(block,file))
+    if old and os.path.join(archive,old['path'])!=dst: # archived before with another codec
+        if os.path.isfile(os.path.join(archive,old['path'])):
+            os.remove(os.path.join(archive,old['path']))
+    entry = {'codec':codec,'path':os.path.relpath(dst,archive),
+        'size':st.st_size,'mtime':st.st_mtime,
+        'compressed_size':os.path.getsize(dst),'time':time.time()-start}
+    if catalog is not None:
+        catalog[get_key(block,file)] = entry
+    os.remove(src)
+    return entry
+
+def restore_file(archive,block,file,catalog,dest=None):
+    """
+    Decompress the archived file to dest (block/file by default).
+    The original mtime is restored so the dependent outputs stay up to date.
+    """
+    entry = catalog[get_key(block,file)]
+    src = os.path.join(archive,entry['path'])
+    dest = dest or os.path.join(block,file)
+    tmpdest = dest+'.tmp'
+    with open(tmpdest,'wb') as fout:
+        result = subprocess.run(CODECS[entry['codec']]['decompress']+[src],
+            stdout=fout,stderr=subprocess.PIPE,universal_newlines=True)
+    if result.returncode or os.path.getsize(tmpdest)!=entry['size']:
+        os.remove(tmpdest)
+        raise Exception('cannot restore %s: %s'%(src,result.stderr.strip() or 'size mismatch'))
+    os.replace(tmpdest,dest)
+    os.utime(dest,(entry['mtime'],entry['mtime']))
+
+def get_stream_command(archive,block,file,dest,catalog,fifo=False):
+    """
+    Shell commands feeding the archived block/file to the job as dest.
+    FIFO mode decompresses into a named pipe in the background, so nothing
+    is written to disk (the program must read the file sequentially once).
+    Return None if the file is not archived.
+    """
+    entry = catalog.get(get_key(block,file))
+    if entry is None:
+        return None
+    src = os.path.join(os.path.abspath(archive),entry['path'])
+    decompress = ' '.join(CODECS[entry['codec']]['decompress']+[src])
+    if fifo:
+        return 'rm -f %s; mkfifo %s; %s > %s & STREAM_PIDS="$STREAM_PIDS $!"'%\
+            (dest,dest,decompress,dest)
+    return 'rm -f %s; %s > %s'%(dest,decompress,dest)
+
+def get_stats(catalog):
+    """ Number of files, original and compressed sizes. """
+    size = sum(entry['size'] for entry in catalog.values())
+    compressed_size = sum(entry['compressed_size'] for entry in catalog.values())
+    return len(catalog),size,compressed_size
+
+def main():
+    parser = argparse.ArgumentParser(description='Archive of the large fort.* files.')
+    parser.add_argument('archive')
+    args = parser.parse_args()
+    catalog = load_catalog(args.archive)
+    for key in sorted(catalog):
+        entry = catalog[key]
+        print('%-30s %5s %12d -> %12d (%.1fx)'%(key,entry['codec'],entry['size'],
+            entry['compressed_size'],entry['size']/max(entry['compressed_size'],1)))
+    nfiles,size,compressed_size = get_stats(catalog)
+    print('%d files, %.3f GB -> %.3f GB'%(nfiles,size/2**30,compressed_size/2**30))
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+
+import os
+import time
+from collections import OrderedDict
+
+from . import monitor
+from . import schedule
+from . import ledger as job_ledger
+from .estimate import estimate_flops
+from . import positions as posit
+from . import intensities as intens
+
+"""
+DEPENDENCY GRAPH OF THE CAMPAIGN:
+
+   jki_0000f   jki_0100f   jki_0110f       <- positions blocks (root_energies)
+        \\       /    \\       /
+      transition_1   transition_2          <- dipole3b+spectra folders
+
+Each DIPOLE3B job links fort.11/fort.12 from exactly two positions
+blocks (bra and ket), so a transition can be released as soon as
+both of them are DONE, without waiting for the whole J ladder.
+
+The job scripts write the DONE label even after a failed run, so the
+state of a finished node is taken from the ledger if it is configured
+(exit code of the latest run, killed jobs are reconciled with the
+scheduler), otherwise from the failure signs in the job output
+(see parse.collect_states.detect_failure):
+
+    None:      not finished (pending, queued or running)
+    done:      finished successfully, dependents can be released
+    failed:    non-zero exit code in the ledger or errors in the job output
+    blocked:   both labels or missing folder (see monitor.STATUS_MESSAGES)
+    dropped:   depends on a failed or blocked node, never submitted
+
+The campaign stops when everything is submitted, or when nothing
+can be released and no dependency is left to wait for.
+"""
+
+CLOCK_SKEW = 300 # seconds, tolerance between the clocks of the submit host and the compute nodes
+
+class Node:
+    """
+    Job folder which is a node of the campaign graph.
+    """
+
+    def __init__(self,name,path,job_manager,deps=(),ledger=None):
+        self.name = name
+        self.path = path
+        self.job_manager = job_manager
+        self.deps = list(deps)
+        self.ledger = ledger
+        self.submitted = False
+        self.submit_time = None
+        self.state = None # see above
+        self.error = None
+        self.priority = (0,0) # (priority, cost), larger goes first
+
+    def get_status(self):
+        return monitor.get_folder_status(self.path)
+
+    def update(self,runs=None):
+        """
+        Update the state of the submitted node. Runs are the latest
+        ledger runs {name: run} (None => ledger is not used).
+        Final states are not probed again.
+        """
+        from ..parse.collect_states import job_failed
+        if self.state is not None or not self.submitted:
+            return self.state
+        status = self.get_status()
+        if status in {3,4}:
+            self.state = 'blocked'; self.error = monitor.STATUS_MESSAGES[status]%self.path
+            return self.state
+        run = runs.get(self.name) if runs is not None else None
+        if run is not None and self.submit_time and run['start']<self.submit_time-CLOCK_SKEW:
+            run = None # previous run, the new job has not started yet
+        if runs is not None and self.submit_time and run is None:
+            pass # submitted by the campaign, wait for the ledger record
+        elif run is not None:
+            status = job_ledger.get_run_status(run)
+            if status==0:
+                self.state = 'done'
+            elif status==5:
+                self.state = 'failed'
+                self.error = 'killed by the scheduler' if run['exit_code']==job_ledger.EXIT_CODE_KILLED \
+                    else 'exit code %d in the ledger'%run['exit_code']
+        elif status in {0,1}: # no ledger record, use the job output
+            error = job_failed(self.path)
+            if error=='no job output':
+                error = None # e.g. Shell job manager, output is not saved
+            if error:
+                self.state = 'failed'; self.error = error
+            elif status==0:
+                self.state = 'done'
+        return self.state
+
+    def is_done(self):
+        return self.state=='done'
+
+    def is_ready(self):
+        return all(dep.is_done() for dep in self.deps)
+
+    def is_dropped(self):
+        return any(dep.state in {'failed','blocked','dropped'} for dep in self.deps)
+
+    def submit(self):
+        curdir = os.getcwd()
+        os.chdir(self.path)
+        self.submit_time = time.time()
+        self.job_manager.submit_job()
+        os.chdir(curdir)
+        self.submitted = True
+
+class Campaign:
+    """
+    Dependency-aware scheduler: submits every node
+    as soon as all of its dependencies are DONE.
+    """
+
+    def __init__(self):
+        self.nodes = OrderedDict()
+
+    def add_node(self,name,path,job_manager,deps=(),ledger=None):
+        deps = [self.nodes[dep] for dep in deps]
+        node = Node(name,path,job_manager,deps,ledger)
+        status = node.get_status()
+        if status in {0,1}: # already done or running
+            node.submitted = True
+        elif status in {3,4}:
+            print(monitor.STATUS_MESSAGES[status]%path+' ===> SKIPPING NODE')
+            node.submitted = True
+            node.state = 'blocked'; node.error = monitor.STATUS_MESSAGES[status]%path
+        self.nodes[name] = node
+        return node
+
+    def get_job_managers(self):
+        job_managers = []
+        for node in self.nodes.values():
+            if node.job_manager not in job_managers:
+                job_managers.append(node.job_manager)
+        return job_managers
+
+    def update(self):
+        """ Update the states of the submitted nodes, one ledger query per ledger. """
+        for job_manager in self.get_job_managers():
+            job_manager.poll() # e.g. LocalPool launches the queued jobs
+        ledgers = {node.ledger for node in self.nodes.values() \
+            if node.ledger and node.submitted and node.state is None}
+        runs = {}
+        for ledger in ledgers:
+            runs[ledger] = job_ledger.get_last_runs(ledger) if os.path.isfile(ledger) else {}
+            job_ledger.reconcile(ledger,runs[ledger])
+        for node in self.nodes.values():
+            state = node.state
+            if node.update(runs.get(node.ledger)) in {'failed','blocked'} and state is None:
+                print('%s FAILED: %s'%(node.name,node.error))
+
+    def drop(self):
+        """ Mark the pending nodes depending on the failed ones, return them. """
+        dropped = []
+        for node in self.nodes.values(): # dependencies are added first
+            if not node.submitted and node.state is None and node.is_dropped():
+                node.state = 'dropped'
+                node.error = 'depends on %s'%', '.join(dep.name for dep in node.deps \
+                    if dep.state in {'failed','blocked','dropped'})
+                dropped.append(node)
+        return dropped
+
+    def get_pending(self):
+        pending = [node for node in self.nodes.values() \
+            if not node.submitted and node.state is None]
+        return sorted(pending,key=lambda node: (-node.priority[0],-node.priority[1]))
+
+    def is_waiting(self,pending):
+        """ True if some dependency of the pending nodes is not finished yet. """
+        return any(dep.state is None for node in pending for dep in node.deps)
+
+    def release(self):
+        """ Submit all pending nodes with completed dependencies. """
+        released = []
+        for node in self.get_pending():
+            if node.is_ready():
+                print('RELEASING %s'%node.name)
+                node.submit()
+                released.append(node)
+        return released
+
+    def run(self,interval=60):
+        """
+        Release the nodes until there is nothing left to submit,
+        or nothing can be released anymore. Return the dropped nodes.
+        """
+        dropped = []
+        while True:
+            self.update()
+            dropped += self.drop()
+            released = self.release()
+            pending = self.get_pending()
+            print('%s: %d released, %d pending, %d dropped'%\
+                (time.strftime('%Y-%m-%d %H:%M:%S'),len(released),len(pending),len(dropped)))
+            if not pending:
+                break
+            if not released and not self.is_waiting(pending):
+                print('NOTHING CAN BE RELEASED, STOPPING')
+                break
+            time.sleep(interval)
+        if dropped:
+            print('\nDROPPED %d NODES:'%len(dropped))
+            for node in dropped:
+                print('%s: %s'%(node.name,node.error))
+        for job_manager in self.get_job_managers():
+            job_manager.finalize()
+        return dropped
+
+def get_campaign(VARSPACE):
+    """
+    Build campaign graph from the intensities project config.
+    Optional CAMPAIGN section:
+        positions_job_manager: job manager for the blocks (Slurm by default)
+        positions_job_script: job script name in the blocks (job.sh by default)
+        nslots: number of simultaneous blocks for LocalPool manager
+        order: release order of the ready nodes, file (default), cost or priority
+        positions_ledger: ledger of the blocks (see calc/ledger.py), empty => use the job output
+    The transitions use the ledger of the intensities project (CREATE.ledger).
+    """
+    CAMPAIGN = VARSPACE.get('CAMPAIGN',{})
+    root_energies = VARSPACE['INIT']['root_energies']
+    states = intens.read_states(VARSPACE['INIT']['states'])
+    transitions = intens.read_transitions(VARSPACE['CREATE']['transitions'])
+
+    # job manager for the positions blocks
+    positions_manager = posit.get_job_manager(
+        jobman=CAMPAIGN.get('positions_job_manager') or 'Slurm',
+        jobscript=CAMPAIGN.get('positions_job_script') or 'job.sh')
+    if isinstance(positions_manager,(posit.SlurmArray,posit.SlurmPack,posit.Pilot)):
+        raise Exception('job arrays, packs and pilots cannot be used in campaign mode')
+    if isinstance(positions_manager,posit.LocalPool):
+        positions_manager.nslots = intens.to_int(CAMPAIGN.get('nslots'))
+
+    # job manager for the transitions
+    transitions_manager = intens.get_job_manager(VARSPACE,'job.slurm')
+    if isinstance(transitions_manager,(posit.SlurmArray,posit.SlurmPack,posit.Pilot)):
+        raise Exception('job arrays, packs and pilots cannot be used in campaign mode')
+
+    positions_ledger = CAMPAIGN.get('positions_ledger')
+    if positions_ledger: positions_ledger = os.path.abspath(positions_ledger)
+    ledger = VARSPACE['CREATE'].get('ledger')
+    if ledger: ledger = os.path.abspath(ledger)
+
+    campaign = Campaign()
+    for state in states:
+        path = os.path.abspath(os.path.join(root_energies,state['name']))
+        campaign.add_node(state['name'],path,positions_manager,ledger=positions_ledger)
+    for trans in transitions:
+        for dep in [trans['state'],trans['state_']]:
+            if dep not in campaign.nodes:
+                raise Exception('unknown state %s in transition %s'%(dep,trans['name']))
+        path = os.path.abspath(trans['name'])
+        campaign.add_node(trans['name'],path,transitions_manager,
+            deps=[trans['state'],trans['state_']],ledger=ledger)
+
+    order = schedule.check_order(CAMPAIGN.get('order'))
+    if order in {'cost','priority'}:
+        set_priorities(campaign,VARSPACE,states,transitions,order)
+
+    return campaign
+
+def get_block_cost(path,state):
+    """ Predicted cost of the energy block from its input files, 0 if unknown. """
+    from ..parse.collect_timings import read_basis
+    rotlev_input = None
+    for name in ['rotlev3b.inp','rotlev3.inp','rotlev3z.inp']:
+        if os.path.isfile(os.path.join(path,name)):
+            rotlev_input = name
+    basis = read_basis(path,'dvr3drjz.inp',rotlev_input)
+    if basis['max3d'] is None:
+        return 0
+    basis.update({'jrot':state['jrot'],'kmin':state['kmin']})
+    return estimate_flops(basis)
+
+def set_priorities(campaign,VARSPACE,states,transitions,order):
+    """
+    Set release priorities of the nodes (see schedule.py).
+    Blocks: number of dependent transitions (priority order only) and basis cost.
+    Transitions: number of bra and ket levels from the collected energies.
+    """
+    root_energies = VARSPACE['INIT']['root_energies']
+    dependents = schedule.get_dependent_counts(transitions) if order=='priority' else {}
+    for state in states:
+        node = campaign.nodes[state['name']]
+        node.priority = (dependents.get(state['name'],0),get_block_cost(node.path,state))
+    counts = schedule.read_level_counts(os.path.join(root_energies,'states.csv'))
+    costs = schedule.get_transition_costs(transitions,counts)
+    for trans in transitions:
+        campaign.nodes[trans['name']].priority = (0,costs[trans['name']])
+
+def run_campaign(VARSPACE):
+    campaign = get_campaign(VARSPACE)
+    interval = int(VARSPACE.get('CAMPAIGN',{}).get('interval') or 60)
+    print('CAMPAIGN: %d nodes, %d to submit, polling every %d s'%\
+        (len(campaign.nodes),len(campaign.get_pending()),interval))
+    campaign.run(interval)
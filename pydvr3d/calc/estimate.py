@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+import os
+import copy
+import math
+import statistics
+
+from . import ledger as job_ledger
+
+"""
+RESOURCE ESTIMATES FOR THE DVR BLOCKS
+
+Peak memory is set by the largest dense matrix diagonalised in the job:
+
+    DVR3DRJZ: 3D Hamiltonian (max3d x max3d), 2D Hamiltonians (max2d x max2d),
+              eigenvectors on the DVR grid (neval x npnt1 x npnt2 x nalf)
+    ROTLEV:   rotational Hamiltonian (nbass x nbass),
+              nbass = min(nvib,neval) x (number of k blocks), or ibass if smaller
+
+Runtime is dominated by the dense diagonalisations (N^3 flops each):
+the 3D and nalf 2D problems for each k block in DVR3DRJZ,
+and the single nbass problem in ROTLEV.
+
+The flop rate is a rough guess unless it is calibrated
+on the finished jobs from the campaign ledger.
+"""
+
+BYTES = 8 # double precision
+MEMORY_OVERHEAD = 500 # MB: executable, PES, I/O buffers
+FLOP_RATE = 1.0e10 # flop/s per core
+MEMORY_SAFETY = 1.5
+WALLTIME_SAFETY = 2.0
+
+def get_nblocks(jrot,kmin):
+    """ Number of k blocks in the J block. """
+    if jrot==0:
+        return 1
+    elif kmin==2: # both parities
+        return 2*jrot+1
+    else:
+        return jrot+kmin
+
+def get_block_basis(rovib_state):
+    """ Get basis sizes of the block from the ROVIB_STATE object. """
+    dvr3drjz = rovib_state.dvr3drjz
+    basis = {
+        'jrot': dvr3drjz.jrot, 'kmin': dvr3drjz.kmin,
+        'npnt1': dvr3drjz.npnt1, 'npnt2': dvr3drjz.npnt2, 'nalf': dvr3drjz.nalf,
+        'max2d': dvr3drjz.max2d, 'max3d': dvr3drjz.max3d, 'neval': dvr3drjz.neval,
+        'nvib': None, 'ibass': None,
+    }
+    if dvr3drjz.idia==-2: # npnt1 is ignored, same grid in r1 and r2
+        basis['npnt1'] = dvr3drjz.npnt2
+    if dvr3drjz.jrot>0:
+        basis['nvib'] = rovib_state.rotlev.nvib
+        basis['ibass'] = rovib_state.rotlev.ibass
+    return basis
+
+def get_rotlev_size(basis):
+    """ Size of the ROTLEV Hamiltonian, 0 for J=0. """
+    if basis['jrot']==0:
+        return 0
+    nvib = min(basis['nvib'] or basis['neval'],basis['neval'])
+    nbass = nvib*get_nblocks(basis['jrot'],basis['kmin'])
+    if basis['ibass'] and 0<basis['ibass']<nbass:
+        nbass = basis['ibass']
+    return nbass
+
+def estimate_memory(basis):
+    """ Peak memory of the block, MB. """
+    dvr = basis['max3d']**2 + basis['max2d']**2 + \
+        basis['neval']*basis['npnt1']*basis['npnt2']*basis['nalf']
+    rot = get_rotlev_size(basis)**2
+    return MEMORY_OVERHEAD + max(dvr,rot)*BYTES/2**20
+
+def estimate_flops(basis):
+    """ Floating point operations of the block. """
+    nblocks = get_nblocks(basis['jrot'],basis['kmin'])
+    dvr = nblocks*(basis['max3d']**3 + basis['nalf']*basis['max2d']**3)
+    rot = get_rotlev_size(basis)**3
+    return dvr+rot
+
+class Estimator:
+    """
+    Predicts memory (MB), walltime (hours) and number of cores for each block.
+    The configured ncores, memory and walltime are the upper limits.
+    """
+
+    def __init__(self,ncores,memory,walltime,flop_rate=FLOP_RATE):
+        self.ncores = ncores
+        self.memory = memory
+        self.walltime = walltime
+        self.flop_rate = flop_rate
+
+    def calibrate(self,ledger,blocks,job_script='job.sh'):
+        """
+        Fit the flop rate to the finished runs in the ledger.
+        Blocks is a dict {folder name: basis}.
+        Number of cores of the finished run is taken from its job script.
+        Return the number of runs used.
+        """
+        from ..parse.collect_timings import get_job_cores
+        rates = []
+        for name,run in job_ledger.get_last_runs(ledger,list(blocks)).items():
+            if job_ledger.get_run_status(run)!=0 or run['end']<=run['start']:
+                continue
+            ncores = get_job_cores(name,job_script) or 1
+            core_seconds = (run['end']-run['start'])*ncores
+            rates.append(estimate_flops(blocks[name])/core_seconds)
+        if rates:
+            self.flop_rate = statistics.median(rates)
+        return len(rates)
+
+    def estimate(self,basis):
+        """ Return dict with memory, walltime and ncores for the block. """
+        core_hours = estimate_flops(basis)/self.flop_rate/3600
+        ncores = min(max(math.ceil(core_hours),1),self.ncores) # at least one hour of work per core
+        memory = math.ceil(estimate_memory(basis)*MEMORY_SAFETY/100)*100
+        walltime = math.ceil(core_hours/ncores*WALLTIME_SAFETY)
+        return {
+            'memory': min(memory,self.memory),
+            'walltime': min(max(walltime,1),self.walltime),
+            'ncores': ncores,
+        }
+
+def get_estimator(VARSPACE,rovib_state,states):
+    """
+    Create estimator from the CALCULATE section,
+    calibrate it on the ledger history if available.
+    """
+    CALCULATE = VARSPACE['CALCULATE']
+    estimator = Estimator(CALCULATE['ncores'],CALCULATE['memory'],CALCULATE['walltime'])
+    ledger = VARSPACE['CREATE']['ledger']
+    if ledger and os.path.isfile(ledger):
+        blocks = {state['name']:get_state_basis(rovib_state,state) for state in states}
+        nruns = estimator.calibrate(ledger,blocks,VARSPACE['CREATE']['job_script'])
+        print('Estimator calibrated on %d finished runs: %.3g flop/s per core'%\
+            (nruns,estimator.flop_rate))
+    return estimator
+
+def get_block_costs(rovib_state,states):
+    """ Predicted cost of each block in flops, {folder name: flops}. """
+    return {state['name']:estimate_flops(get_state_basis(rovib_state,state)) \
+        for state in states}
+
+def get_state_basis(rovib_state,state):
+    """ Basis sizes of the block of the state, rovib_state itself is not changed. """
+    block = copy.copy(rovib_state)
+    block.dvr3drjz = copy.copy(rovib_state.dvr3drjz)
+    block.rotlev = copy.copy(rovib_state.rotlev)
+    set_block(block,state)
+    return get_block_basis(block)
+
+def set_block(rovib_state,state):
+    """ Actualize jrot, kmin, and ipar of the ROVIB_STATE object. """
+    rovib_state.dvr3drjz.jrot = state['jrot']
+    rovib_state.dvr3drjz.kmin = state['kmin']
+    rovib_state.dvr3drjz.ipar = state['ipar']
+    rovib_state.rotlev.kmin = state['kmin']
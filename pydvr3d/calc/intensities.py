@@ -9,8 +9,17 @@ import configparser as ConfigParser # python 3
 import shutil
 import subprocess
 
+from . import monitor
+from . import ledger as job_ledger
+from . import schedule
+from . import archive as fort_archive
+from . import stage as fort_stage
+from . import transitions as trans_gen
+from .positions import Slurm, SlurmArray, SlurmPack, Pilot
+
 LABEL_DONE = '===DONE==='
 LABEL_RUNNING = '===RUNNING==='
+GROUP_JOB_FILE = 'job_group.slurm' # runs all transitions of the group, see submit_groups
 
 # SERIALIZATION FRAMEWORK
 class Serial():
@@ -271,6 +280,13 @@ class DIPOLE3B():
         self.fort_bra = fort_bra
         self.fort_ket = fort_ket
         
+        # commands streaming the archived bra and ket files (None => not archived)
+        self.stream_bra = argv.get('stream_bra',None)
+        self.stream_ket = argv.get('stream_ket',None)
+        
+        # node-local staging cache: dict(cache,max_size,mode), None => no staging
+        self.stage = argv.get('stage',None)
+        
         # path to executable
         self.exefile = argv.get('exefile','./dipole3b.x')
             
@@ -356,16 +372,39 @@ class DIPOLE3B():
             else:
                 self.ezero = 0.0
                 
+    def get_link(self,path,fort,unit,stream):
+        """
+        Link the wavefunction file to the unit. Archived files 
+        (see calc/archive.py) are decompressed if the original is absent.
+        """
+        link = 'ln -sf %s/%s %s'%(path,fort,unit)
+        if self.stage: # linked by the staging tool, see calc/stage.py
+            link = 'STAGE="$STAGE %s=%s/%s"'%(unit,path,fort)
+        if not stream:
+            return link
+        return 'if [ -f %s/%s ]; then %s; else %s; fi'%(path,fort,link,stream)
+        
     def get_starter(self):
+        # decompressors are killed after the run: FIFO writers stay
+        # blocked if the program fails before opening the pipes
+        streams = self.stream_bra or self.stream_ket
+        command = self.exefile + ' < ' + self.input_file + ' > ' + self.output_file
+        if self.stage:
+            command = fort_stage.get_command(self.stage['cache'],['$STAGE'],command,
+                self.stage.get('max_size'),self.stage.get('mode','copy'))
         text = \
         '#!/bin/sh' + '\n\n' + \
         'echo running dipole3b ...\n\n' + \
-        'ln -sf %s/%s fort.11'%(self.path_bra,self.fort_bra) + '\n\n' + \
-        'ln -sf %s/%s fort.12'%(self.path_ket,self.fort_ket) + '\n\n' + \
-        self.exefile + ' < ' + \
-        self.input_file + ' > ' + \
-        self.output_file + '\n\n' + \
-        'echo dipole3b ok'
+        ('STAGE=""\n' if self.stage else '') + \
+        self.get_link(self.path_bra,self.fort_bra,'fort.11',self.stream_bra) + '\n\n' + \
+        self.get_link(self.path_ket,self.fort_ket,'fort.12',self.stream_ket) + '\n\n' + \
+        command + '\n' + \
+        'EXIT_CODE=$?' + '\n\n' + \
+        ('kill $STREAM_PIDS 2>/dev/null; wait\n' + \
+        '[ -L fort.11 ] || rm -f fort.11\n' + \
+        '[ -L fort.12 ] || rm -f fort.12\n\n' if streams else '') + \
+        'echo dipole3b ok' + '\n' + \
+        'exit $EXIT_CODE'
         return text
         
     def save_starter(self,dirname='./'):
@@ -503,8 +542,10 @@ class SPECTRA():
         'echo running spectra ...\n\n' + \
         self.exefile + ' < ' + \
         self.input_file + ' > ' + \
-        self.output_file + '\n\n' + \
-        'echo spectra ok'
+        self.output_file + '\n' + \
+        'EXIT_CODE=$?' + '\n\n' + \
+        'echo spectra ok' + '\n' + \
+        'exit $EXIT_CODE'
         return text
         
     def save_starter(self,dirname='./'):
@@ -574,13 +615,19 @@ class DIPSPECTRA():
         self.job_name = argv.get('job_name','dipspectra')
         self.job_file = argv.get('job_file','job.slurm')
         self.job_manager = SLURM( self.job_name )
+        
+        # Campaign job ledger (None => not used).
+        self.ledger = argv.get('ledger',None)
                    
     def get_job(self):        
         commands = []
         commands.append('rm -f %s'%LABEL_DONE)
         commands.append('touch %s'%LABEL_RUNNING)
-        commands.append('time ./' + self.dipole3b.starter_file)
-        commands.append('time ./' + self.spectra.starter_file)
+        steps = ['time ./' + self.dipole3b.starter_file,
+                 'time ./' + self.spectra.starter_file]
+        if self.ledger:
+            steps = job_ledger.get_job_commands(self.ledger,steps)
+        commands += steps
         commands.append('rm -f %s'%LABEL_RUNNING)
         commands.append('touch %s'%LABEL_DONE)
         return self.job_manager.get_job(commands)
@@ -706,18 +753,7 @@ def get_case_params(state):
     ipar = state['ipar']    
     
     # get the lost of files containing wave functions
-    if jrot==0:
-        frts = ['fort.26']
-    elif jrot==1 and kmin==0:
-        frts = ['fort.26']
-    elif jrot==1 and kmin==1:
-        frts = ['fort.8']
-    elif jrot>1 and kmin in [0,1]:
-        frts = ['fort.8']
-    elif jrot>=1 and kmin==2:
-        frts = ['fort.8','fort.9']
-    else:
-        raise Exception('unknown combination of jrot and kmin: %d %d'%(jrot,kmin))
+    frts = trans_gen.get_wavefunction_files(jrot,kmin)
         
     return name,jrot,kmin,ipar,frts        
 
@@ -730,8 +766,20 @@ def generate(VARSPACE): # generate transitions
     states = read_states(VARSPACE['INIT']['states'])
     outfile = VARSPACE['GENERATE']['output']
     project_name = VARSPACE['INIT']['project']
-    filter = eval('lambda jrot,kmin,ipar,jrot_,kmin_,ipar_,fort,fort_,name,name_: %s'%\
-        VARSPACE['GENERATE']['filter'])
+    filters = [trans_gen.get_filter(VARSPACE['GENERATE']['filter'])]
+    # pairs rejected by DIPOLE3B or weighted to zero by SPECTRA, see calc/transitions.py
+    selection_rules = VARSPACE['GENERATE'].get('selection_rules','true').strip().lower() \
+        not in ['false','no','0','off']
+    if selection_rules:
+        spin_weights = None
+        spectra_template = VARSPACE['INIT'].get('spectra_template')
+        # ge and go are used by SPECTRA for the symmetric (AB2) molecules only, i.e. both ipar present
+        symmetric = len(set(state['ipar'] for state in states))>1
+        if symmetric and spectra_template and os.path.isfile(spectra_template):
+            spectra = SPECTRA()
+            spectra.load_input(spectra_template)
+            spin_weights = (spectra.ge,spectra.go)
+        filters += trans_gen.get_selection_rules(spin_weights)
     if os.path.isfile(outfile):
         print('ERROR: file "%s" already exists.'%outfile)
         sys.exit(1)
@@ -741,29 +789,27 @@ def generate(VARSPACE): # generate transitions
     J_diff_max = int(VARSPACE['GENERATE']['j_diff_max'])
     fmt_head = '%10s  %34s   %2s %1s %1s   %2s %1s %1s   %7s %7s   %8s  %8s\n'
     fmt = '%10s  %34s   %02d %1d %1d   %02d %1d %1d   %7s %7s   %8s  %8s\n'
+    # pairs are built per J group and filtered on arrays, see calc/transitions.py
+    rows = trans_gen.expand_states(states,get_case_params)
+    counts = {}
+    bra,ket = trans_gen.generate_pairs(rows,J_min,J_max,J_diff_min,J_diff_max,filters,counts)
     count = 0
     with open(outfile,'w')as f:
         f.write(fmt_head%('id','name','J','k','i','J','k','i','fort','fort','state','state'))
-        for state_bra in states:
-            name,jrot,kmin,ipar,frts = get_case_params(state_bra)
-            for state_ket in states:
-                name_,jrot_,kmin_,ipar_,frts_ = get_case_params(state_ket)
-                # test for selection rules
-                if jrot<J_min: continue
-                if jrot>J_max: continue
-                if jrot-jrot_<J_diff_min: continue
-                if jrot-jrot_>J_diff_max: continue
-                for fort in frts:
-                    for fort_ in frts_:
-                        pars = (jrot,kmin,ipar,jrot_,kmin_,ipar_,fort,fort_,name,name_)
-                        if not filter(*pars): continue
-                        # all selection rules are passed - save case
-                        count += 1
-                        id = '%s%s'%(project_name,count)
-                        #tname = '%s_%s__%s_%s'%(name,fort,name_,fort_)
-                        tname = create_transition_folder_name(name,fort,name_,fort_)
-                        f.write(fmt%(id,tname,*pars))
+        lines = []
+        params = trans_gen.get_pair_params(rows,bra,ket)
+        for pars in zip(*[params[key].tolist() for key in trans_gen.PAIR_PARAMS]):
+            count += 1
+            id = '%s%s'%(project_name,count)
+            jrot,kmin,ipar,jrot_,kmin_,ipar_,fort,fort_,name,name_ = pars
+            tname = create_transition_folder_name(name,fort,name_,fort_)
+            lines.append(fmt%(id,tname,*pars))
+        f.writelines(lines)
     print('%d transitions were generated and saved to %s'%(count,outfile))
+    if selection_rules:
+        avoided = sum(counts.get(name,0) for name,_ in filters[1:])
+        print('%d jobs avoided by the selection rules (%s)'%(avoided,
+            ', '.join('%s: %d'%(name,counts.get(name,0)) for name,_ in filters[1:])))
                     
 def read_states(filename):
     """
@@ -849,6 +895,26 @@ def create(VARSPACE):
     nnodes = VARSPACE['CALCULATE']['nnodes']
     memory = VARSPACE['CALCULATE']['memory']
     walltime = VARSPACE['CALCULATE']['walltime']
+    ledger = VARSPACE['CREATE'].get('ledger')
+    if ledger: ledger = os.path.abspath(ledger)
+    # archive of the wavefunction files (positions --clean --archive): same key
+    # as in the positions config, CALCULATE.archive relative to root_energies
+    archive = os.path.join(root_energies,VARSPACE['CALCULATE'].get('archive') or 'archive')
+    catalog = fort_archive.load_catalog(archive)
+    fifo = (VARSPACE['CALCULATE'].get('archive_stream') or 'file').lower()=='fifo'
+    if catalog:
+        print('Using archive %s (%d files)'%(archive,len(catalog)))
+    # node-local staging of the wavefunction files (see calc/stage.py)
+    if (VARSPACE['CALCULATE'].get('stage') or 'no').lower() in ['yes','true','1','on']:
+        max_size = VARSPACE['CALCULATE'].get('stage_max_size')
+        dipole3b.stage = {
+            'cache':VARSPACE['CALCULATE'].get('stage_dir') or '${TMPDIR:-/tmp}/pydvr3d_stage',
+            'max_size':float(max_size) if max_size else None,
+            'mode':(VARSPACE['CALCULATE'].get('stage_mode') or 'copy').lower(),
+        }
+        if dipole3b.stage['mode'] not in ['copy','link']:
+            raise Exception('unknown stage_mode "%s" (expected copy or link)'%dipole3b.stage['mode'])
+        print('Staging wavefunction files to %s'%dipole3b.stage['cache'])
     for trans in transitions: 
         print('Creating inputs for ',trans['name']) # for slow-reacting systems
         # actualize parameters
@@ -866,8 +932,12 @@ def create(VARSPACE):
         dipole3b.jki_ket = jki_ket
         dipole3b.fort_bra = fort_bra
         dipole3b.fort_ket = fort_ket
+        dipole3b.stream_bra = fort_archive.get_stream_command(
+            archive,state_bra,fort_bra,'fort.11',catalog,fifo)
+        dipole3b.stream_ket = fort_archive.get_stream_command(
+            archive,state_ket,fort_ket,'fort.12',catalog,fifo)
         # create job files for dipole+spectra
-        dipspect = DIPSPECTRA(dipole3b=dipole3b,spectra=spectra)
+        dipspect = DIPSPECTRA(dipole3b=dipole3b,spectra=spectra,ledger=ledger)
         dipspect.job_manager.ncores = ncores
         dipspect.job_manager.nnodes = nnodes
         dipspect.job_manager.memory = memory
@@ -882,9 +952,9 @@ def create(VARSPACE):
         fout.write(str(trans)+'\n')
     print('%d subfolders were created. Summary is saved to %s'%(len(transitions),summary_file))
 
-def check_job_status(curdir): # need to have a proper working dir
-    flag_done = os.path.isfile(LABEL_DONE)
-    flag_running = os.path.isfile(LABEL_RUNNING)
+def check_job_status(curdir,dirname='./'): # dirname is relative to the working dir
+    flag_done = os.path.isfile(os.path.join(dirname,LABEL_DONE))
+    flag_running = os.path.isfile(os.path.join(dirname,LABEL_RUNNING))
     if flag_done and not flag_running:
         status = 0; message = 'JOB IN %s IS DONE'%curdir
     elif not flag_done and flag_running:
@@ -895,8 +965,52 @@ def check_job_status(curdir): # need to have a proper working dir
         status = 3; message = 'ERROR: JOB IN %s HAS BOTH LABELS (SOMETHING IS WRONG)'%curdir        
     return status, message
     
-def submit(VARSPACE):
+def get_job_manager(VARSPACE,job_file):
+    """
+    Create job manager for submitting the transition folders.
+    CALCULATE.job_manager: Slurm (default), SlurmArray, SlurmPack, Pilot or PilotLocal.
+    """
+    CALCULATE = VARSPACE['CALCULATE']
+    jobman = CALCULATE.get('job_manager') or 'slurm'
+    jobman_ = jobman.lower()
+    if jobman_ in ['slurm']:
+        job_manager = Slurm(title=VARSPACE['INIT']['project'],job_file=job_file)
+    elif jobman_ in ['slurmarray','array']:
+        job_manager = SlurmArray(title=VARSPACE['INIT']['project'],job_file=job_file)
+        job_manager.throttle = to_int(CALCULATE.get('array_throttle'))
+        array_max_size = to_int(CALCULATE.get('array_max_size'))
+        if array_max_size:
+            job_manager.max_array_size = array_max_size
+    elif jobman_ in ['slurmpack','pack']:
+        job_manager = SlurmPack(title=VARSPACE['INIT']['project'],job_file=job_file)
+        job_manager.ntasks = to_int(CALCULATE.get('pack_ntasks'))
+        job_manager.pack_size = to_int(CALCULATE.get('pack_size'))
+    elif jobman_ in ['pilot','pilotlocal']:
+        job_manager = Pilot(title=VARSPACE['INIT']['project'],job_file=job_file)
+        job_manager.local = jobman_=='pilotlocal'
+        job_manager.nslots = to_int(CALCULATE.get('nslots')) or 1
+        job_manager.npilots = to_int(CALCULATE.get('npilots')) or 1
+    else:
+        raise Exception('unknown mode "%s"'%jobman)
+    job_manager.ncores = to_int(CALCULATE['ncores'])
+    job_manager.nnodes = to_int(CALCULATE['nnodes'])
+    job_manager.memory = CALCULATE['memory']
+    job_manager.walltime = CALCULATE['walltime']
+    return job_manager
+    
+def submit_jobs(VARSPACE,job_file):
     transitions = read_transitions(VARSPACE['CREATE']['transitions'])
+    job_manager = get_job_manager(VARSPACE,job_file)
+    # most expensive transitions first (LPT), cost is taken from the collected energies
+    order = schedule.check_order(VARSPACE['CALCULATE'].get('submit_order'),['file','cost'])
+    if order=='cost':
+        counts = schedule.read_level_counts(
+            os.path.join(VARSPACE['INIT']['root_energies'],'states.csv'))
+        if not counts:
+            print('WARNING: no collected energies in %s, using file order'%\
+                VARSPACE['INIT']['root_energies'])
+        transitions = schedule.order_by_cost(transitions,
+            schedule.get_transition_costs(transitions,counts))
     print('INITIAL DIR: %s'%os.getcwd())
     for trans in transitions:
         curdir = trans['name']
@@ -906,24 +1020,84 @@ def submit(VARSPACE):
         if status in {1,3}:
             print(message+' ===> SKIPPING SUBMIT')
         else:
-            subprocess.run(['sbatch','job.slurm']) # system-specific
+            job_manager.submit_job() # system-specific
         print('CD TO UPPER LEVEL')
         os.chdir('..')
+    job_manager.finalize()
+    
+def save_group_job(job_manager,group,job_file):
+    """
+    Save the job running the group members one after another
+    to the folder of the first member. Finished members are skipped.
+    Walltime is the sum of the member walltimes.
+    """
+    commands = []
+    for trans in group:
+        commands.append('cd ../%s && echo RUNNING %s && '%(trans['name'],trans['name']) + \
+            '{ [ -f %s ] || ./%s; }'%(LABEL_DONE,job_file))
+    walltime = job_manager.walltime
+    job_manager.walltime = int(walltime)*len(group)
+    with open(os.path.join(group[0]['name'],GROUP_JOB_FILE),'w') as f:
+        f.write(job_manager.get_job(commands)+'\n')
+    make_executable(os.path.join(group[0]['name'],GROUP_JOB_FILE))
+    job_manager.walltime = walltime
 
-def submit_spectra(VARSPACE):
+def submit_groups(VARSPACE,job_file,grouping):
+    """
+    Submit the transitions sharing a wavefunction file as one job per group
+    (CALCULATE.group: bra, ket or file, see schedule.group_by_file).
+    The group job is put to the folder of the first member.
+    Groups are split so that their walltime (member walltime x size) does not
+    exceed CALCULATE.max_walltime, e.g. the partition time limit in hours.
+    """
     transitions = read_transitions(VARSPACE['CREATE']['transitions'])
+    job_manager = get_job_manager(VARSPACE,GROUP_JOB_FILE)
+    group_size = to_int(VARSPACE['CALCULATE'].get('group_size'))
+    max_walltime = to_int(VARSPACE['CALCULATE'].get('max_walltime'))
+    if max_walltime:
+        walltime = int(job_manager.walltime)
+        if walltime>max_walltime:
+            raise Exception('walltime of a single job (%d h) exceeds max_walltime (%d h)'%\
+                (walltime,max_walltime))
+        group_size = min(group_size or max_walltime//walltime,max_walltime//walltime)
+    groups = schedule.group_by_file(transitions,grouping,group_size)
+    # most expensive groups first (LPT)
+    order = schedule.check_order(VARSPACE['CALCULATE'].get('submit_order'),['file','cost'])
+    if order=='cost':
+        counts = schedule.read_level_counts(
+            os.path.join(VARSPACE['INIT']['root_energies'],'states.csv'))
+        costs = schedule.get_transition_costs(transitions,counts)
+        groups = sorted(groups,key=lambda group: -sum(costs[trans['name']] for trans in group))
     print('INITIAL DIR: %s'%os.getcwd())
-    for trans in transitions:
-        curdir = trans['name']
-        print('\nCD TO %s'%curdir)
+    print('%d TRANSITIONS IN %d GROUPS (%s)'%(len(transitions),len(groups),grouping))
+    nsubmitted = 0
+    for group in groups:
+        curdir = group[0]['name']
+        statuses = [check_job_status(trans['name'],trans['name'])[0] for trans in group]
+        if all(status==0 for status in statuses):
+            print('\nGROUP %s (%d): ALL DONE ===> SKIPPING SUBMIT'%(curdir,len(group)))
+            continue
+        if any(status in {1,3} for status in statuses):
+            print('\nGROUP %s (%d): STILL RUNNING ===> SKIPPING SUBMIT'%(curdir,len(group)))
+            continue
+        print('\nGROUP %s (%d): %s'%(curdir,len(group),' '.join(trans['name'] for trans in group[1:])))
+        save_group_job(job_manager,group,job_file)
         os.chdir(curdir)
-        status, message = check_job_status(curdir)
-        if status in {1,3}:
-            print(message+' ===> SKIPPING SUBMIT')
-        else:
-            subprocess.run(['sbatch','job_spectra.slurm']) # system-specific
-        print('CD TO UPPER LEVEL')
+        job_manager.submit_job() # system-specific
         os.chdir('..')
+        nsubmitted += 1
+    job_manager.finalize()
+    print('\nSUBMITTED: %d GROUPS'%nsubmitted)
+
+def submit(VARSPACE):
+    grouping = schedule.check_grouping(VARSPACE['CALCULATE'].get('group'))
+    if grouping!='none':
+        submit_groups(VARSPACE,'job.slurm',grouping)
+    else:
+        submit_jobs(VARSPACE,'job.slurm')
+
+def submit_spectra(VARSPACE):
+    submit_jobs(VARSPACE,'job_spectra.slurm')
         
 def clear(VARSPACE):
     raise NotImplementedError
@@ -931,14 +1105,14 @@ def clear(VARSPACE):
 def cancel(VARSPACE):   
     raise NotImplementedError
     
-def check(VARSPACE): # check the status of running jobs
+def check(VARSPACE,watch=None): # check the status of running jobs
     transitions = read_transitions(VARSPACE['CREATE']['transitions'])
+    names = [trans['name'] for trans in transitions]
+    ledger = VARSPACE['CREATE'].get('ledger')
+    if ledger and not os.path.isfile(ledger):
+        ledger = None
+    if watch:
+        print('WATCHING THE JOBs STATUS IN %s EVERY %d s'%(os.getcwd(),watch))
+        return monitor.watch(names,interval=watch,ledger=ledger)
     print('CHECKING THE JOBs STATUS IN %s'%os.getcwd())
-    for trans in transitions:
-        curdir = trans['name']
-        print('\nCD TO %s'%curdir)
-        os.chdir(curdir)
-        status, message = check_job_status(curdir)
-        print('Status %d: %s'%(status,message))
-        print('CD TO UPPER LEVEL')
-        os.chdir('..')
+    return monitor.check(names,ledger=ledger)
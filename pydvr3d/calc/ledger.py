@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import shutil
+import socket
+import sqlite3
+import argparse
+import subprocess
+from collections import OrderedDict
+
+"""
+CAMPAIGN JOB LEDGER
+
+Single SQLite file collecting the start/end timestamps, exit codes,
+hostnames and scheduler job ids of all the job runs of the campaign.
+Each run of the job script adds a new row, so the history of the
+resubmitted folders is kept. The job scripts call:
+
+    LEDGER_ID=$(python -m pydvr3d.calc.ledger ledger.db start jki_0100f)
+    ...
+    python -m pydvr3d.calc.ledger ledger.db end $LEDGER_ID $EXIT_CODE
+
+Rollback journal is used instead of WAL since the latter needs
+shared memory and does not work on network filesystems.
+Concurrent writers wait for the lock (see TIMEOUT).
+
+A job killed by the scheduler (walltime, OOM, scancel) never reaches
+the "end" call, so its run stays open. The open runs are reconciled
+with the scheduler before the status is used (see reconcile): runs
+whose Slurm job has ended (sacct) or whose local process is gone are
+closed with EXIT_CODE_KILLED.
+"""
+
+TIMEOUT = 600 # seconds to wait for the database lock
+
+EXIT_CODE_KILLED = -1 # run closed by reconcile
+
+# sacct states of the finished jobs
+SLURM_ENDED_STATES = {'COMPLETED','FAILED','TIMEOUT','OUT_OF_MEMORY','CANCELLED',
+    'NODE_FAIL','PREEMPTED','BOOT_FAIL','DEADLINE','REVOKED'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    jobid TEXT,
+    hostname TEXT,
+    start REAL,
+    end REAL,
+    exit_code INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_name ON jobs (name);
+"""
+
+COLUMNS = ['id','name','jobid','hostname','start','end','exit_code']
+
+def connect(ledger):
+    """ Open the ledger, create the tables if needed. """
+    conn = sqlite3.connect(ledger,timeout=TIMEOUT,isolation_level=None)
+    conn.executescript(SCHEMA)
+    return conn
+
+def execute(ledger,query,params=()):
+    """ Run a single writing query in an immediate transaction. """
+    conn = connect(ledger)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        cursor = conn.execute(query,params)
+        conn.execute('COMMIT')
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+def get_jobid():
+    if 'SLURM_ARRAY_JOB_ID' in os.environ:
+        return '%s_%s'%(os.environ['SLURM_ARRAY_JOB_ID'],
+            os.environ.get('SLURM_ARRAY_TASK_ID',''))
+    if 'SLURM_JOB_ID' in os.environ:
+        return os.environ['SLURM_JOB_ID']
+    return 'local-%d'%os.getppid()
+
+def start(ledger,name):
+    """ Register the job start, return the row id. """
+    return execute(ledger,
+        'INSERT INTO jobs (name,jobid,hostname,start) VALUES (?,?,?,?)',
+        (name,get_jobid(),socket.gethostname(),time.time()))
+
+def end(ledger,id,exit_code):
+    """ Register the job end. """
+    execute(ledger,'UPDATE jobs SET end=?, exit_code=? WHERE id=?',
+        (time.time(),exit_code,id))
+
+def get_last_runs(ledger,names=None):
+    """
+    Return ordered dict {name: row} with the latest run of each job.
+    If names are given, only these jobs are returned.
+    """
+    conn = connect(ledger)
+    try:
+        rows = conn.execute('SELECT %s FROM jobs WHERE id IN '
+            '(SELECT MAX(id) FROM jobs GROUP BY name) ORDER BY id'%','.join(COLUMNS))
+        runs = OrderedDict()
+        for row in rows:
+            run = dict(zip(COLUMNS,row))
+            runs[run['name']] = run
+    finally:
+        conn.close()
+    if names is not None:
+        runs = OrderedDict((name,runs[name]) for name in names if name in runs)
+    return runs
+
+def get_scheduler_states(jobids):
+    """ Return {jobid: state} from sacct, empty dict if sacct is not available. """
+    if not jobids or not shutil.which('sacct'):
+        return {}
+    result = subprocess.run(['sacct','-n','-X','-P','-o','JobID,State','-j',','.join(jobids)],
+        stdout=subprocess.PIPE,stderr=subprocess.DEVNULL,universal_newlines=True)
+    states = {}
+    for line in result.stdout.splitlines():
+        jobid,_,state = line.partition('|')
+        if state.strip():
+            states[jobid.strip()] = state.split()[0] # e.g. "CANCELLED by 1000"
+    return states
+
+def get_ended_state(run,states):
+    """
+    Scheduler state of the open run if its job is gone, None if
+    the job is still alive or this cannot be checked from here.
+    """
+    jobid = run['jobid'] or ''
+    if jobid.startswith('local-'):
+        if run['hostname']!=socket.gethostname():
+            return None
+        try:
+            os.kill(int(jobid[6:]),0)
+        except ProcessLookupError:
+            return 'GONE'
+        except (PermissionError,ValueError):
+            pass
+        return None
+    state = states.get(jobid)
+    return state if state in SLURM_ENDED_STATES else None
+
+def reconcile(ledger,runs=None):
+    """
+    Close the open runs whose jobs ended without the "end" call.
+    Runs (see get_last_runs) are updated in place.
+    Return list of (name, scheduler state) of the closed runs.
+    """
+    if runs is None:
+        runs = get_last_runs(ledger)
+    open_runs = [run for run in runs.values() if run['end'] is None]
+    states = get_scheduler_states([run['jobid'] for run in open_runs \
+        if run['jobid'] and not run['jobid'].startswith('local-')])
+    closed = []
+    for run in open_runs:
+        state = get_ended_state(run,states)
+        if state is None:
+            continue
+        now = time.time()
+        execute(ledger,'UPDATE jobs SET end=?, exit_code=? WHERE id=? AND end IS NULL',
+            (now,EXIT_CODE_KILLED,run['id']))
+        run['end'] = now; run['exit_code'] = EXIT_CODE_KILLED
+        closed.append((run['name'],state))
+    return closed
+
+def get_run_status(run):
+    """ Status code of the run (see monitor.STATUS_MESSAGES). """
+    if run is None:
+        return 2 # not launched
+    elif run['end'] is None:
+        return 1 # running
+    elif run['exit_code']:
+        return 5 # failed
+    else:
+        return 0 # done
+
+def get_failed(ledger):
+    """ Names of the jobs which failed (or were killed) in their latest run. """
+    runs = get_last_runs(ledger)
+    reconcile(ledger,runs)
+    return [name for name,run in runs.items() if get_run_status(run)==5]
+
+def get_command(ledger,action,*args):
+    """ Shell command calling the ledger from a job script. """
+    return ' '.join([sys.executable,'-m','pydvr3d.calc.ledger',
+        os.path.abspath(ledger),action]+list(args))
+
+def get_job_commands(ledger,steps):
+    """
+    Wrap the job steps with the ledger calls.
+    Exit code of the job is the last non-zero exit code of the steps.
+    """
+    commands = []
+    commands.append('LEDGER_ID=$(%s)'%get_command(ledger,'start','"$(basename "$PWD")"'))
+    commands.append('EXIT_CODE=0')
+    for step in steps:
+        commands.append('%s || EXIT_CODE=$?'%step)
+    commands.append(get_command(ledger,'end','"$LEDGER_ID"','$EXIT_CODE'))
+    return commands
+
+def report(ledger):
+    """ Print summary on the latest runs of all jobs. """
+    runs = get_last_runs(ledger)
+    counts = OrderedDict([('done',0),('running',0),('failed',0)])
+    walltimes = []
+    for run in runs.values():
+        status = get_run_status(run)
+        counts[{0:'done',1:'running',5:'failed'}[status]] += 1
+        if status==0:
+            walltimes.append(run['end']-run['start'])
+    print('%d jobs in %s (%s)'%(len(runs),ledger,
+        ', '.join(['%s: %d'%(key,counts[key]) for key in counts])))
+    if walltimes:
+        print('wall time, hours: mean %.2f, max %.2f, total %.2f'%(
+            sum(walltimes)/len(walltimes)/3600,max(walltimes)/3600,
+            sum(walltimes)/3600))
+
+def main():
+    parser = argparse.ArgumentParser(description='Campaign job ledger.')
+    parser.add_argument('ledger')
+    parser.add_argument('action',choices=['start','end','failed','reconcile','report'])
+    parser.add_argument('args',nargs='*')
+    args = parser.parse_args()
+    if args.action=='start':
+        print(start(args.ledger,args.args[0]))
+    elif args.action=='end':
+        if not args.args[0]: # "start" failed, the job itself should not fail because of that
+            print('ledger: no run id, the end of the job is not recorded',file=sys.stderr)
+            return
+        end(args.ledger,int(args.args[0]),int(args.args[1]))
+    elif args.action=='failed':
+        for name in get_failed(args.ledger):
+            print(name)
+    elif args.action=='reconcile':
+        for name,state in reconcile(args.ledger):
+            print('%s: %s'%(name,state))
+    elif args.action=='report':
+        reconcile(args.ledger)
+        report(args.ledger)
+
+if __name__=='__main__':
+    main()
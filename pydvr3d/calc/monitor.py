@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+import os
+import time
+from collections import OrderedDict
+
+from . import ledger as job_ledger
+
+LABEL_DONE = '===DONE==='
+LABEL_RUNNING = '===RUNNING==='
+
+# Status codes are the same as in check_job_status,
+# plus the code for the absent job folders.
+STATUS_MESSAGES = OrderedDict([
+    (0, 'JOB IN %s IS DONE'),
+    (1, 'JOB IN %s STILL RUNNING'),
+    (2, 'JOB IN %s HAS NOT BEEN LAUNCHED?'),
+    (3, 'ERROR: JOB IN %s HAS BOTH LABELS (SOMETHING IS WRONG)'),
+    (4, 'ERROR: FOLDER %s DOES NOT EXIST'),
+    (5, 'ERROR: JOB IN %s FAILED (NON-ZERO EXIT CODE IN THE LEDGER)'),
+])
+
+STATUS_NAMES = OrderedDict([
+    (0, 'done'),
+    (1, 'running'),
+    (2, 'not launched'),
+    (3, 'both labels'),
+    (4, 'missing'),
+    (5, 'failed'),
+])
+
+def get_folder_status(path):
+    """
+    Get job status from the labels in the folder.
+    The working dir is not changed. A single directory listing is
+    used instead of stat-ing each label, which is cheaper on network
+    filesystems (no file size requests to the storage servers).
+    """
+    try:
+        with os.scandir(path) as entries:
+            names = {entry.name for entry in entries}
+    except (FileNotFoundError,NotADirectoryError):
+        return 4
+    flag_done = LABEL_DONE in names
+    flag_running = LABEL_RUNNING in names
+    if flag_done and not flag_running:
+        return 0
+    elif not flag_done and flag_running:
+        return 1
+    elif not flag_done and not flag_running:
+        return 2
+    else:
+        return 3
+
+def get_status(names,root='./',table=None,ledger=None):
+    """
+    Return ordered status table {folder name: status code}.
+    If the previous table is supplied, the folders which
+    are already DONE are not probed again.
+    If the ledger file is supplied, the status is taken
+    from there instead of the job folders (killed jobs are
+    reconciled with the scheduler, see ledger.reconcile).
+    """
+    if ledger:
+        runs = job_ledger.get_last_runs(ledger,names)
+        job_ledger.reconcile(ledger,runs)
+        return OrderedDict((name,job_ledger.get_run_status(runs.get(name))) \
+            for name in names)
+    status_table = OrderedDict()
+    for name in names:
+        if table and table.get(name)==0:
+            status_table[name] = 0
+        else:
+            status_table[name] = get_folder_status(os.path.join(root,name))
+    return status_table
+
+def count_status(table):
+    """ Return number of folders for each status code. """
+    counts = OrderedDict((status,0) for status in STATUS_NAMES)
+    for status in table.values():
+        counts[status] += 1
+    return counts
+
+def format_counts(counts):
+    return ', '.join(['%s: %d'%(STATUS_NAMES[status],counts[status]) \
+        for status in counts if counts[status]])
+
+class Monitor:
+    """
+    Keeps the status table of the campaign in memory
+    and tracks the throughput of the finished jobs.
+    """
+
+    def __init__(self,names,root='./',ledger=None):
+        self.names = list(names)
+        self.root = root
+        self.ledger = ledger
+        self.table = None
+        self.history = [] # (timestamp, number of done jobs)
+
+    def update(self):
+        self.table = get_status(self.names,self.root,self.table,self.ledger)
+        self.counts = count_status(self.table)
+        self.history.append((time.time(),self.counts[0]))
+        return self.table
+
+    def get_rate(self):
+        """ Finished jobs per hour since the first update. """
+        if len(self.history)<2:
+            return None
+        t0,ndone0 = self.history[0]
+        t1,ndone1 = self.history[-1]
+        if t1<=t0:
+            return None
+        return (ndone1-ndone0)/(t1-t0)*3600
+
+    def get_eta(self):
+        """ Estimated time left in hours. """
+        rate = self.get_rate()
+        if not rate:
+            return None
+        nleft = self.counts[1] + self.counts[2]
+        return nleft/rate
+
+    def is_finished(self):
+        return self.counts[1]==0 and self.counts[2]==0
+
+    def report(self):
+        rate = self.get_rate()
+        eta = self.get_eta()
+        return '%s: %d jobs (%s); rate: %s; ETA: %s'%(
+            time.strftime('%Y-%m-%d %H:%M:%S'),
+            len(self.names),format_counts(self.counts),
+            '%.1f jobs/hour'%rate if rate is not None else 'n/a',
+            '%.1f hours'%eta if eta is not None else 'n/a')
+
+def check(names,root='./',ledger=None):
+    """ Print status of each job folder and the summary. """
+    table = get_status(names,root,ledger=ledger)
+    for name,status in table.items():
+        print('Status %d: %s'%(status,STATUS_MESSAGES[status]%name))
+    print('\nSUMMARY: %d jobs (%s)'%(len(table),format_counts(count_status(table))))
+    return table
+
+def watch(names,root='./',interval=60,ledger=None):
+    """
+    Poll the job folders until all jobs are finished
+    (or interrupted by Ctrl-C) and print the summary on each pass.
+    Polling is used since inotify does not see the label
+    changes made by the compute nodes on network filesystems.
+    """
+    monitor = Monitor(names,root,ledger)
+    try:
+        while True:
+            monitor.update()
+            print(monitor.report())
+            if monitor.is_finished():
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    return monitor.table
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import socket
+import sqlite3
+import argparse
+import subprocess
+from collections import OrderedDict
+
+"""
+PILOT JOBS
+
+Job folders are put into a shared SQLite queue. Each pilot (a long-lived
+Slurm allocation or a local process) runs a worker which pulls the folders
+from the queue and runs their job scripts in nslots concurrent slots,
+until the queue is empty:
+
+    python -m pydvr3d.calc.pilot pilot_queue.db work --nslots 4 --ncores 2
+
+Folders are claimed in an immediate transaction, so each folder is taken
+by exactly one worker. The job scripts put the DONE/RUNNING labels as usual;
+the queue keeps the state and the exit code of each folder:
+
+    pending -> running -> done | failed
+
+Folders left in the running state by the killed pilots
+can be put back to the queue with the "requeue" action.
+"""
+
+TIMEOUT = 600 # seconds to wait for the database lock
+POLL_INTERVAL = 1 # seconds between the checks of the running slots
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL UNIQUE,
+    job_file TEXT NOT NULL,
+    state TEXT NOT NULL,
+    worker TEXT,
+    start REAL,
+    end REAL,
+    exit_code INTEGER
+);
+CREATE INDEX IF NOT EXISTS queue_state ON queue (state);
+"""
+
+STATES = ['pending','running','done','failed']
+
+def connect(queue):
+    """ Open the queue, create the tables if needed. """
+    conn = sqlite3.connect(queue,timeout=TIMEOUT,isolation_level=None)
+    conn.executescript(SCHEMA)
+    return conn
+
+def put(queue,paths,job_file):
+    """
+    Add folders to the queue. Folders which are already
+    in the queue are set to pending unless they are running.
+    """
+    conn = connect(queue)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        # INSERT OR IGNORE + UPDATE instead of the upsert (needs SQLite 3.24+)
+        for path in paths:
+            path = os.path.abspath(path)
+            conn.execute('INSERT OR IGNORE INTO queue (path,job_file,state) VALUES (?,?,?)',
+                (path,job_file,'pending'))
+            conn.execute('UPDATE queue SET job_file=?, state=?, worker=NULL, start=NULL, '
+                'end=NULL, exit_code=NULL WHERE path=? AND state!=\'running\'',
+                (job_file,'pending',path))
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+
+def claim(queue,worker):
+    """ Take the next pending folder, return (id,path,job_file) or None. """
+    conn = connect(queue)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute('SELECT id,path,job_file FROM queue '
+            'WHERE state=\'pending\' ORDER BY id LIMIT 1').fetchone()
+        if row:
+            conn.execute('UPDATE queue SET state=\'running\', worker=?, start=? WHERE id=?',
+                (worker,time.time(),row[0]))
+        conn.execute('COMMIT')
+        return row
+    finally:
+        conn.close()
+
+def finish(queue,id,exit_code):
+    conn = connect(queue)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('UPDATE queue SET state=?, end=?, exit_code=? WHERE id=?',
+            ('failed' if exit_code else 'done',time.time(),exit_code,id))
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+
+def requeue(queue,states=('running','failed')):
+    """ Put the running (killed pilots) and failed folders back to the queue. """
+    conn = connect(queue)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        cursor = conn.execute('UPDATE queue SET state=\'pending\', worker=NULL, '
+            'start=NULL, end=NULL, exit_code=NULL WHERE state IN (%s)'%\
+            ','.join('?'*len(states)),tuple(states))
+        conn.execute('COMMIT')
+        return cursor.rowcount
+    finally:
+        conn.close()
+
+def get_counts(queue):
+    """ Number of folders in each state. """
+    conn = connect(queue)
+    try:
+        counts = OrderedDict((state,0) for state in STATES)
+        for state,count in conn.execute('SELECT state,COUNT(*) FROM queue GROUP BY state'):
+            counts[state] = count
+        return counts
+    finally:
+        conn.close()
+
+def get_worker_name():
+    jobid = os.environ.get('SLURM_JOB_ID','local')
+    return '%s:%s:%d'%(socket.gethostname(),jobid,os.getpid())
+
+class Worker:
+    """
+    Pulls the folders from the queue and runs their
+    job scripts in at most nslots concurrent slots.
+    """
+
+    def __init__(self,queue,nslots=1,ncores=None,name=None):
+        self.queue = queue
+        self.nslots = nslots
+        self.ncores = ncores # OMP_NUM_THREADS for each slot, None => unchanged
+        self.name = name or get_worker_name()
+        self.running = [] # (id,path,process,logfile)
+        self.nfinished = 0
+        self.nfailed = 0
+
+    def launch(self,id,path,job_file):
+        env = dict(os.environ)
+        if self.ncores:
+            env['OMP_NUM_THREADS'] = str(self.ncores)
+        log = open(os.path.join(path,'slurm-pilot-%d.out'%int(time.time())),'w')
+        proc = subprocess.Popen(os.path.join('./',job_file),
+            cwd=path,env=env,stdout=log,stderr=subprocess.STDOUT)
+        self.running.append((id,path,proc,log))
+        print('%s: LAUNCHED %s'%(self.name,path),flush=True)
+
+    def reap(self):
+        """ Register the finished slots in the queue. """
+        running = []
+        for id,path,proc,log in self.running:
+            if proc.poll() is None:
+                running.append((id,path,proc,log))
+                continue
+            log.close()
+            finish(self.queue,id,proc.returncode)
+            self.nfinished += 1
+            if proc.returncode:
+                self.nfailed += 1
+            print('%s: FINISHED %s (exit code %d)'%(self.name,path,proc.returncode),flush=True)
+        self.running = running
+
+    def run(self):
+        """ Work until the queue is empty and all slots are finished. """
+        empty = False
+        while True:
+            self.reap()
+            while not empty and len(self.running)<self.nslots:
+                task = claim(self.queue,self.name)
+                if task is None:
+                    empty = True
+                    break
+                self.launch(*task)
+            if empty and not self.running:
+                break
+            time.sleep(POLL_INTERVAL)
+        print('%s: QUEUE IS EMPTY, %d JOBS FINISHED, %d FAILED'%\
+            (self.name,self.nfinished,self.nfailed),flush=True)
+
+def get_command(queue,nslots,ncores=None):
+    """ Shell command starting the worker from a pilot script. """
+    command = [sys.executable,'-m','pydvr3d.calc.pilot',
+        os.path.abspath(queue),'work','--nslots',str(nslots)]
+    if ncores:
+        command += ['--ncores',str(ncores)]
+    return command
+
+def main():
+    parser = argparse.ArgumentParser(description='Pilot job queue.')
+    parser.add_argument('queue')
+    parser.add_argument('action',choices=['work','status','requeue'])
+    parser.add_argument('--nslots',type=int,default=1)
+    parser.add_argument('--ncores',type=int,default=None)
+    args = parser.parse_args()
+    if args.action=='work':
+        Worker(args.queue,args.nslots,args.ncores).run()
+    elif args.action=='status':
+        counts = get_counts(args.queue)
+        print('%d folders in %s (%s)'%(sum(counts.values()),args.queue,
+            ', '.join(['%s: %d'%(state,counts[state]) for state in counts])))
+    elif args.action=='requeue':
+        print('%d folders put back to the queue'%requeue(args.queue))
+
+if __name__=='__main__':
+    main()
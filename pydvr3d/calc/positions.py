@@ -6,8 +6,19 @@ import sys
 import stat
 import argparse
 import configparser as ConfigParser # python 3
+import time
 import shutil
 import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from . import monitor
+from . import ledger as job_ledger
+from . import pilot
+from . import schedule
+from . import archive as fort_archive
+from .transitions import get_wavefunction_files
+from .estimate import get_estimator, get_block_basis, get_block_costs
 
 LABEL_DONE = '===DONE==='
 LABEL_RUNNING = '===RUNNING==='
@@ -218,6 +229,14 @@ class JobManager:
 
     def submit_job(self,dirname):
         raise NotImplementedError
+
+    def poll(self):
+        """ Called regularly by the campaign loop, must not block. """
+        pass
+
+    def finalize(self):
+        """ Called once after all the jobs have been submitted. """
+        pass
     
     def save_job(self,commands=[],dirname='./'):
         open_dir(dirname)
@@ -267,13 +286,16 @@ class Slurm(JobManager):
             PARTITION=self.partition)
                
         if self.ncores:
-            commands = ['export OMP_NUM_THREADS=%d\n'%self.ncores] \
-                + commands
+            commands = [self.get_omp_export(),
+                'echo OMP_NUM_THREADS=$OMP_NUM_THREADS\n'] + commands
                
         for command in commands:
             body += '\n' + command
             
         return body
+        
+    def get_omp_export(self):
+        return 'export OMP_NUM_THREADS=%d\n'%self.ncores
                 
     #def submit_job(self,dirname):
     def submit_job(self):
@@ -282,6 +304,152 @@ class Slurm(JobManager):
         subprocess.run(['sbatch',self.job_file])
         #os.chdir(curdir)
 
+class SlurmArray(Slurm):
+    """
+    Collects the submitted job folders and starts them as Slurm
+    job arrays: task index N runs the job script from the folder
+    given in the line N+1 of the task list file.
+    Arrays larger than max_array_size are split into chunks.
+    """
+
+    def __init__(self,title,job_file='job.sh'):
+        super().__init__(title,job_file)
+
+        # Array script and the list of folders, both in the project root.
+        self.array_file = 'job_array.sh'
+        self.task_file = 'job_array.list'
+
+        # Maximal number of simultaneously running tasks (%N), None => no limit.
+        self.throttle = None
+
+        # MaxArraySize from slurm.conf (array indices are 0..max_array_size-1).
+        self.max_array_size = 1001
+
+        # Folders collected by submit_job.
+        self.folders = []
+
+    def get_array_job(self):
+        commands = [
+            'OFFSET=${1:-0}',
+            'TASK=$((SLURM_ARRAY_TASK_ID+OFFSET+1))',
+            'DIR=$(sed -n "${TASK}p" %s)'%self.task_file,
+            'cd "$DIR" || exit 1',
+            'exec > slurm-${SLURM_ARRAY_JOB_ID}_${SLURM_ARRAY_TASK_ID}.out 2>&1',
+            './%s'%self.job_file,
+        ]
+        return self.get_job(commands)
+
+    def get_chunks(self):
+        """ Split the task list to (offset,size) chunks. """
+        nfolders = len(self.folders)
+        return [(offset,min(self.max_array_size,nfolders-offset)) \
+            for offset in range(0,nfolders,self.max_array_size)]
+
+    def submit_job(self):
+        self.folders.append(os.getcwd())
+
+    def finalize(self):
+        if not self.folders:
+            print('NOTHING TO SUBMIT')
+            return
+        with open(self.task_file,'w') as f:
+            for folder in self.folders:
+                f.write(folder+'\n')
+        with open(self.array_file,'w') as f:
+            f.write(self.get_array_job())
+        make_executable(self.array_file)
+        jobid = None
+        for offset,size in self.get_chunks():
+            array = '--array=0-%d'%(size-1)
+            if self.throttle:
+                array += '%%%d'%self.throttle
+            command = ['sbatch',array]
+            # Chain the chunks to keep the throttle global.
+            if self.throttle and jobid:
+                command.append('--dependency=afterany:%s'%jobid)
+            command += [self.array_file,str(offset)]
+            result = subprocess.run(command,stdout=subprocess.PIPE,
+                universal_newlines=True)
+            print(result.stdout.strip())
+            lookup = re.search('Submitted batch job (\d+)',result.stdout)
+            jobid = lookup.group(1) if lookup else None
+        print('%d FOLDERS SUBMITTED AS %d ARRAY(S), SEE %s'%\
+            (len(self.folders),len(self.get_chunks()),self.task_file))
+
+class SlurmPack(Slurm):
+    """
+    Packs the submitted job folders into multi-node allocations:
+    each allocation runs pack_size folders as job steps
+    (srun --exclusive -n1 -c ncores), at most ntasks of them at once.
+    The steps which do not fit wait inside the allocation
+    until the resources are freed by the finished ones.
+    """
+
+    def __init__(self,title,job_file='job.sh'):
+        super().__init__(title,job_file)
+
+        # Pack scripts are saved to the project root: job_pack_000.sh, ...
+        self.pack_file = 'job_pack_%03d.sh'
+
+        # Number of simultaneous job steps in the allocation (None => nnodes).
+        self.ntasks = None
+
+        # Number of folders in one allocation (None => ntasks).
+        self.pack_size = None
+
+        # Folders collected by submit_job.
+        self.folders = []
+
+    def get_ntasks(self):
+        return self.ntasks or self.nnodes
+
+    def get_pack_size(self):
+        return self.pack_size or self.get_ntasks()
+
+    def get_packs(self):
+        pack_size = self.get_pack_size()
+        return [self.folders[i:i+pack_size] for i in range(0,len(self.folders),pack_size)]
+
+    def get_pack_job(self,folders):
+        ncores = self.ncores or 1
+        body = ''.join(
+            [\
+            '#!/bin/sh\n\n',
+            '#SBATCH -J {JOBNAME}\n',
+            '#SBATCH -N {NNODES}\n',
+            '#SBATCH -n {NTASKS}\n',
+            '#SBATCH -c {NCORES}\n',
+            '#SBATCH --mem-per-cpu {MEMORY}\n',
+            '#SBATCH --time={WALLTIME}:00:00\n',
+            '#SBATCH --partition {PARTITION}\n'
+            ]
+        )\
+        .format(JOBNAME=self.title,NNODES=self.nnodes,NTASKS=self.get_ntasks(),
+            NCORES=ncores,MEMORY=int(self.memory)//ncores,WALLTIME=self.walltime,
+            PARTITION=self.partition)
+        for folder in folders:
+            body += '\n(cd "%s" && srun --exclusive -N1 -n1 -c %d ./%s '\
+                '> slurm-pack-${SLURM_JOB_ID}.out 2>&1) &'%(folder,ncores,self.job_file)
+        body += '\nwait\n'
+        return body
+
+    def submit_job(self):
+        self.folders.append(os.getcwd())
+
+    def finalize(self):
+        if not self.folders:
+            print('NOTHING TO SUBMIT')
+            return
+        packs = self.get_packs()
+        for i,folders in enumerate(packs):
+            pack_file = self.pack_file%i
+            with open(pack_file,'w') as f:
+                f.write(self.get_pack_job(folders))
+            make_executable(pack_file)
+            subprocess.run(['sbatch',pack_file])
+        print('%d FOLDERS SUBMITTED IN %d PACK(S) OF %d JOB STEPS AT ONCE'%\
+            (len(self.folders),len(packs),self.get_ntasks()))
+
 class Shell(Slurm):
     """ Calling jobs through shell scripts (Linux)."""
     
@@ -291,6 +459,159 @@ class Shell(Slurm):
         #os.chdir(dirname)
         subprocess.run(os.path.join('./',self.job_file))
         #os.chdir(curdir)
+
+class LocalPool(Shell):
+    """ 
+    Running several jobs at once on the local machine (Linux).
+    At most nslots jobs are running simultaneously, the machine 
+    cores are split evenly between them via OMP_NUM_THREADS.
+    Submission does not block: the jobs are queued and launched
+    as the slots are freed (see poll), finalize waits for all of them.
+    The job output goes to slurm-local-*.out in the job folder.
+    """
+    
+    def __init__(self,title,job_file='job.sh'):
+        super().__init__(title,job_file)
+        
+        # Number of simultaneously running jobs (None => ncores_total/ncores).
+        self.nslots = None
+        
+        # Total number of cores shared between the jobs.
+        self.ncores_total = os.cpu_count()
+        
+        # Job folders waiting for a free slot.
+        self.queued = []
+        
+        # Currently running jobs: (dirname,process,logfile).
+        self.running = []
+        
+        # Finished jobs with non-zero exit codes: (dirname,returncode).
+        self.failed = []
+        
+    def get_nslots(self):
+        if self.nslots:
+            return self.nslots
+        return max(1,self.ncores_total//(self.ncores or 1))
+        
+    def get_nthreads(self):
+        return max(1,self.ncores_total//self.get_nslots())
+        
+    def get_omp_export(self):
+        # OMP_NUM_THREADS is set by the pool at the launch time;
+        # fall back to ncores when the script is started by hand.
+        return 'export OMP_NUM_THREADS=${OMP_NUM_THREADS:-%d}\n'%self.ncores
+        
+    def reap(self):
+        """ Register the finished jobs. """
+        running = []
+        for dirname,proc,log in self.running:
+            if proc.poll() is None:
+                running.append((dirname,proc,log))
+                continue
+            log.close()
+            if proc.returncode:
+                self.failed.append((dirname,proc.returncode))
+            print('FINISHED %s (exit code %d)'%(dirname,proc.returncode))
+        self.running = running
+        
+    def launch(self,dirname):
+        nthreads = self.get_nthreads()
+        env = dict(os.environ,OMP_NUM_THREADS=str(nthreads))
+        log = open(os.path.join(dirname,'slurm-local-%d.out'%int(time.time())),'w')
+        proc = subprocess.Popen(os.path.join('./',self.job_file),
+            cwd=dirname,env=env,stdout=log,stderr=subprocess.STDOUT)
+        self.running.append((dirname,proc,log))
+        print('LAUNCHED %s WITH %d THREADS'%(dirname,nthreads))
+        
+    def poll(self):
+        """ Register the finished jobs, launch the queued ones on the free slots. """
+        self.reap()
+        while self.queued and len(self.running)<self.get_nslots():
+            self.launch(self.queued.pop(0))
+        
+    def wait(self,nmax=0):
+        """ Wait until all queued jobs are launched and at most nmax jobs are running. """
+        while True:
+            self.poll()
+            if not self.queued and len(self.running)<=nmax:
+                break
+            time.sleep(1)
+            
+    def submit_job(self):
+        self.queued.append(os.getcwd())
+        self.poll()
+        
+    def finalize(self):
+        print('\nWAITING FOR %d RUNNING AND %d QUEUED JOBS'%(len(self.running),len(self.queued)))
+        self.wait(0)
+        for dirname,returncode in self.failed:
+            print('ERROR: JOB IN %s EXITED WITH CODE %d'%(dirname,returncode))
+
+class Pilot(Slurm):
+    """
+    Puts the submitted job folders into the shared queue (see pilot.py)
+    and starts npilots long-lived Slurm allocations, each running
+    a worker which drains the queue with nslots concurrent jobs.
+    With local=True the workers are started as local processes instead.
+    """
+    
+    def __init__(self,title,job_file='job.sh'):
+        super().__init__(title,job_file)
+        
+        # Queue and the pilot script, both in the project root.
+        self.queue = 'pilot_queue.db'
+        self.pilot_file = 'job_pilot.sh'
+        
+        # Number of pilots and simultaneously running jobs in each of them.
+        self.npilots = 1
+        self.nslots = 1
+        
+        # Run the pilots as local processes (for testing).
+        self.local = False
+        
+        # Folders collected by submit_job.
+        self.folders = []
+        
+    def get_omp_export(self):
+        # OMP_NUM_THREADS is set by the worker at the launch time.
+        return 'export OMP_NUM_THREADS=${OMP_NUM_THREADS:-%d}\n'%self.ncores
+        
+    def get_pilot_job(self):
+        """ Pilot script: the allocation holds nslots jobs at once. """
+        if not self.ncores:
+            raise Exception('Pilot job manager needs the number of cores per job (CALCULATE.ncores)')
+        pilot_manager = Slurm(self.title,self.pilot_file)
+        pilot_manager.nnodes = self.nnodes
+        pilot_manager.ncores = self.ncores*self.nslots
+        pilot_manager.memory = int(self.memory)*self.nslots
+        pilot_manager.walltime = self.walltime
+        pilot_manager.partition = self.partition
+        command = ' '.join(pilot.get_command(self.queue,self.nslots,self.ncores))
+        return pilot_manager.get_job([command])
+        
+    def submit_job(self):
+        self.folders.append(os.getcwd())
+        
+    def finalize(self):
+        if not self.folders:
+            print('NOTHING TO SUBMIT')
+            return
+        pilot.put(self.queue,self.folders,self.job_file)
+        print('%d FOLDERS PUT TO THE QUEUE %s'%(len(self.folders),self.queue))
+        if self.local:
+            workers = [subprocess.Popen(pilot.get_command(self.queue,self.nslots,self.ncores)) \
+                for _ in range(self.npilots)]
+            print('WAITING FOR %d LOCAL PILOTS'%len(workers))
+            for worker in workers:
+                worker.wait()
+            counts = pilot.get_counts(self.queue)
+            print('QUEUE: %s'%', '.join(['%s: %d'%(state,counts[state]) for state in counts]))
+            return
+        with open(self.pilot_file,'w') as f:
+            f.write(self.get_pilot_job())
+        make_executable(self.pilot_file)
+        for _ in range(self.npilots):
+            subprocess.run(['sbatch',self.pilot_file])
     
 def get_job_manager(jobman,jobscript):
     jobman_ = jobman.lower()
@@ -298,6 +619,18 @@ def get_job_manager(jobman,jobscript):
         return Slurm(title='job',job_file=jobscript)
     elif jobman_ in ['shell']:
         return Shell(title='job',job_file=jobscript)
+    elif jobman_ in ['localpool','local']:
+        return LocalPool(title='job',job_file=jobscript)
+    elif jobman_ in ['slurmarray','array']:
+        return SlurmArray(title='job',job_file=jobscript)
+    elif jobman_ in ['slurmpack','pack']:
+        return SlurmPack(title='job',job_file=jobscript)
+    elif jobman_ in ['pilot']:
+        return Pilot(title='job',job_file=jobscript)
+    elif jobman_ in ['pilotlocal']:
+        job_manager = Pilot(title='job',job_file=jobscript)
+        job_manager.local = True
+        return job_manager
     else:
         raise Exception('unknown mode "%s"'%jobman)
 
@@ -525,8 +858,10 @@ class DVR3DRJZ:
         'echo running dvr3drjz ...\n\n' + \
         self.exefile + ' < ' + \
         self.input_file + ' > ' + \
-        self.output_file + '\n\n' + \
-        'echo dvr3drjz ok'
+        self.output_file + '\n' + \
+        'EXIT_CODE=$?' + '\n\n' + \
+        'echo dvr3drjz ok' + '\n' + \
+        'exit $EXIT_CODE'
         return text
         
     def save_starter(self,dirname='./'):
@@ -679,8 +1014,10 @@ class ROTLEV3B:
         'ln -s fort.26 fort.4' + '\n\n' + \
         self.exefile + ' < ' + \
         self.input_file + ' > ' + \
-        self.output_file + '\n\n' + \
-        'echo %s ok'%self.stem
+        self.output_file + '\n' + \
+        'EXIT_CODE=$?' + '\n\n' + \
+        'echo %s ok'%self.stem + '\n' + \
+        'exit $EXIT_CODE'
         return text
         
     def save_starter(self,dirname='./'):
@@ -761,6 +1098,14 @@ class ROVIB_STATE():
             self.dvr3drjz.jrot,
             self.dvr3drjz.kmin,
             self.dvr3drjz.ipar,'f'))
+            
+        # Campaign job ledger (None => not used).
+        self.ledger = argv.get('ledger',None)
+        
+        # Node-local scratch directory (None => run in the block folder)
+        # and the files copied back besides the outputs and wavefunctions.
+        self.scratch = argv.get('scratch',None)
+        self.scratch_keep = argv.get('scratch_keep',['fort.26'])
 
     #def positions_subdir_name(OPTIONS):
     #    jrot = self.dvr3drjz.jrot
@@ -768,13 +1113,65 @@ class ROVIB_STATE():
     #    ipar = self.dvr3drjz.ipar
     #    return 'J=%d_kmin=%d_ipar=%d'%[jrot,kmin,ipar]
                    
+    def get_programs(self):
+        programs = [self.dvr3drjz]
+        if self.dvr3drjz.jrot>0:
+            programs.append(self.rotlev)
+        return programs
+        
+    def get_scratch_files(self):
+        """ Files copied back from the scratch to the block folder. """
+        files = [program.output_file for program in self.get_programs()] + ['energies.out'] + \
+            get_wavefunction_files(self.dvr3drjz.jrot,self.dvr3drjz.kmin) + self.scratch_keep
+        return sorted(set(files),key=files.index)
+        
+    def get_scratch_setup(self):
+        """
+        Create the scratch copy of the block folder: $SCRATCH/<block> with
+        the inputs and starters, the files referenced as ../<file> 
+        (executables, PES parameters) are linked to $SCRATCH/<file>.
+        """
+        files = []; links = []
+        for program in self.get_programs():
+            files += [program.input_file,program.starter_file]
+            for path in [program.exefile,getattr(program,'parfile',None)]:
+                if path and path.startswith('../') and path not in links:
+                    links.append(path)
+        files.append('pes.par') # dummy written by DVR3DRJZ.save_starter
+        commands = []
+        commands.append('SCRATCH=$(mktemp -d %s/pydvr3d.XXXXXX) || exit 1'%self.scratch)
+        commands.append('WORKDIR=$SCRATCH/$(basename "$PWD")')
+        commands.append('mkdir "$WORKDIR" && cp -p %s "$WORKDIR"'%' '.join(files))
+        for path in links:
+            target = path[3:]
+            if os.path.dirname(target):
+                commands.append('mkdir -p "$SCRATCH/%s"'%os.path.dirname(target))
+            commands.append('ln -s "$PWD/%s" "$SCRATCH/%s"'%(path,target))
+        return commands
+        
+    def get_scratch_teardown(self):
+        """ Copy back the needed files (also after a failure) and drop the scratch. """
+        return [
+            'for FILE in %s; do'%' '.join(self.get_scratch_files()),
+            '    if [ -f "$WORKDIR/$FILE" ]; then cp -p "$WORKDIR/$FILE" .; fi',
+            'done',
+            'rm -rf "$SCRATCH"',
+        ]
+                   
     def get_job(self):        
         commands = []
         commands.append('rm -f %s'%LABEL_DONE)
         commands.append('touch %s'%LABEL_RUNNING)
-        commands.append('time ./' + self.dvr3drjz.starter_file)
-        if self.dvr3drjz.jrot>0:
-            commands.append('time ./' + self.rotlev.starter_file)
+        steps = ['time ./' + program.starter_file for program in self.get_programs()]
+        if self.scratch:
+            commands += self.get_scratch_setup()
+            steps = ['(cd "$WORKDIR" && %s)'%step for step in steps]
+        if self.ledger:
+            steps = job_ledger.get_job_commands(self.ledger,steps)
+        if self.scratch: # copy back before the ledger marks the run finished
+            at = len(steps)-1 if self.ledger else len(steps)
+            steps[at:at] = self.get_scratch_teardown()
+        commands += steps
         commands.append('rm -f %s'%LABEL_RUNNING)
         commands.append('touch %s'%LABEL_DONE)
         return self.job_manager.get_job(commands)
@@ -911,6 +1308,12 @@ def get_rovib_state(VARSPACE):
     # Set up job details.
     ncores = to_int( VARSPACE['CALCULATE']['ncores'] )
     nnodes = to_int( VARSPACE['CALCULATE']['nnodes'] )
+    nslots = to_int( VARSPACE['CALCULATE']['nslots'] )
+    array_throttle = to_int( VARSPACE['CALCULATE']['array_throttle'] )
+    array_max_size = to_int( VARSPACE['CALCULATE']['array_max_size'] )
+    npilots = to_int( VARSPACE['CALCULATE']['npilots'] )
+    pack_ntasks = to_int( VARSPACE['CALCULATE']['pack_ntasks'] )
+    pack_size = to_int( VARSPACE['CALCULATE']['pack_size'] )
     memory = VARSPACE['CALCULATE']['memory']
     walltime = VARSPACE['CALCULATE']['walltime']
         
@@ -989,6 +1392,25 @@ def get_rovib_state(VARSPACE):
     rovib_state.job_manager.nnodes = nnodes
     rovib_state.job_manager.memory = memory
     rovib_state.job_manager.walltime = walltime  
+    ledger = VARSPACE['CREATE']['ledger']
+    if ledger:
+        rovib_state.ledger = os.path.abspath(ledger)
+    if VARSPACE['CALCULATE']['scratch']:
+        rovib_state.scratch = VARSPACE['CALCULATE']['scratch']
+        rovib_state.scratch_keep = [file.strip() for file in \
+            (VARSPACE['CALCULATE']['scratch_keep'] or '').split(',') if file.strip()]
+    if isinstance(rovib_state.job_manager,LocalPool):
+        rovib_state.job_manager.nslots = nslots
+    if isinstance(rovib_state.job_manager,SlurmPack):
+        rovib_state.job_manager.ntasks = pack_ntasks
+        rovib_state.job_manager.pack_size = pack_size
+    if isinstance(rovib_state.job_manager,Pilot):
+        rovib_state.job_manager.nslots = nslots or 1
+        rovib_state.job_manager.npilots = npilots or 1
+    if isinstance(rovib_state.job_manager,SlurmArray):
+        rovib_state.job_manager.throttle = array_throttle
+        if array_max_size:
+            rovib_state.job_manager.max_array_size = array_max_size
     
     return rovib_state
     
@@ -1246,6 +1668,15 @@ def create(VARSPACE):
     summary_file = VARSPACE['CREATE']['summary']
     fout = open(summary_file,'w')
     
+    # per-block memory, walltime and cores
+    estimate = VARSPACE['CALCULATE']['estimate']
+    if estimate:
+        estimator = get_estimator(VARSPACE,rovib_state,states)
+        if isinstance(rovib_state.job_manager,(SlurmArray,SlurmPack,Pilot)):
+            print('WARNING: %s submits the blocks with one allocation header from CALCULATE, '
+                'the estimates go to the job.sh headers only and are not used by Slurm'%\
+                rovib_state.job_manager.__class__.__name__)
+    
     for state in states:        
         # actualize jrot, kmin, and ipar
         dirname = state['name']
@@ -1257,18 +1688,28 @@ def create(VARSPACE):
         rovib_state.dvr3drjz.ipar = ipar
         rovib_state.rotlev.kmin = kmin
         rovib_state.job_manager.title = dirname                
+        if estimate:
+            resources = estimator.estimate(get_block_basis(rovib_state))
+            rovib_state.job_manager.memory = resources['memory']
+            rovib_state.job_manager.walltime = resources['walltime']
+            rovib_state.job_manager.ncores = resources['ncores']
+            print('%s: memory=%d MB, walltime=%d h, ncores=%d'%(dirname,
+                resources['memory'],resources['walltime'],resources['ncores']))
         rovib_state.save(dirname)
         # write summary
         fout.write('\n\ndirname=%s'%dirname+'\n')
+        if estimate:
+            fout.write('memory=%d, walltime=%d, ncores=%d\n'%(
+                resources['memory'],resources['walltime'],resources['ncores']))
         fout.write(str(rovib_state)+'\n')
     
     fout.close()
     
     print('%d subfolders were created. Summary is saved to %s'%(len(states),summary_file))
 
-def check_job_status(curdir): # need to have a proper working dir
-    flag_done = os.path.isfile(LABEL_DONE)
-    flag_running = os.path.isfile(LABEL_RUNNING)
+def check_job_status(curdir,dirname='./'): # dirname is relative to the working dir
+    flag_done = os.path.isfile(os.path.join(dirname,LABEL_DONE))
+    flag_running = os.path.isfile(os.path.join(dirname,LABEL_RUNNING))
     if flag_done and not flag_running:
         status = 0; message = 'JOB IN %s IS DONE'%curdir
     elif not flag_done and flag_running:
@@ -1282,6 +1723,12 @@ def check_job_status(curdir): # need to have a proper working dir
 def submit(VARSPACE):
     states = read_states(VARSPACE['CREATE']['states'])
     rovib_state = get_rovib_state(VARSPACE)
+    rovib_state.job_manager.title = VARSPACE['GENERAL']['project']
+    
+    # most expensive blocks first (LPT)
+    order = schedule.check_order(VARSPACE['CALCULATE']['submit_order'],['file','cost'])
+    if order=='cost':
+        states = schedule.order_by_cost(states,get_block_costs(rovib_state,states))
     
     print('INITIAL DIR: %s'%os.getcwd())
     for state in states:
@@ -1296,71 +1743,336 @@ def submit(VARSPACE):
             rovib_state.job_manager.submit_job()
         print('CD TO UPPER LEVEL')
         os.chdir('..')
+    rovib_state.job_manager.finalize()
 
-def check(VARSPACE): # check the status of running jobs
+def check(VARSPACE,watch=None): # check the status of running jobs
     states = read_states(VARSPACE['CREATE']['states'])
+    names = [state['name'] for state in states]
+    ledger = VARSPACE['CREATE']['ledger']
+    if ledger and not os.path.isfile(ledger):
+        ledger = None
+    if watch:
+        print('WATCHING THE JOBs STATUS IN %s EVERY %d s'%(os.getcwd(),watch))
+        return monitor.watch(names,interval=watch,ledger=ledger)
     print('CHECKING THE JOBs STATUS IN %s'%os.getcwd())
+    return monitor.check(names,ledger=ledger)
+
+# Escalation of the block settings for each failure signature:
+# signature: (regex on the error message, {setting: factor}).
+# Errors are taken from the job output, see parse.collect_states.job_failed.
+# Factors below 1 are not used: e.g. ROTLEV reads all the DVR3DRJZ vectors
+# (nvib=9999), so fewer vectors in fort.26 are fixed by raising DVR3DRJZ neval.
+FAILURE_ESCALATIONS = OrderedDict([
+    ('walltime', ('time limit', {'walltime':2})),
+    ('memory', ('out of memory|insufficient virtual memory', {'memory':2})),
+    ('segfault', ('segmentation fault|sigsegv', {})), # stack limit or input error: resubmit unchanged
+    ('basis', ('too much data', {'max3d':1.5,'memory':2})), # rotlev: truncated DVR3DRJZ basis
+    ('eigenvectors', ('end-of-file', {'neval':1.5})), # rotlev: fewer vectors in fort.26 than requested
+    ('unknown', ('', {})), # resubmit unchanged
+])
+
+RESUBMIT_LOG = 'resubmit.log'
+RESUBMIT_SETTINGS = ['memory','walltime','max3d','neval']
+
+def classify_failure(error):
+    """ Get failure signature for the error message. """
+    for signature,(regex,_) in FAILURE_ESCALATIONS.items():
+        if re.search(regex,error,re.IGNORECASE):
+            return signature
+
+def escalate(settings,signature):
+    """ Return new block settings for the failure signature. """
+    settings = settings.copy()
+    _,factors = FAILURE_ESCALATIONS[signature]
+    for key,factor in factors.items():
+        settings[key] = max(int(settings[key]*factor),1)
+    return settings
+
+def read_resubmit_log(dirname):
+    """
+    Read resubmission history of the block.
+    Each line is one attempt:
+    2026-01-01 12:00:00 attempt=1 signature=memory memory=20000 walltime=24 max3d=1000 neval=100 # error
+    Return the number of attempts and the settings of the latest one (None if absent).
+    """
+    path = os.path.join(dirname,RESUBMIT_LOG)
+    if not os.path.isfile(path):
+        return 0,None
+    with open(path) as f:
+        lines = [line for line in f if line.strip()]
+    if not lines:
+        return 0,None
+    vals = dict(item.split('=',1) for item in lines[-1].split('#')[0].split() if '=' in item)
+    settings = {key:int(vals[key]) for key in RESUBMIT_SETTINGS}
+    return len(lines),settings
+
+def write_resubmit_log(dirname,attempt,signature,settings,error):
+    with open(os.path.join(dirname,RESUBMIT_LOG),'a') as f:
+        f.write('%s attempt=%d signature=%s %s # %s\n'%(
+            time.strftime('%Y-%m-%d %H:%M:%S'),attempt,signature,
+            ' '.join(['%s=%d'%(key,settings[key]) for key in RESUBMIT_SETTINGS]),
+            error.strip()))
+
+# Errors for the sacct states of the killed jobs without the signature in the output.
+SCHEDULER_ERRORS = {'TIMEOUT':'time limit','OUT_OF_MEMORY':'out of memory'}
+
+def get_killed_blocks(dirnames):
+    """
+    Return {folder name: error message} for the RUNNING blocks whose
+    Slurm job (taken from the newest slurm-<jobid>.out) has ended.
+    """
+    from ..parse.collect_states import get_job_output_filename, REGEX_JOB_ID
+    jobids = OrderedDict()
+    for dirname in dirnames:
+        status,_ = check_job_status(dirname,dirname)
+        if status!=1:
+            continue
+        lookup = REGEX_JOB_ID.match(get_job_output_filename(dirname) or '')
+        if lookup:
+            jobids[dirname] = '_'.join(val for val in lookup.groups() if val)
+    states = job_ledger.get_scheduler_states(list(jobids.values()))
+    killed = OrderedDict()
+    for dirname,jobid in jobids.items():
+        state = states.get(jobid)
+        if state in job_ledger.SLURM_ENDED_STATES:
+            killed[dirname] = SCHEDULER_ERRORS.get(state,
+                'job %s ended (%s) without the DONE label'%(jobid,state))
+    return killed
+
+def get_failed_blocks(VARSPACE,states):
+    """
+    Return ordered dict {folder name: error message} for the failed blocks.
+    Block is failed if its job is DONE and the job output has errors,
+    or if the latest run in the ledger has non-zero exit code
+    (this includes the jobs killed by the scheduler, see ledger.reconcile).
+    Without the ledger, a block left RUNNING by a killed job is failed
+    if the Slurm job of its newest output has ended (sacct is needed).
+    """
+    from ..parse.collect_states import job_failed
+    ledger = VARSPACE['CREATE']['ledger']
+    failed_in_ledger = set(job_ledger.get_failed(ledger)) \
+        if ledger and os.path.isfile(ledger) else set()
+    killed = get_killed_blocks([state['name'] for state in states \
+        if state['name'] not in failed_in_ledger])
+    failed = OrderedDict()
     for state in states:
-        curdir = state['name']
-        print('\nCD TO %s'%curdir)
-        os.chdir(curdir)
-        status, message = check_job_status(curdir)
-        print('Status %d: %s'%(status,message))
-        print('CD TO UPPER LEVEL')
+        dirname = state['name']
+        status,_ = check_job_status(dirname,dirname)
+        if dirname in killed:
+            failed[dirname] = job_failed(dirname) or killed[dirname]
+            continue
+        if status!=0 and dirname not in failed_in_ledger:
+            continue
+        error = job_failed(dirname)
+        if error=='no job output' and dirname not in failed_in_ledger:
+            error = None # e.g. Shell job manager, output is not saved
+        if error is None and dirname in failed_in_ledger:
+            error = 'non-zero exit code in the ledger'
+        if error:
+            failed[dirname] = error
+    return failed
+
+def resubmit_failed(VARSPACE):
+    """
+    Regenerate the failed blocks with escalated settings and resubmit them.
+    """
+    states = read_states(VARSPACE['CREATE']['states'])
+    rovib_state = get_rovib_state(VARSPACE)
+    max_attempts = to_int( VARSPACE['CALCULATE']['max_attempts'] or 3 )
+    defaults = {
+        'memory': VARSPACE['CALCULATE']['memory'],
+        'walltime': VARSPACE['CALCULATE']['walltime'],
+        'max3d': VARSPACE['DVR3DRJZ_INPUT']['max3d'],
+        'neval': VARSPACE['DVR3DRJZ_INPUT']['neval'],
+    }
+
+    failed = get_failed_blocks(VARSPACE,states)
+    print('FOUND %d FAILED BLOCKS IN %s'%(len(failed),os.getcwd()))
+
+    resubmitted = []; given_up = []
+    for state in states:
+        dirname = state['name']
+        if dirname not in failed:
+            continue
+        error = failed[dirname]
+        signature = classify_failure(error)
+        attempts,settings = read_resubmit_log(dirname)
+        if attempts>=max_attempts:
+            print('\n%s: %s (%s) ===> GIVING UP AFTER %d ATTEMPTS'%\
+                (dirname,error.strip(),signature,attempts))
+            given_up.append(dirname)
+            continue
+        settings = escalate(settings or defaults,signature)
+        print('\n%s: %s (%s) ===> ATTEMPT %d: %s'%(dirname,error.strip(),signature,attempts+1,
+            ', '.join(['%s=%d'%(key,settings[key]) for key in RESUBMIT_SETTINGS])))
+
+        # regenerate the block with the new settings
+        rovib_state.dvr3drjz.jrot = state['jrot']
+        rovib_state.dvr3drjz.kmin = state['kmin']
+        rovib_state.dvr3drjz.ipar = state['ipar']
+        rovib_state.dvr3drjz.max3d = settings['max3d']
+        rovib_state.dvr3drjz.neval = settings['neval']
+        rovib_state.rotlev.kmin = state['kmin']
+        rovib_state.job_manager.memory = settings['memory']
+        rovib_state.job_manager.walltime = settings['walltime']
+        rovib_state.job_manager.title = dirname
+        rovib_state.save(dirname)
+        write_resubmit_log(dirname,attempts+1,signature,settings,error)
+
+        # labels are removed now to show the block as not launched until the job starts
+        # (a killed job leaves RUNNING instead of DONE)
+        for label in [LABEL_DONE,LABEL_RUNNING]:
+            if os.path.isfile(os.path.join(dirname,label)):
+                os.remove(os.path.join(dirname,label))
+        os.chdir(dirname)
+        rovib_state.job_manager.submit_job()
         os.chdir('..')
+        resubmitted.append(dirname)
+    rovib_state.job_manager.finalize()
+
+    print('\nRESUBMITTED: %d, GIVEN UP: %d'%(len(resubmitted),len(given_up)))
+    if given_up:
+        print('GIVEN UP: %s'%', '.join(given_up))
+
+def run_hosetaylor(hosetaylor_exe,ZPE,dirname,file):
+    """
+    Run Hose-Taylor on a single wavefunction file inside the job folder.
+    The file is skipped if its output is newer than the file itself.
+    Return (dirname,file,status,error), status is done, skipped or failed.
+    """
+    path = os.path.join(dirname,file)
+    output = path+'.hose-taylor.out'
+    if not os.path.isfile(path):
+        return dirname,file,'failed','no such file'
+    if os.path.isfile(output) and os.path.getmtime(output)>os.path.getmtime(path):
+        return dirname,file,'skipped',None
+    result = subprocess.run([hosetaylor_exe,'%.11f'%ZPE,file],cwd=dirname,
+        stdout=subprocess.PIPE,stderr=subprocess.STDOUT,universal_newlines=True)
+    if result.returncode:
+        lines = result.stdout.strip().split('\n')
+        return dirname,file,'failed','exit code %d: %s'%(result.returncode,lines[-1])
+    return dirname,file,'done',None
 
 def hosetaylor(VARSPACE): # calculate rot. assignments with Hose-Taylor procedure
     states = read_states(VARSPACE['CREATE']['states'])
-    print('CLEANING LARGE FILES IN %s'%os.getcwd())
-    hosetaylor_exe = VARSPACE['INIT']['hosetaylor']
-    hosetaylor_exe_path = os.path.join('..',hosetaylor_exe)
-    
-    def run_ht(ZPE,files):
-        for file in files:
-            subprocess.run([hosetaylor_exe_path,'%.11f'%ZPE,file])
+    hosetaylor_exe = os.path.abspath(VARSPACE['RESOURCES']['hosetaylor_executable'])
+    nslots = to_int( VARSPACE['CALCULATE']['hosetaylor_nprocs'] ) or os.cpu_count()
+    print('RUNNING HOSE-TAYLOR IN %s WITH %d PROCESSES'%(os.getcwd(),nslots))
     
     # try to get ZPE from file
     with open('states.ZPE') as f:
         ZPE = float(f.read().strip())
     
-    for state in states:
-        curdir = state['name']
-        print('\nCD TO %s'%curdir)
-        os.chdir(curdir)
-        j,k,i = state['jrot'],state['kmin'],state['ipar']
-        
-        if j==0:
-            files = ['fort.26']
-        elif k==2:
-            files = ['fort.8','fort.9']
-        elif k in [0,1]:
-            files = ['fort.8']
-        else:
-            raise Exception('unknown j,k,i configuration: %s'%str([j,k,i]))
-        
-        run_ht(ZPE,files)
-
-        print('Processed: %s'%(', '.join(files)))
-        print('CD TO UPPER LEVEL')
-        os.chdir('..')
+    # Each file runs in its own folder (cwd of the subprocess),
+    # threads only wait for the subprocesses.
+    tasks = [(state['name'],file) for state in states \
+        for file in get_wavefunction_files(state['jrot'],state['kmin'])]
+    counts = OrderedDict([('done',0),('skipped',0),('failed',0)])
+    failed = []
+    with ThreadPoolExecutor(max_workers=nslots) as executor:
+        results = executor.map(lambda task: run_hosetaylor(hosetaylor_exe,ZPE,*task),tasks)
+        for dirname,file,status,error in results:
+            counts[status] += 1
+            print('%s/%s: %s'%(dirname,file,status+(' (%s)'%error if error else '')))
+            if error:
+                failed.append((dirname,file,error))
+    
+    print('\nHOSE-TAYLOR: %d files (%s)'%(len(tasks),
+        ', '.join(['%s: %d'%(key,counts[key]) for key in counts])))
+    for dirname,file,error in failed:
+        print('ERROR: %s/%s: %s'%(dirname,file,error))
         
-def clean(VARSPACE): # check the status of running jobs
+def clean(VARSPACE,archive=False): # remove large files from the job folders
+    """
+    Remove DVR3DRJZ scratch (fort.16) and eigenvectors (fort.26) from the job folders.
+    In archive mode fort.26 and the wavefunction files used by DIPOLE3B
+    are compressed to the archive (CALCULATE.archive) instead, see calc/archive.py.
+    Wavefunction files failing the validation are not archived,
+    and fort.26 is then kept in the folder (archive mode only).
+    """
+    from ..parse.wavefunctions import check_wavefunction_file
     states = read_states(VARSPACE['CREATE']['states'])
-    print('CLEANING LARGE FILES IN %s'%os.getcwd())
+    CALCULATE = VARSPACE['CALCULATE']
+    if archive:
+        archive_dir = CALCULATE['archive']
+        codec = fort_archive.get_codec(CALCULATE['archive_codec'])
+        catalog = fort_archive.load_catalog(archive_dir)
+        print('ARCHIVING LARGE FILES IN %s TO %s (%s)'%(os.getcwd(),archive_dir,codec))
+    else:
+        print('CLEANING LARGE FILES IN %s'%os.getcwd())
     for state in states:
         curdir = state['name']
-        print('\nCD TO %s'%curdir)
-        os.chdir(curdir)
+        print('\n%s'%curdir)
         j,k,i = state['jrot'],state['kmin'],state['ipar']
         files = ['fort.16']
+        # ROTLEV wavefunctions to archive, {file: error} for the invalid ones
+        errors = OrderedDict()
+        if archive:
+            for file in get_wavefunction_files(j,k):
+                path = os.path.join(curdir,file)
+                if file=='fort.26' or not os.path.isfile(path):
+                    continue
+                error = check_wavefunction_file(path)
+                if error:
+                    print('ERROR: invalid %s'%error)
+                    errors[file] = error
         if (j==1 and (k,i) in {(1,0),(1,1)}) or j>1:
-            files.append('fort.26')            
+            # fort.26 is needed to rerun ROTLEV, keep it if the wavefunctions are not archived
+            if errors:
+                print('keeping fort.26, not archiving invalid %s'%', '.join(errors))
+            else:
+                files.append('fort.26')            
+        archived = []
+        if archive:
+            for file in get_wavefunction_files(j,k)+files[1:]:
+                if file in archived:
+                    continue
+                if not os.path.isfile(os.path.join(curdir,file)):
+                    print('skipping missing',file)
+                    continue
+                if file in errors:
+                    continue
+                entry = fort_archive.archive_file(archive_dir,curdir,file,codec,
+                    CALCULATE['archive_level'],CALCULATE['archive_threads'],catalog)
+                fort_archive.save_catalog(archive_dir,catalog)
+                print('%s: %d -> %d bytes (%.1fx, %.1f s)'%(file,entry['size'],
+                    entry['compressed_size'],entry['size']/max(entry['compressed_size'],1),
+                    entry['time']))
+                archived.append(file)
+            files = files[:1]
         for file in files:
-            file = os.path.join('./',file)
-            if os.path.isfile(file):
-                os.remove(file)
+            path = os.path.join(curdir,file)
+            if os.path.isfile(path):
+                os.remove(path)
             else:
                 print('skipping',file)
         print('Cleaned: %s'%(', '.join(files)))
-        print('CD TO UPPER LEVEL')
-        os.chdir('..')
+        if archived:
+            print('Archived: %s'%(', '.join(archived)))
+    if archive:
+        nfiles,size,compressed_size = fort_archive.get_stats(catalog)
+        print('\nARCHIVE %s: %d files, %.3f GB -> %.3f GB'%\
+            (archive_dir,nfiles,size/2**30,compressed_size/2**30))
+
+def restore(VARSPACE):
+    """
+    Restore the archived files (see clean) to the job folders.
+    Files which are present in the folders are not overwritten.
+    """
+    states = read_states(VARSPACE['CREATE']['states'])
+    archive_dir = VARSPACE['CALCULATE']['archive']
+    catalog = fort_archive.load_catalog(archive_dir)
+    print('RESTORING FILES FROM %s TO %s'%(archive_dir,os.getcwd()))
+    nrestored = 0
+    for state in states:
+        curdir = state['name']
+        keys = sorted(key for key in catalog if key.split('/')[0]==curdir)
+        for key in keys:
+            file = key.split('/')[1]
+            if os.path.isfile(os.path.join(curdir,file)):
+                print('%s: skipping (exists)'%key)
+                continue
+            fort_archive.restore_file(archive_dir,curdir,file,catalog)
+            print('%s: restored'%key)
+            nrestored += 1
+    print('\nRESTORED: %d files'%nrestored)
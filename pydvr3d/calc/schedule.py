@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+import os
+import csv
+from collections import Counter
+
+"""
+SUBMISSION ORDER OF THE JOB FOLDERS
+
+    file:      as listed in states.txt / transitions.txt
+    cost:      longest-processing-time-first (LPT), the most expensive
+               jobs start first and the cheap ones fill the gaps at the end
+    priority:  energy blocks which unblock the most transitions first,
+               then LPT (campaign mode only)
+
+Block cost is predicted from the basis sizes (see estimate.py).
+Transition (DIPOLE3B) cost is the product of the numbers of levels
+of the bra and ket blocks found in the collected energies (states.csv).
+
+GROUPING OF THE TRANSITIONS SHARING A WAVEFUNCTION FILE
+
+    none:  each transition is a separate job
+    bra:   transitions with the same bra file (state + fort) run as one job
+    ket:   same for the ket file
+    file:  each transition goes to the group of its bra or ket file,
+           whichever is shared by more transitions (greedy)
+
+Members of the group run one after another on the same node, so the
+shared file is read from the page cache (or the local scratch) after
+the first member instead of the parallel filesystem.
+"""
+
+ORDERS = ['file','cost','priority']
+GROUPINGS = ['none','bra','ket','file']
+
+def check_order(order,allowed=ORDERS):
+    order = (order or 'file').lower()
+    if order not in allowed:
+        raise Exception('unknown submit order "%s" (expected one of: %s)'%\
+            (order,', '.join(allowed)))
+    return order
+
+def order_by_cost(items,costs):
+    """ Sort items by decreasing cost, unknown costs go last. """
+    return sorted(items,key=lambda item: -costs.get(item['name'],0))
+
+def order_by_priority(items,priorities,costs):
+    """ Sort items by decreasing priority, then by decreasing cost. """
+    return sorted(items,key=lambda item: \
+        (-priorities.get(item['name'],0),-costs.get(item['name'],0)))
+
+def read_level_counts(filename):
+    """
+    Count levels for each block in the collected energies (states.csv).
+    Return Counter {block folder: number of levels}, empty if the file is absent.
+    """
+    counts = Counter()
+    if not os.path.isfile(filename):
+        return counts
+    with open(filename) as f:
+        for row in csv.DictReader(f,delimiter=';'):
+            counts[row['dir']] += 1
+    return counts
+
+def get_transition_costs(transitions,counts):
+    """ DIPOLE3B cost: number of bra levels times number of ket levels. """
+    return {trans['name']: counts[trans['state']]*counts[trans['state_']] \
+        for trans in transitions}
+
+def check_grouping(grouping):
+    grouping = (grouping or 'none').lower()
+    if grouping not in GROUPINGS:
+        raise Exception('unknown transition grouping "%s" (expected one of: %s)'%\
+            (grouping,', '.join(GROUPINGS)))
+    return grouping
+
+def get_wavefunction_keys(trans):
+    """ Bra and ket wavefunction files of the transition. """
+    return (trans['state'],trans['fort']),(trans['state_'],trans['fort_'])
+
+def group_by_file(transitions,grouping,group_size=None):
+    """
+    Group the transitions sharing a wavefunction file (see above).
+    Groups larger than group_size are split.
+    Return list of groups (lists of transitions); groups and their members
+    keep the order of the transitions (by the first member).
+    """
+    grouping = check_grouping(grouping)
+    if grouping=='none':
+        return [[trans] for trans in transitions]
+    keys = [get_wavefunction_keys(trans) for trans in transitions]
+    if grouping=='bra':
+        owners = [bra for bra,ket in keys]
+    elif grouping=='ket':
+        owners = [ket for bra,ket in keys]
+    else:
+        usage = Counter()
+        for bra,ket in keys:
+            usage[bra] += 1
+            if ket!=bra:
+                usage[ket] += 1
+        owners = [bra if usage[bra]>=usage[ket] else ket for bra,ket in keys]
+    groups = {}
+    for trans,owner in zip(transitions,owners):
+        groups.setdefault(owner,[]).append(trans) # dicts keep the insertion order
+    result = []
+    for group in groups.values():
+        size = group_size or len(group)
+        result += [group[i:i+size] for i in range(0,len(group),size)]
+    return result
+
+def get_dependent_counts(transitions):
+    """ Number of transitions depending on each energy block. """
+    counts = Counter()
+    for trans in transitions:
+        counts[trans['state']] += 1
+        if trans['state_']!=trans['state']:
+            counts[trans['state_']] += 1
+    return counts
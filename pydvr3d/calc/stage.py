@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import argparse
+import subprocess
+
+"""
+NODE-LOCAL STAGING CACHE FOR THE WAVEFUNCTION FILES
+
+DIPOLE3B reads the bra and ket files sequentially from the shared storage.
+With staging the job runs through the wrapper, which puts the files into
+the cache directory on the node-local disk (e.g. $TMPDIR) and links them
+to the units in the job folder:
+
+    python -m pydvr3d.calc.stage run --cache $TMPDIR/pydvr3d_stage --max-size 200 \\
+        fort.11=/root/energies/jki_0100f/fort.8 fort.12=/root/energies/jki_0200f/fort.8 \\
+        -- "./dipole3b.x < dipole3b.inp > dipole3b.out"
+
+The cache is shared by all jobs of the node:
+
+    key:       hash of the source path, size and mtime (changed file => new entry),
+               the data are not hashed since the files are tens of GB
+    entry:     <key>.data (copy, or hard link if on the same filesystem)
+    locking:   <key>.fill is held exclusively while the entry is filled, so
+               concurrent jobs needing the same file copy it once; <key>.lock
+               is held shared by the jobs using the entry until they finish,
+               so used entries are never evicted
+    eviction:  least recently used entries (mtime is touched on each hit)
+               are removed until the cache fits into max-size (GB)
+    stats:     hits, misses, copied bytes and evictions are accumulated in
+               stats.json of the cache and printed to the job output
+"""
+
+STATS_FILE = 'stats.json'
+STATS_LOCK = 'stats.lock'
+COPY_BUFSIZE = 1<<24
+
+def get_key(src):
+    st = os.stat(src)
+    ident = '%s:%d:%d'%(os.path.realpath(src),st.st_size,st.st_mtime_ns)
+    return hashlib.sha1(ident.encode()).hexdigest()
+
+def get_entries(cache):
+    """ Cached entries: list of (key, size, last access). """
+    entries = []
+    with os.scandir(cache) as items:
+        for item in items:
+            if item.name.endswith('.data'):
+                st = item.stat()
+                entries.append((item.name[:-5],st.st_size,st.st_mtime))
+    return entries
+
+def update_stats(cache,**increments):
+    """ Add the increments to the node statistics, return the totals. """
+    with open(os.path.join(cache,STATS_LOCK),'a') as lock:
+        fcntl.flock(lock,fcntl.LOCK_EX)
+        path = os.path.join(cache,STATS_FILE)
+        stats = {'hits':0,'misses':0,'bytes_copied':0,'evictions':0,'bytes_evicted':0}
+        if os.path.isfile(path):
+            with open(path) as f:
+                stats.update(json.load(f))
+        for key,val in increments.items():
+            stats[key] += val
+        with open(path+'.tmp','w') as f:
+            json.dump(stats,f,indent=1)
+        os.replace(path+'.tmp',path)
+    return stats
+
+def evict(cache,max_size,needed=0):
+    """
+    Remove least recently used entries until the cache with the
+    needed bytes fits into max_size. Entries in use are skipped.
+    Return (number, bytes) of the evicted entries.
+    """
+    entries = sorted(get_entries(cache),key=lambda entry: entry[2])
+    total = sum(size for _,size,_ in entries)+needed
+    nevicted = 0; bytes_evicted = 0
+    for key,size,_ in entries:
+        if total<=max_size:
+            break
+        with open(os.path.join(cache,key+'.lock'),'a') as lock:
+            try:
+                fcntl.flock(lock,fcntl.LOCK_EX|fcntl.LOCK_NB)
+            except BlockingIOError: # used by a running job
+                continue
+            path = os.path.join(cache,key+'.data')
+            if os.path.isfile(path):
+                os.remove(path)
+                total -= size; nevicted += 1; bytes_evicted += size
+    return nevicted,bytes_evicted
+
+def fill(src,path,mode):
+    """ Put the source to the cache: hard link (mode link, same filesystem) or copy. """
+    if mode=='link':
+        try:
+            os.link(src,path)
+            return 0
+        except OSError: # different filesystems
+            pass
+    tmppath = path+'.tmp'
+    with open(src,'rb') as fin, open(tmppath,'wb') as fout:
+        shutil.copyfileobj(fin,fout,COPY_BUFSIZE)
+    os.replace(tmppath,path)
+    return os.path.getsize(path)
+
+def stage(cache,src,max_size=None,mode='copy'):
+    """
+    Get the cached copy of src. Return (path, lock, hit, copied bytes, evictions).
+    The returned lock file is held in the shared mode, close it after use.
+    """
+    key = get_key(src)
+    path = os.path.join(cache,key+'.data')
+    lock = open(os.path.join(cache,key+'.lock'),'a')
+    fcntl.flock(lock,fcntl.LOCK_SH) # protects the entry from eviction
+    hit = True; copied = 0; evicted = (0,0)
+    with open(os.path.join(cache,key+'.fill'),'a') as fill_lock:
+        fcntl.flock(fill_lock,fcntl.LOCK_EX) # waits if another job is filling the entry
+        if os.path.isfile(path):
+            os.utime(path)
+        else:
+            hit = False
+            if max_size:
+                evicted = evict(cache,max_size,os.path.getsize(src))
+            copied = fill(src,path,mode)
+    return path,lock,hit,copied,evicted
+
+def run(cache,files,command,max_size=None,mode='copy'):
+    """
+    Stage the files ({unit: source}), link them to the units and run the command.
+    Return the exit code of the command.
+    """
+    os.makedirs(cache,exist_ok=True)
+    max_size = max_size*2**30 if max_size else None
+    locks = []
+    hits = 0; misses = 0; copied = 0; nevicted = 0; bytes_evicted = 0
+    start = time.time()
+    for unit,src in files.items():
+        path,lock,hit,nbytes,(n,nb) = stage(cache,src,max_size,mode)
+        locks.append(lock)
+        if os.path.lexists(unit):
+            os.remove(unit)
+        os.symlink(path,unit)
+        hits += hit; misses += not hit; copied += nbytes
+        nevicted += n; bytes_evicted += nb
+        print('STAGE: %s -> %s (%s)'%(src,unit,'hit' if hit else 'miss'),flush=True)
+    stats = update_stats(cache,hits=hits,misses=misses,bytes_copied=copied,
+        evictions=nevicted,bytes_evicted=bytes_evicted)
+    print('STAGE: %d hits, %d misses, %.3f GB copied in %.1f s, %d evicted (node total: %d hits, %d misses)'%\
+        (hits,misses,copied/2**30,time.time()-start,nevicted,stats['hits'],stats['misses']),flush=True)
+    try:
+        return subprocess.run(command,shell=True).returncode
+    finally:
+        for unit in files:
+            if os.path.islink(unit):
+                os.remove(unit)
+        for lock in locks:
+            lock.close()
+
+def get_command(cache,files,command,max_size=None,mode='copy'):
+    """
+    Shell command running the job step with the staged files, see run.
+    Files are the "unit=source" arguments (may be shell variables).
+    """
+    args = [sys.executable,'-m','pydvr3d.calc.stage','run','--cache',cache,'--mode',mode]
+    if max_size:
+        args += ['--max-size',str(max_size)]
+    args += list(files)
+    return ' '.join(args+['--','"%s"'%command.replace('"','\\"')])
+
+def main():
+    parser = argparse.ArgumentParser(description='Node-local staging cache.')
+    parser.add_argument('action',choices=['run','stats'])
+    parser.add_argument('--cache',required=True)
+    parser.add_argument('--max-size',type=float,default=None,help='cache size limit, GB')
+    parser.add_argument('--mode',choices=['copy','link'],default='copy')
+    parser.add_argument('files',nargs='*',help='unit=source pairs')
+    argv = sys.argv[1:]
+    split = argv.index('--') if '--' in argv else len(argv)
+    args = parser.parse_intermixed_args(argv[:split])
+    command = argv[split+1:]
+    if args.action=='stats':
+        path = os.path.join(args.cache,STATS_FILE)
+        stats = json.load(open(path)) if os.path.isfile(path) else {}
+        entries = get_entries(args.cache) if os.path.isdir(args.cache) else []
+        print('%s: %d entries, %.3f GB; %s'%(args.cache,len(entries),
+            sum(size for _,size,_ in entries)/2**30,
+            ', '.join('%s: %s'%(key,stats[key]) for key in stats)))
+        return
+    files = dict(pair.split('=',1) for pair in args.files)
+    sys.exit(run(args.cache,files,' '.join(command),args.max_size,args.mode))
+
+if __name__=='__main__':
+    main()
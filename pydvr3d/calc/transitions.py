@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+
+import sys
+import ast
+import numpy as np
+
+"""
+GENERATION OF THE TRANSITION LIST
+
+Each state (energy block) gives one row per wavefunction file,
+see intensities.get_case_params. The rows are grouped by J, so only the
+bra/ket groups inside [J-j_diff_max, J-j_diff_min] are paired; the pairs
+of each group are built at once as index arrays.
+
+GENERATE.filter is a Python expression of the pair parameters:
+
+    jrot,kmin,ipar,jrot_,kmin_,ipar_,fort,fort_,name,name_
+
+It is compiled once into the vectorised predicate evaluated on the
+arrays of all candidate pairs of the group: "and", "or", "not", chained
+comparisons, "in" and conditional expressions are rewritten to their
+elementwise NumPy equivalents. Expressions with other constructs
+(string methods, subscripts, calls except abs) are evaluated pair by pair.
+The choice is made once at compile time; errors of the vectorised
+predicate are raised as they are.
+
+The pairs are returned in the order of the original double loop
+(bra state, ket state, bra file, ket file), so the transition ids are stable.
+
+SELECTION RULES
+
+The pairs which DIPOLE3B rejects or SPECTRA weights to zero
+are dropped before any job is created:
+
+    delta J:       |J-J'| <= 1
+    J=0 -> 0:      "j = 0 -> 0 not allowed"
+    parity:        total parity (-1)^(J+p) must change (e <-> f for dJ=0,
+                   e <-> e and f <-> f for dJ=1), "selection rules violated"
+    nuclear spin:  ipar is conserved, "parity mismatch, spin forbidden"
+    spin weight:   ge (ipar=0) or go (ipar=1) of the SPECTRA input is zero
+
+Wavefunction files of the block (see get_wavefunction_files), the only
+definition used by generate, Hose-Taylor, clean and the collectors:
+
+    J=0, J=1 kmin=0:   fort.26 (DVR3DRJZ)
+    kmin=0,1:          fort.8 (ROTLEV)
+    kmin=2:            fort.8, fort.9 (ROTLEV)
+
+Rotational parity p of the wavefunction file (DVR3D e/f labels):
+
+    J=0:               p=0 (fort.26)
+    kmin=1:            p=0 (e)
+    kmin=0:            p=1 (f)
+    kmin=2:            fort.8 p=0 (e), fort.9 p=1 (f)
+"""
+
+PAIR_PARAMS = ['jrot','kmin','ipar','jrot_','kmin_','ipar_','fort','fort_','name','name_']
+
+class Vectorize(ast.NodeTransformer):
+    """ Rewrite the boolean logic of the expression to the elementwise operations. """
+
+    def visit_BoolOp(self,node):
+        self.generic_visit(node)
+        op = ast.BitAnd() if isinstance(node.op,ast.And) else ast.BitOr()
+        values = [self.as_bool(value) for value in node.values]
+        result = values[0]
+        for value in values[1:]:
+            result = ast.BinOp(left=result,op=op,right=value)
+        return result
+
+    def visit_UnaryOp(self,node):
+        self.generic_visit(node)
+        if isinstance(node.op,ast.Not):
+            return ast.UnaryOp(op=ast.Invert(),operand=self.as_bool(node.operand))
+        return node
+
+    def visit_Compare(self,node):
+        self.generic_visit(node)
+        result = None
+        left = node.left
+        for op,right in zip(node.ops,node.comparators):
+            if isinstance(op,(ast.In,ast.NotIn)):
+                term = self.call('isin',[left,right])
+                if isinstance(op,ast.NotIn):
+                    term = ast.UnaryOp(op=ast.Invert(),operand=term)
+            else:
+                term = ast.Compare(left=left,ops=[op],comparators=[right])
+            result = term if result is None else ast.BinOp(left=result,op=ast.BitAnd(),right=term)
+            left = right
+        return result
+
+    def visit_IfExp(self,node):
+        self.generic_visit(node)
+        return self.call('where',[node.test,node.body,node.orelse])
+
+    def as_bool(self,node):
+        return self.call('asarray',[node],[ast.keyword(arg='dtype',value=ast.Name(id='bool',ctx=ast.Load()))])
+
+    def call(self,func,args,keywords=[]):
+        return ast.Call(func=ast.Attribute(value=ast.Name(id='__np__',ctx=ast.Load()),
+            attr=func,ctx=ast.Load()),args=args,keywords=keywords)
+
+# literals: ast.parse gives Num, Str and NameConstant before Python 3.8
+CONSTANT_NODES = (ast.Constant,) if sys.version_info>=(3,8) else \
+    (ast.Constant,ast.Num,ast.Str,ast.NameConstant)
+
+VECTOR_NODES = CONSTANT_NODES+(ast.Expression,ast.Name,ast.Load,ast.BoolOp,ast.And,ast.Or,
+    ast.UnaryOp,ast.Not,ast.USub,ast.UAdd,ast.BinOp,ast.Add,ast.Sub,ast.Mult,ast.Mod,
+    ast.FloorDiv,ast.Compare,ast.Eq,ast.NotEq,ast.Lt,ast.LtE,ast.Gt,ast.GtE,
+    ast.In,ast.NotIn,ast.IfExp,ast.List,ast.Tuple,ast.Set,ast.Call)
+
+def is_vectorizable(tree):
+    """ Check that the expression has the same meaning on arrays and scalars. """
+    for node in ast.walk(tree):
+        if not isinstance(node,VECTOR_NODES):
+            return False
+        if isinstance(node,ast.Name) and node.id not in PAIR_PARAMS+['abs']:
+            return False
+        if isinstance(node,ast.Call) and not (isinstance(node.func,ast.Name) and \
+                node.func.id=='abs' and len(node.args)==1 and not node.keywords):
+            return False
+        if isinstance(node,ast.Compare):
+            for op,right in zip(node.ops,node.comparators):
+                if isinstance(op,(ast.In,ast.NotIn)) and not (isinstance(right,(ast.List,ast.Tuple,ast.Set)) \
+                        and all(isinstance(elt,CONSTANT_NODES) for elt in right.elts)):
+                    return False
+    return True
+
+def compile_filter(expression):
+    """
+    Compile the filter expression.
+    Return (scalar predicate, vectorised predicate or None).
+    """
+    expression = (expression or 'True').strip()
+    scalar = eval('lambda %s: %s'%(','.join(PAIR_PARAMS),expression))
+    tree = ast.parse(expression,mode='eval')
+    if not is_vectorizable(tree):
+        return scalar,None
+    tree = ast.fix_missing_locations(Vectorize().visit(tree))
+    code = compile(tree,'<filter>','eval')
+    def vector(**params):
+        return eval(code,{'__np__':np,'abs':np.abs},params)
+    return scalar,vector
+
+def get_wavefunction_files(jrot,kmin):
+    """ Wavefunction files of the block (see above). """
+    if jrot==0 or (jrot==1 and kmin==0):
+        return ['fort.26']
+    elif kmin in [0,1]:
+        return ['fort.8']
+    elif kmin==2:
+        return ['fort.8','fort.9']
+    else:
+        raise Exception('unknown combination of jrot and kmin: %d %d'%(jrot,kmin))
+
+def get_parity(jrot,kmin,fort):
+    """ Rotational parity of the wavefunction file (see above). """
+    if jrot==0 or kmin==1:
+        return 0
+    elif kmin==0:
+        return 1
+    elif kmin==2:
+        return 0 if fort=='fort.8' else 1
+    else:
+        raise Exception('unknown combination of jrot and kmin: %d %d'%(jrot,kmin))
+
+def expand_states(states,get_case_params):
+    """
+    One row per (state, wavefunction file).
+    Return dict of the column arrays: state (index in states), jrot, kmin, ipar, 
+    p (rotational parity), fort, name.
+    """
+    rows = []
+    for n,state in enumerate(states):
+        name,jrot,kmin,ipar,frts = get_case_params(state)
+        for fort in frts:
+            rows.append((n,jrot,kmin,ipar,get_parity(jrot,kmin,fort),fort,name))
+    columns = {}
+    for col,key in enumerate(['state','jrot','kmin','ipar','p','fort','name']):
+        vals = [row[col] for row in rows]
+        columns[key] = np.array(vals,dtype=int if key not in ['fort','name'] else str)
+    return columns
+
+def get_pair_params(rows,bra,ket):
+    """ Parameters of the pairs (bra,ket row index arrays) for the filter. """
+    return {
+        'jrot':rows['jrot'][bra],'kmin':rows['kmin'][bra],'ipar':rows['ipar'][bra],
+        'jrot_':rows['jrot'][ket],'kmin_':rows['kmin'][ket],'ipar_':rows['ipar'][ket],
+        'fort':rows['fort'][bra],'fort_':rows['fort'][ket],
+        'name':rows['name'][bra],'name_':rows['name'][ket],
+        'p':rows['p'][bra],'p_':rows['p'][ket],
+    }
+
+def get_selection_rules(spin_weights=None):
+    """
+    Selection rules as the list of (name, predicate on the pair parameters).
+    spin_weights is (ge,go) from the SPECTRA input, None => no spin weight rule.
+    """
+    rules = [
+        ('delta J', lambda pars: np.abs(pars['jrot']-pars['jrot_'])<=1),
+        ('J=0 -> 0', lambda pars: (pars['jrot']!=0)|(pars['jrot_']!=0)),
+        ('parity', lambda pars: (pars['jrot']+pars['p']+pars['jrot_']+pars['p_'])%2==1),
+        ('nuclear spin', lambda pars: pars['ipar']==pars['ipar_']),
+    ]
+    if spin_weights is not None:
+        weights = np.array(spin_weights,dtype=float)
+        rules.append(('spin weight', lambda pars: weights[pars['ipar']]!=0))
+    return rules
+
+def get_filter(expression):
+    """ User filter (see compile_filter) as the named predicate. """
+    scalar,vector = compile_filter(expression)
+    return 'filter', lambda pars: apply_filter(scalar,vector,pars,len(pars['jrot']))
+
+def apply_filter(scalar,vector,params,npairs):
+    """ Return the boolean mask of the pairs passing the filter. """
+    if vector is not None:
+        return np.broadcast_to(np.asarray(vector(**params),dtype=bool),(npairs,))
+    return np.array([bool(scalar(*[params[key][n] for key in PAIR_PARAMS])) \
+        for n in range(npairs)],dtype=bool)
+
+def generate_pairs(rows,J_min,J_max,J_diff_min,J_diff_max,filters=[],counts=None):
+    """
+    Build all bra/ket row pairs satisfying the J limits and the filters.
+    Filters is the list of (name,predicate) applied in turn, see get_filter
+    and get_selection_rules. Number of pairs dropped by each filter is added
+    to the counts dict if given.
+    Return (bra,ket) row index arrays in the order of the original double loop.
+    """
+    groups = {}
+    for n,jrot in enumerate(rows['jrot']):
+        groups.setdefault(int(jrot),[]).append(n)
+    groups = {jrot:np.array(index) for jrot,index in groups.items()}
+    bras,kets = [],[]
+    for jrot in sorted(groups):
+        if jrot<J_min or jrot>J_max:
+            continue
+        bra_rows = groups[jrot]
+        for jrot_ in range(jrot-J_diff_max,jrot-J_diff_min+1):
+            if jrot_ not in groups:
+                continue
+            ket_rows = groups[jrot_]
+            bra = np.repeat(bra_rows,len(ket_rows))
+            ket = np.tile(ket_rows,len(bra_rows))
+            for name,predicate in filters:
+                if not len(bra):
+                    break
+                mask = np.broadcast_to(predicate(get_pair_params(rows,bra,ket)),bra.shape)
+                if counts is not None:
+                    counts[name] = counts.get(name,0)+int(len(mask)-np.count_nonzero(mask))
+                bra,ket = bra[mask],ket[mask]
+            bras.append(bra); kets.append(ket)
+    if not bras:
+        return np.empty(0,dtype=int),np.empty(0,dtype=int)
+    bra = np.concatenate(bras); ket = np.concatenate(kets)
+    # rows are ordered by (state, file), so this is the (bra state, ket state, bra file, ket file) order
+    order = np.lexsort((ket,bra,rows['state'][ket],rows['state'][bra]))
+    return bra[order],ket[order]
@@ -3,6 +3,7 @@ import argparse
 
 from .calc import positions as posit
 from .calc import intensities as intens
+from .calc import campaign
 
 from . import parse
 
@@ -61,11 +62,22 @@ def main_positions():
     parser.add_argument('--check', dest='check',
         action='store_const', const=True, default=False,
         help='Stage 6: check the status of the submitted jobs')
+
+    parser.add_argument('--watch', type=int, nargs='?', const=60, default=None,
+        help='Stage 6b: watch the jobs status, print summary every WATCH seconds')
+
+    parser.add_argument('--resubmit-failed', dest='resubmit_failed',
+        action='store_const', const=True, default=False,
+        help='Stage 6c: resubmit failed jobs with escalated resources')
         
     parser.add_argument('--collect', dest='collect',
         action='store_const', const=True, default=False,
         help='Stage 7: collect energies to csv file')
 
+    parser.add_argument('--timings', dest='timings',
+        action='store_const', const=True, default=False,
+        help='Stage 7b: collect job timings and parallel efficiency to states.timing')
+
     parser.add_argument('--hose-taylor', dest='hosetaylor',
         action='store_const', const=True, default=False,
         help='Stage 8: assign levels with Hose-Taylor procedure')
@@ -73,6 +85,14 @@ def main_positions():
     parser.add_argument('--clean', dest='clean',
         action='store_const', const=True, default=False,
         help='Final: remove large fort.* files from job folders')
+
+    parser.add_argument('--archive', dest='archive',
+        action='store_const', const=True, default=False,
+        help='_________with --clean: compress wavefunction files to the archive instead of deleting them')
+
+    parser.add_argument('--restore', dest='restore',
+        action='store_const', const=True, default=False,
+        help='Final: restore archived fort.* files to job folders')
         
     args = parser.parse_args() 
     
@@ -110,12 +130,20 @@ def main_positions():
         posit.submit(VARSPACE)
     elif args.check:
         posit.check(VARSPACE)
+    elif args.watch:
+        posit.check(VARSPACE,watch=args.watch)
+    elif args.resubmit_failed:
+        posit.resubmit_failed(VARSPACE)
     elif args.collect:
         parse.collect_states(VARSPACE)
+    elif args.timings:
+        parse.collect_timings(VARSPACE)
     elif args.hosetaylor:
         posit.hosetaylor(VARSPACE)
     elif args.clean:
-        posit.clean(VARSPACE)
+        posit.clean(VARSPACE,archive=args.archive)
+    elif args.restore:
+        posit.restore(VARSPACE)
 
 def main_intensities():
     """ Main driver for intensities"""
@@ -146,10 +174,17 @@ def main_intensities():
         action='store_const', const=True, default=False,
         help='Stage 4b: submit spectra jobs to calculate energy states')
 
+    parser.add_argument('-r', '--campaign', dest='campaign',
+        action='store_const', const=True, default=False,
+        help='Stage 4c: submit energy blocks and transitions as a dependency graph')
+
     parser.add_argument('-c', '--check', dest='check',
         action='store_const', const=True, default=False,
         help='Stage 5: check the status of the submitted jobs')
 
+    parser.add_argument('-w', '--watch', type=int, nargs='?', const=60, default=None,
+        help='Stage 5b: watch the jobs status, print summary every WATCH seconds')
+
     parser.add_argument('-d', '--clear', dest='clear',
         action='store_const', const=True, default=False,
         help='Stage 6: clear job folders from large fort.* files')
@@ -172,8 +207,12 @@ def main_intensities():
         intens.submit(VARSPACE)
     elif args.submit_spectra:
         intens.submit_spectra(VARSPACE)
+    elif args.campaign:
+        campaign.run_campaign(VARSPACE)
     elif args.check:
         intens.check(VARSPACE)
+    elif args.watch:
+        intens.check(VARSPACE,watch=args.watch)
     elif args.clear:
         intens.check(VARSPACE)
     elif args.cancel:
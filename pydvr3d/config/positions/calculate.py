@@ -18,6 +18,64 @@ class Default(ConfigSection):
 # Job time limit.
 {walltime}
 
+# Estimate memory, time limit and number of cores for each block
+# from its basis size (ncores, memory and walltime above are the upper limits).
+# The estimates go to the job.sh header of each block, so they are ignored by
+# the SlurmArray, SlurmPack and Pilot job managers (one header for all blocks).
+{estimate}
+
+# Number of jobs running simultaneously (LocalPool and Pilot job managers only).
+# Empty value means the number of machine cores divided by ncores (LocalPool) or 1 (Pilot).
+{nslots}
+
+# Number of Hose-Taylor processes running at once (--hose-taylor).
+# Empty value means the number of machine cores.
+{hosetaylor_nprocs}
+
+# Number of pilot allocations draining the job queue (Pilot job manager only).
+{npilots}
+
+# Number of blocks running at once as job steps in one allocation (SlurmPack job manager only).
+# Empty value means one block per node.
+{pack_ntasks}
+
+# Number of blocks packed into one allocation (SlurmPack job manager only).
+# Empty value means pack_ntasks.
+{pack_size}
+
+# Maximal number of simultaneously running array tasks (SlurmArray job manager only).
+{array_throttle}
+
+# Maximal size of a single job array, see MaxArraySize in slurm.conf (SlurmArray job manager only).
+{array_max_size}
+
+# Maximal number of automatic resubmissions of a failed block (see --resubmit-failed).
+{max_attempts}
+
+# Submission order of the blocks: file (as in the states file) or cost (most expensive first).
+{submit_order}
+
+# Archive directory for the wavefunction files (see --clean --archive and --restore).
+# The intensities project reads the same key (CALCULATE.archive, relative to root_energies).
+{archive}
+
+# Archive compression: zstd, xz or gzip, empty value means the best available.
+{archive_codec}
+
+# Compression level, empty value means the codec default.
+{archive_level}
+
+# Number of compression threads (zstd and xz only), 0 means all cores.
+{archive_threads}
+
+# Node-local scratch directory for the DVR3DRJZ/ROTLEV runs, e.g. $TMPDIR
+# (shell variables are expanded on the node). Empty value means running in the block folder.
+{scratch}
+
+# Comma-separated files copied back from the scratch besides the outputs, energies.out
+# and the wavefunction files (fort.8/fort.9, fort.26 for J=0). fort.26 is needed to rerun ROTLEV.
+{scratch_keep}
+
 # Default name for the job script.
 {script}
 """
@@ -26,6 +84,22 @@ class Default(ConfigSection):
     __nnodes__type__ = types.Integer
     __memory__type__ = types.Integer
     __walltime__type__ = types.Integer
+    __estimate__type__ = types.Boolean
+    __nslots__type__ = types.Integer
+    __hosetaylor_nprocs__type__ = types.Integer
+    __npilots__type__ = types.Integer
+    __pack_ntasks__type__ = types.Integer
+    __pack_size__type__ = types.Integer
+    __array_throttle__type__ = types.Integer
+    __array_max_size__type__ = types.Integer
+    __max_attempts__type__ = types.Integer
+    __submit_order__type__ = types.String
+    __archive__type__ = types.String
+    __archive_codec__type__ = types.String
+    __archive_level__type__ = types.Integer
+    __archive_threads__type__ = types.Integer
+    __scratch__type__ = types.String
+    __scratch_keep__type__ = types.String
     __script__type__ = types.String
    
     # parameter defaults
@@ -33,4 +107,12 @@ class Default(ConfigSection):
     nnodes = 1
     memory = 10000
     walltime = 24
+    estimate = False
+    array_max_size = 1001
+    npilots = 1
+    max_attempts = 3
+    submit_order = 'file'
+    archive = 'archive'
+    archive_threads = 0
+    scratch_keep = 'fort.26'
     script = 'job.slurm'
@@ -12,17 +12,21 @@ class Default(ConfigSection):
 # Job script name.
 {job_script}
 
-# Job manager: Shell, Slurm, ...
+# Job manager: Shell, Slurm, SlurmArray, SlurmPack, LocalPool, Pilot, PilotLocal, ...
 {job_manager}
 
 # Creation summary.
 {summary}
+
+# Campaign job ledger (SQLite file), empty value => no ledger.
+{ledger}
 """
     # parameter types
     __states__type__ = types.String
     __job_script__type__ = types.String
     __job_manager__type__ = types.String
     __summary__type__ = types.String
+    __ledger__type__ = types.String
     
     # parameter defaults
     states = 'states.txt'
@@ -25,6 +25,9 @@ class Default(ConfigSection):
 {rotlev3z_build_script}
 {rotlev3z_executable}
 {rotlev3z_input_template}
+
+# Hose-Taylor assignment executable.
+{hosetaylor_executable}
 """
     # parameter types
     __dvr3drjz_build_script__type__ = types.String
@@ -39,6 +42,7 @@ class Default(ConfigSection):
     __rotlev3z_build_script__type__ = types.String
     __rotlev3z_executable__type__ = types.String
     __rotlev3z_input_template__type__= types.String
+    __hosetaylor_executable__type__ = types.String
     
     # parameter defaults
     dvr3drjz_build_script = 'build_dvr3drjz.sh'
@@ -53,3 +57,4 @@ class Default(ConfigSection):
     rotlev3z_build_script = 'build_rotlev3z.sh'
     rotlev3z_executable = 'rotlev3z.x'
     rotlev3z_input_template = 'rotlev3z.inp'
+    hosetaylor_executable = 'hosetaylor.x'
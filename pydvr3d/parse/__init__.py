@@ -1 +1,2 @@
 from .collect_states import collect_states
+from .collect_timings import collect_timings
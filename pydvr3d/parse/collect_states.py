@@ -1,6 +1,12 @@
 import re
 import os,sys
+import mmap
+import pickle
+import numpy as np
 import jeanny3
+from concurrent.futures import ThreadPoolExecutor
+
+from .states_store import write_store
 
 """
 === VALID JOB OUTPUT slurm-*.out EXAMPLE ===:
@@ -90,23 +96,76 @@ sys	0m0.014s
 
 # + file "energies.out" should be non-empty
 
+REGEX_JOB_OUTPUT = re.compile('slurm.+\.out')
+REGEX_JOB_ID = re.compile('^slurm-(\d+)(?:_(\d+))?\.out$') # slurm-123.out, slurm-123_4.out (arrays)
+
 def get_job_output_filename(dir):
-    filenames = jeanny3.scandir(dir,'slurm.+\.out')
-    if not filenames: 
+    """
+    Pick the newest job output in the folder: by the job id if all
+    outputs are named by the Slurm job ids, by the mtime otherwise
+    (local, pilot and pack outputs, mixed naming).
+    """
+    try:
+        with os.scandir(dir) as entries:
+            outputs = [entry for entry in entries \
+                if REGEX_JOB_OUTPUT.search(entry.name) and entry.is_file()]
+    except (FileNotFoundError,NotADirectoryError):
         return None
-    filenames = sorted(filenames)
-    filename = filenames[-1] # take the last one (can be not reliable when several runs were performed)
-    return filename
+    if not outputs: 
+        return None
+    lookups = [REGEX_JOB_ID.match(entry.name) for entry in outputs]
+    if all(lookups):
+        key = lambda i: tuple(int(val or 0) for val in lookups[i].groups())
+    else:
+        key = lambda i: outputs[i].stat().st_mtime
+    return outputs[max(range(len(outputs)),key=key)].name
     
-def parse_energies(dir,j,k,i):
+# Columns of energies.out in the file order.
+ENERGY_DTYPE = np.dtype([('n','i4'),('e','f8'),('j','i4'),('p','i4'),('s','i4')])
+
+def to_records(data,dtype,source='<table>',first_line=1):
     """
-    Parse energies.out depending on (j,k,i). See above for examples
-    Return ZPE (None, if not present in file), energies and VTET parities and symmetries.
+    Convert whitespace-separated table to the structured array, numeric columns only.
+    Lines with the wrong number of values (e.g. truncated by a killed job)
+    or non-numeric values are skipped with a warning on the source file;
+    first_line is the line number of the data in the source.
+    """
+    ncols = len(dtype.names)
+    rows = []
+    for lineno,line in enumerate(data.splitlines(),first_line):
+        vals = line.split()
+        if not vals:
+            continue
+        if len(vals)!=ncols:
+            print('WARNING: %s, line %d: %d values instead of %d, skipped'%\
+                (source,lineno,len(vals),ncols))
+            continue
+        rows.append((lineno,vals))
+    try:
+        vals = np.array([vals for _,vals in rows],dtype=np.float64).reshape(-1,ncols)
+    except ValueError: # non-numeric values, find them line by line
+        valid = []
+        for lineno,vals in rows:
+            try:
+                valid.append([float(val) for val in vals])
+            except ValueError:
+                print('WARNING: %s, line %d: non-numeric values, skipped'%(source,lineno))
+        vals = np.array(valid,dtype=np.float64).reshape(-1,ncols)
+    records = np.empty(len(vals),dtype=dtype)
+    for col,name in enumerate(dtype.names):
+        records[name] = vals[:,col]
+    return records
+
+def read_energies(dir,j,k,i):
+    """
+    Read energies.out depending on (j,k,i). See above for examples
+    Return ZPE (None, if not present in file) and structured array
+    of energies with VTET parities and symmetries (see ENERGY_DTYPE).
     """
     # Check if file exists
     filepath = os.path.join(dir,'energies.out')
     if not os.path.isfile(filepath):
-        return None,[]
+        return None,np.empty(0,dtype=ENERGY_DTYPE)
         
     ZPE = None    
     with open(filepath) as f:
@@ -116,39 +175,121 @@ def parse_energies(dir,j,k,i):
             # ZPE is in the first line of the file.
             ZPE = float(line.strip())
         f.readline() # skip header
-        energies = []
-        for line in f:
-            line = line.strip()
-            vals = line.split()
-            energy = {
-                'n':int(vals[0]),
-                'j':int(vals[2]),
-                'p':int(vals[3]),
-                's':int(vals[4]),
-                'e':float(vals[1]),
-                #'ZPE':ZPE,
-            }
-            energies.append(energy)
+        energies = to_records(f.read(),ENERGY_DTYPE,filepath,3)
     return ZPE,energies
 
-def job_failed(dir):
+def parse_energies(dir,j,k,i):
     """
-    Try to search the signs of Fortran errors in the job output file.
-    Using regular expressions.
+    Parse energies.out depending on (j,k,i). See above for examples
+    Return ZPE (None, if not present in file), energies and VTET parities and symmetries.
+    """
+    ZPE,energies = read_energies(dir,j,k,i)
+    names = ENERGY_DTYPE.names
+    return ZPE,[dict(zip(names,row)) for row in energies.tolist()]
+
+def write_states_csv(filename,blocks):
+    """
+    Save energies to csv straight from the arrays.
+    Blocks is the list of (energies,jki,dir), see read_energies.
+    """
+    with open(filename,'w') as f:
+        f.write('n;e;j;p;s;jki;dir\n')
+        for energies,jki,dir in blocks:
+            suffix = (';%s;%s'%(jki,dir)).replace('%','%%')
+            np.savetxt(f,energies,fmt='%d;%.10f;%d;%d;%d'+suffix)
+
+# Failure signatures in the order of priority: (signature, regex on bytes).
+FAILURE_SIGNATURES = [
+    ('forrtl', re.compile(b'forrtl:([^\n]+)')),
+    ('segmentation fault', re.compile(b'segmentation fault',re.IGNORECASE)),
+    # slurm: "*** JOB 123 ON node CANCELLED AT ... DUE TO TIME LIMIT ***"
+    ('time limit', re.compile(b'due to time limit',re.IGNORECASE)),
+    ('out of memory', re.compile(b'oom-kill|exceeded job memory limit',re.IGNORECASE)),
+]
+
+SCAN_CHUNK = 1<<20 # bytes scanned at once
+SCAN_OVERLAP = 4096 # chunks overlap, longer than any matched line
+TRACEBACK_SIZE = 16384 # bytes after the forrtl line searched for the traceback
+
+def parse_traceback(text):
+    """
+    Get the first known location from the Intel Fortran traceback (see above):
+    Image  PC  Routine  Line  Source
+    Return (routine, line, source) or Nones.
+    """
+    lines = text.splitlines()
+    for i,line in enumerate(lines):
+        if line.split()[:3]==['Image','PC','Routine']:
+            for line in lines[i+1:]:
+                vals = line.split()
+                if len(vals)!=5:
+                    break
+                image,pc,routine,lineno,source = vals
+                if source!='Unknown':
+                    return routine,int(lineno),source
+            break
+    return None,None,None
+
+def scan_log(path):
+    """
+    Scan the job output for the failure signatures.
+    The file is memory-mapped and scanned in bounded chunks from the end
+    (the errors are at the tail), stopping at the first chunk with a hit.
+    Return failure record (see detect_failure) or None.
+    """
+    with open(path,'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size==0:
+            return None
+        with mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) as mm:
+            end = size
+            while end>0:
+                start = max(0,end-SCAN_CHUNK)
+                chunk = mm[start:min(size,end+SCAN_OVERLAP)]
+                for signature,regex in FAILURE_SIGNATURES:
+                    lookup = regex.search(chunk)
+                    if not lookup:
+                        continue
+                    record = {'signature':signature,'message':signature,
+                        'routine':None,'line':None,'source':None}
+                    if signature=='forrtl':
+                        record['message'] = lookup.group(1).decode(errors='replace')
+                        pos = start+lookup.start()
+                        text = mm[pos:pos+TRACEBACK_SIZE].decode(errors='replace')
+                        record['routine'],record['line'],record['source'] = parse_traceback(text)
+                    return record
+                end = start
+    return None
+
+def detect_failure(dir):
+    """
+    Search the signs of Fortran errors and Slurm limits in the newest job output.
+    Return None if nothing is found, otherwise the failure record:
+    {'signature','message','routine','line','source','log'}.
+    Absent job output is the failure with "no job output" signature.
     """
-    regex = "forrtl\:([^\n]+)"
     job_output = get_job_output_filename(dir)
     if job_output is None:
-        return 'no job output'
-    with open(os.path.join(dir,job_output)) as f:
-        data = f.read()
-        res = re.search(regex,data)
-        if res:
-            return res.group(1)
-        elif "segmentation fault" in data.lower(): # search specifically for "segmentation fault" entry
-            return 'segmentation fault'
-        else:
-            return None
+        return {'signature':'no job output','message':'no job output',
+            'routine':None,'line':None,'source':None,'log':None}
+    record = scan_log(os.path.join(dir,job_output))
+    if record:
+        record['log'] = job_output
+    return record
+
+def job_failed(dir):
+    """
+    Try to search the signs of Fortran errors in the job output file.
+    Return the error message or None (see detect_failure).
+    """
+    record = detect_failure(dir)
+    return record['message'] if record else None
+
+def format_failure_location(record):
+    """ radint_ (radint.f90:22) """
+    if not record or not record['routine']:
+        return None
+    return '%s (%s:%d)'%(record['routine'],record['source'],record['line'])
     
 #if __name__=="__main__":
 def test():
@@ -192,8 +333,85 @@ def read_states(filename):
                 })
     return states
         
+def collect_block(s):
+    """
+    Read all valuable info from the single folder containing DVR block.
+    Return ZPE, energies and the block (state) statistics.
+    """
+    jki = [s['jrot'],s['kmin'],s['ipar']]; dir = s['name']
+    ZPE,energies = read_energies(dir,*jki)
+    failure = detect_failure(dir)
+    block = {'name':dir,'jrot':s['jrot'],
+        'kmin':s['kmin'],'ipar':s['ipar'],
+        'N':len(energies),'error_msg':failure['message'] if failure else None,
+        'error_location':format_failure_location(failure)}
+    return ZPE,energies,block
+
+# Sidecar cache of the parsed folders; delete it to force the full re-collect.
+COLLECT_CACHE = 'states.cache'
+COLLECT_CACHE_VERSION = 2 # change when the block results change
+
+def get_fingerprint(s):
+    """
+    Fingerprint of the folder: (name, size, mtime) of energies.out,
+    the job outputs and the hose-taylor outputs, plus the (j,k,i) of the block.
+    """
+    dir = s['name']
+    files = []
+    try:
+        with os.scandir(dir) as entries:
+            for entry in entries:
+                name = entry.name
+                if name=='energies.out' or name.endswith('.hose-taylor.out') or \
+                        re.match('slurm.+\.out',name):
+                    st = entry.stat()
+                    files.append((name,st.st_size,st.st_mtime_ns))
+    except (FileNotFoundError,NotADirectoryError):
+        pass
+    return (COLLECT_CACHE_VERSION,s['jrot'],s['kmin'],s['ipar'],tuple(sorted(files)))
+
+def load_cache(filename):
+    if not os.path.isfile(filename):
+        return {}
+    try:
+        with open(filename,'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        print('WARNING: cannot read %s, collecting all folders'%filename)
+        return {}
+
+def save_cache(filename,cache):
+    tmpname = filename+'.tmp'
+    with open(tmpname,'wb') as f:
+        pickle.dump(cache,f,protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmpname,filename)
+
+def collect_blocks(states,nthreads=None,cache=None):
+    """
+    Run collect_block for all states on the thread pool.
+    The work is latency-bound on network filesystems (small reads,
+    directory listings), so the threads overlap the waiting.
+    Results are returned in the order of states.
+    nthreads=None => ThreadPoolExecutor default.
+    If the cache dict {folder: (fingerprint,result)} is given,
+    only the folders with changed fingerprints are parsed
+    and the cache is updated in place.
+    """
+    def collect(s):
+        if cache is None:
+            return collect_block(s)
+        fingerprint = get_fingerprint(s)
+        cached = cache.get(s['name'])
+        if cached and cached[0]==fingerprint:
+            return cached[1]
+        result = collect_block(s)
+        cache[s['name']] = (fingerprint,result)
+        return result
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        return list(executor.map(collect,states))
+
 #if __name__=="__main__":
-def collect_states(VARSPACE):
+def collect_states(VARSPACE,nthreads=None,use_cache=True):
             
     #if len(sys.argv)<2:
     #    print('please supply the file containing folder list (see states.txt as a sample)\n')
@@ -205,22 +423,27 @@ def collect_states(VARSPACE):
     
     ZPEs = set()
     
-    # Loop over each folder containing DVR block, and try to read all valuable info from there.  
-    states_col = jeanny3.Collection()
+    # Only the changed folders are parsed, the rest is taken from the cache.
+    cache = load_cache(COLLECT_CACHE) if use_cache else None
+    if cache is not None:
+        cache = {s['name']:cache[s['name']] for s in states if s['name'] in cache}
+        cached = dict(cache)
+    results = collect_blocks(states,nthreads,cache)
+    if cache is not None:
+        save_cache(COLLECT_CACHE,cache)
+        n_parsed = len([name for name in cache if cache[name] is not cached.get(name)])
+        print('\n%d folders parsed, %d taken from "%s"'%\
+            (n_parsed,len(states)-n_parsed,COLLECT_CACHE))
+    
+    # Read each folder containing DVR block in parallel, merge in the order of states.
+    blocks = []
     blocks_stat = jeanny3.Collection() 
-    for s in states:
-        # Fill energies collection.
+    for s,(ZPE,energies,block) in zip(states,results):
+        # Fill energies arrays.
         jki = [s['jrot'],s['kmin'],s['ipar']]; dir = s['name']
-        ZPE,energies = parse_energies(dir,*jki)
         ZPEs.add(ZPE)
-        col = jeanny3.Collection(); col.update(energies)
-        col.assign('jki',lambda v: jki)
-        col.assign('dir',lambda v: dir)
-        states_col.update(col.getitems())
+        blocks.append((energies,jki,dir))
         # Fill block (state) statistics collection.
-        block = {'name':dir,'jrot':s['jrot'],
-            'kmin':s['kmin'],'ipar':s['ipar'],
-            'N':len(energies),'error_msg':job_failed(dir)}
         blocks_stat.update(block)
         
     ZPEs = ZPEs - {None}
@@ -236,25 +459,30 @@ def collect_states(VARSPACE):
     # The rest of the stated should be normalized by ZPE.
         
     # Subtract ZPE from states (all except the ones given above)
-    ids = states_col.ids(lambda v: v['jki']!=[0, 0, 0] \
-        and v['jki']!=[0, 1, 0] and v['jki']!=[0, 2, 0])
-    states_col.assign('e',lambda v: v['e']-ZPE,IDs=ids)
-        
-    # Display energies as a table.
-    #states_col.tabulate(['n','e','j','p','s','jki'])
+    # (on copies, the cached arrays are kept intact)
+    for ib,(energies,jki,dir) in enumerate(blocks):
+        if jki not in ([0, 0, 0],[0, 1, 0],[0, 2, 0]):
+            energies = energies.copy()
+            energies['e'] -= ZPE
+            blocks[ib] = (energies,jki,dir)
     
-    n_energies = len(states_col.ids())
-    n_valid_states = len(set(states_col.getcol('dir')))
+    n_energies = sum(len(energies) for energies,_,_ in blocks)
+    n_valid_states = len(set(dir for energies,_,dir in blocks if len(energies)))
     n_states = len(states)
     
-    # Save energies collection.
+    # Save energies.
     STATES_FILE = 'states.csv'
-    states_col.order = ['n','e','j','p','s','jki','dir']
-    states_col.export_csv('states.csv')
+    write_states_csv(STATES_FILE,blocks)
     print('\n%d energies from %d states have been saved to "%s". '
           'Total number of states considered: %d'%\
           (n_energies,n_valid_states,STATES_FILE,n_states))
     
+    # Save binary columnar store (see states_store.py).
+    STORE_DIR = 'states.store'
+    write_store(STORE_DIR,blocks,ZPE,blocks_stat.getitems(),
+        provenance={'states_file':os.path.abspath(states_file)})
+    print('\nBinary states store has been saved to "%s"'%STORE_DIR)
+    
     # Save ZPE information.
     ZPE_FILE = 'states.ZPE'
     with open(ZPE_FILE,'w') as f:
@@ -263,7 +491,7 @@ def collect_states(VARSPACE):
         
     # Save statistics on DVR state blocks (calc. folders)
     STAT_FILE= 'states.stat'
-    blocks_stat.order = ['name','jrot','kmin','ipar','N','error_msg']
+    blocks_stat.order = ['name','jrot','kmin','ipar','N','error_msg','error_location']
     blocks_stat.tabulate(file=STAT_FILE)
     print('\nStatistics on DVR state blocks has been saved to "%s"'%STAT_FILE)
     
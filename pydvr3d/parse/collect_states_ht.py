@@ -1,7 +1,11 @@
 import re
 import os,sys
+import numpy as np
 import jeanny3
 
+from .collect_states import to_records
+from ..calc.transitions import get_wavefunction_files
+
 """
 THIS SCRIPT ASSUMES THAT ALL JOBS ARE DONE WITHOUT ERRORS!!!
 
@@ -25,9 +29,13 @@ J, ENERGY, KA, KC, MAX(|<PSI|PSI>|^2),  IPAR, KMIN, MOD(QUANTA OF NU3,2)
 
 """
 
-def parse_hose_taylor_out(dir,wfnfile):
+# Columns of the hose-taylor output in the file order.
+HT_DTYPE = np.dtype([('jrot','i4'),('energy','f8'),('ka','i4'),('kc','i4'),
+    ('maxpsi2','f8'),('ipar','i4'),('kmin','i4'),('nu3odd','i4')])
+
+def read_hose_taylor_out(dir,wfnfile):
     """
-    Parse hose-taylor output file.
+    Read hose-taylor output file to the structured array (see HT_DTYPE).
     Original name of th wavefunction file is stored in wfnfile.
     Allowed names for wfnfile can be:
        fort.8, fort.9, fort.26
@@ -43,46 +51,52 @@ def parse_hose_taylor_out(dir,wfnfile):
     
     # Parse output file.
     with open(filepath) as f:
-        energies = []
-        for line in f:
-            line = line.strip()
-            vals = line.split()
-            energy = {
-                'jrot'    :   int(vals[0]),
-                'energy'  : float(vals[1]),
-                'ka'      :   int(vals[2]),
-                'kc'      :   int(vals[3]),
-                'maxpsi2' : float(vals[4]),
-                'ipar'    :   int(vals[5]),
-                'kmin'    :   int(vals[6]),
-                'nu3odd'  :   int(vals[7]),
-                'wfnfile' : wfnfile,
-            }
-            energies.append(energy)
-    return energies
+        return to_records(f.read(),HT_DTYPE,filepath)
+
+def parse_hose_taylor_out(dir,wfnfile):
+    """
+    Parse hose-taylor output file.
+    Original name of th wavefunction file is stored in wfnfile.
+    Allowed names for wfnfile can be:
+       fort.8, fort.9, fort.26
+    """
+    energies = read_hose_taylor_out(dir,wfnfile)
+    names = HT_DTYPE.names
+    return [dict(zip(names,row),wfnfile=wfnfile) for row in energies.tolist()]
     
+def read_energies(dir,jrot,kmin,ipar):
+    """
+    Read folder according to values of jrot and kmin.
+    Return list of (energies,wfnfile), one array per wavefunction file.
+    """
+    return [(read_hose_taylor_out(dir,wfnfile),wfnfile) \
+        for wfnfile in get_wavefunction_files(jrot,kmin)]
+
 def parse_energies(dir,jrot,kmin,ipar):
     """
     Parse folder according to values of jrot and kmin.
     """
-    
-    # Prepare a list of files to parse.
-    if jrot==0:
-        wfnfiles = ['fort.26']
-    elif kmin==2:
-        wfnfiles = ['fort.8','fort.9']
-    elif kmin in [0,1]:
-        wfnfiles = ['fort.8']
-    else:
-        raise Exception('unknown jrot,kmin configuration: %s'\
-            %str([jrot,kmin]))
             
     # Gather data from all files in one list.
     energies = []    
-    for wfnfile in wfnfiles:
+    for wfnfile in get_wavefunction_files(jrot,kmin):
         energies += parse_hose_taylor_out(dir,wfnfile)
         
     return energies
+
+def write_states_csv(filename,blocks):
+    """
+    Save energies to csv straight from the arrays.
+    Blocks is the list of (energies,wfnfile,dir,jki), see read_energies.
+    """
+    with open(filename,'w') as f:
+        f.write('jrot;energy;ka;kc;maxpsi2;kmin;ipar;nu3odd;wfnfile;dir;jki_dir\n')
+        for energies,wfnfile,dir,jki in blocks:
+            suffix = (';%s;%s;%s'%(wfnfile,dir,jki)).replace('%','%%')
+            columns = [energies[name] for name in \
+                ['jrot','energy','ka','kc','maxpsi2','kmin','ipar','nu3odd']]
+            np.savetxt(f,np.column_stack(columns),
+                fmt='%d;%.5f;%d;%d;%.5f;%d;%d;%d'+suffix)
         
 
 #if __name__=="__main__":
@@ -131,33 +145,31 @@ if __name__=="__main__":
     states = read_states(states_file)
     
     # Loop over each folder containing DVR block, and try to read all valuable info from there.  
-    states_col = jeanny3.Collection()
+    blocks = []
     blocks_stat = jeanny3.Collection() 
     for s in states:
-        # Fill energies collection.
+        # Fill energies arrays.
         jki = [s['jrot'],s['kmin'],s['ipar']]; dir = s['name']
-        energies = parse_energies(dir,*jki)
-        col = jeanny3.Collection(); col.update(energies)
-        col.assign('jki_dir',lambda v: jki)
-        col.assign('dir',lambda v: dir)
-        states_col.update(col.getitems())
+        N = 0
+        for energies,wfnfile in read_energies(dir,*jki):
+            blocks.append((energies,wfnfile,dir,jki))
+            N += len(energies)
         # Fill block (state) statistics collection.
         block = {'name':dir,'jrot':s['jrot'],
             'kmin':s['kmin'],'ipar':s['ipar'],
-            'N':len(energies)}
+            'N':N}
         blocks_stat.update(block)
         
         
     # Display energies as a table.
     
-    n_energies = len(states_col.ids())
-    n_valid_states = len(set(states_col.getcol('dir')))
+    n_energies = sum(len(energies) for energies,_,_,_ in blocks)
+    n_valid_states = len(set(dir for energies,_,dir,_ in blocks if len(energies)))
     n_states = len(states)
     
-    # Save energies collection.
+    # Save energies.
     STATES_FILE = 'states_ht.csv'
-    states_col.order = ['jrot','energy','ka','kc','maxpsi2','kmin','ipar','nu3odd','wfnfile','dir','jki_dir']
-    states_col.export_csv(STATES_FILE)
+    write_states_csv(STATES_FILE,blocks)
     print('\n%d energies from %d states have been saved to "%s". '
           'Total number of states considered: %d'%\
           (n_energies,n_valid_states,STATES_FILE,n_states))
@@ -0,0 +1,193 @@
+import re
+import os,sys
+import jeanny3
+
+from .collect_states import get_job_output_filename, read_states
+from ..calc.positions import slice
+
+"""
+=== JOB OUTPUT slurm-*.out WITH TIMINGS ===:
+
+OMP_NUM_THREADS=10
+running dvr3drjz ...
+dvr3drjz ok
+
+real	31m34.832s
+user	320m48.912s
+sys	4m50.213s
+running rotlev3b ...
+rotlev3b ok
+
+real	0m34.503s
+user	0m53.940s
+sys	0m1.211s
+
+POSIX format (time -p) is also accepted:
+
+real 1894.83
+user 19248.91
+sys 290.21
+"""
+
+"""
+DVR3DRJZ INPUT, LINE 5 (FORMAT: 11I5):
+npnt2 jrot neval nalf max2d max3d idia kmin npnt1 ipar [max3d2]
+   40    1  100   60  500 1000   -2    0   40    0
+
+ROTLEV INPUT, LINE 2 (FORMAT: I5):
+nvib neval kmin [ibass neval2 npnt]
+ 9999 9999    2
+
+The fields are fixed-width, 5-digit values run together (e.g. "1200012000"),
+so the lines are sliced as in DVR3DRJZ.load_input, not split on spaces.
+"""
+
+REGEX_STEP = re.compile('running\s+(\S+)\s+\.\.\.')
+REGEX_TIME = re.compile('^(real|user|sys)\s+(?:(\d+)m)?([\d\.]+)s?\s*$')
+REGEX_THREADS = re.compile('OMP_NUM_THREADS=(?:\$\{OMP_NUM_THREADS:-)?(\d+)')
+REGEX_CORES = re.compile('#SBATCH\s+-c\s+(\d+)')
+
+def parse_timings(path):
+    """
+    Parse time output for each step of the job.
+    Return dictionary {step: {'real':..,'user':..,'sys':..}} in seconds,
+    and the number of threads found in the log (None if absent).
+    """
+    timings = {}
+    nthreads = None
+    step = None
+    with open(path,errors='replace') as f:
+        for line in f:
+            lookup = REGEX_STEP.search(line)
+            if lookup:
+                step = lookup.group(1)
+                continue
+            lookup = REGEX_TIME.match(line.strip())
+            if lookup and step:
+                key,minutes,seconds = lookup.groups()
+                seconds = float(seconds) + (int(minutes)*60 if minutes else 0)
+                timings.setdefault(step,{})[key] = seconds
+                continue
+            if nthreads is None:
+                lookup = REGEX_THREADS.match(line.strip())
+                if lookup:
+                    nthreads = int(lookup.group(1))
+    return timings,nthreads
+
+def get_job_cores(dir,job_script):
+    """
+    Get number of cores from the job script:
+    OMP_NUM_THREADS export first, then "#SBATCH -c".
+    """
+    path = os.path.join(dir,job_script)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        data = f.read()
+    for regex in [REGEX_THREADS,REGEX_CORES]:
+        lookup = regex.search(data)
+        if lookup:
+            return int(lookup.group(1))
+    return None
+
+def read_basis(dir,dvr3drjz_input,rotlev_input):
+    """
+    Get basis sizes from the DVR3DRJZ and ROTLEV input files (see above).
+    Absent values are None.
+    """
+    def to_ints(line,nfields):
+        return [int(piece) if piece.strip() else None \
+            for piece in slice(line.rstrip('\r\n'),[5]*nfields)]
+
+    basis = {'npnt1':None,'npnt2':None,'nalf':None,'max2d':None,'max3d':None,
+             'neval':None,'nvib':None,'ibass':None}
+    path = os.path.join(dir,dvr3drjz_input)
+    if os.path.isfile(path):
+        with open(path) as f:
+            lines = f.readlines()
+        vals = to_ints(lines[4],11)
+        basis['npnt2'] = vals[0]
+        basis['neval'] = vals[2]
+        basis['nalf'] = vals[3]
+        basis['max2d'] = vals[4]
+        basis['max3d'] = vals[5]
+        basis['npnt1'] = vals[8]
+    path = os.path.join(dir,rotlev_input) if rotlev_input else None
+    if path and os.path.isfile(path):
+        with open(path) as f:
+            lines = f.readlines()
+        vals = to_ints(lines[1],6)
+        basis['nvib'] = vals[0]
+        basis['ibass'] = vals[3]
+    return basis
+
+def get_efficiency(timing,ncores):
+    """ Parallel efficiency: user time / real time / number of cores. """
+    if not timing or not ncores or not timing.get('real'):
+        return None
+    return timing.get('user',0.0)/timing['real']/ncores
+
+def collect_block_timings(dir,jrot,kmin,ipar,
+        job_script='job.sh',dvr3drjz_input='dvr3drjz.inp',rotlev_input=None):
+    """
+    Collect timings and basis sizes for the single DVR block (folder).
+    """
+    block = {'name':dir,'jrot':jrot,'kmin':kmin,'ipar':ipar}
+    block.update(read_basis(dir,dvr3drjz_input,rotlev_input))
+    timings,nthreads = {},None
+    job_output = get_job_output_filename(dir) if os.path.isdir(dir) else None
+    if job_output:
+        timings,nthreads = parse_timings(os.path.join(dir,job_output))
+    ncores = nthreads or get_job_cores(dir,job_script)
+    block['ncores'] = ncores
+    real = 0.0; user = 0.0; cpu = 0.0
+    for step,prefix in [('dvr3drjz','dvr'),('rotlev','rot')]:
+        # rotlev step can be named rotlev3, rotlev3b, rotlev3z
+        timing = None
+        for name in timings:
+            if name.startswith(step):
+                timing = timings[name]
+        block['%s_real'%prefix] = timing.get('real') if timing else None
+        block['%s_cpu'%prefix] = timing.get('user',0.0)+timing.get('sys',0.0) \
+            if timing else None
+        block['%s_eff'%prefix] = get_efficiency(timing,ncores)
+        if timing:
+            real += timing.get('real',0.0)
+            user += timing.get('user',0.0)
+            cpu += timing.get('user',0.0)+timing.get('sys',0.0)
+    block['real'] = real if timings else None
+    block['cpu'] = cpu if timings else None
+    block['eff'] = user/real/ncores if timings and real and ncores else None
+    return block
+
+def collect_timings(VARSPACE):
+    """
+    Collect timings for all DVR blocks and save them to states.timing.
+    Times are in seconds.
+    """
+    states = read_states(VARSPACE['CREATE']['states'])
+    job_script = VARSPACE['CREATE']['job_script']
+    dvr3drjz_input = VARSPACE['RESOURCES']['dvr3drjz_input_template']
+    rotlev_inputs = [VARSPACE['RESOURCES']['%s_input_template'%name] \
+        for name in ['rotlev3b','rotlev3','rotlev3z']]
+
+    blocks = jeanny3.Collection()
+    for s in states:
+        dir = s['name']
+        rotlev_input = None
+        for name in rotlev_inputs:
+            if name and os.path.isfile(os.path.join(dir,name)):
+                rotlev_input = name
+        block = collect_block_timings(dir,s['jrot'],s['kmin'],s['ipar'],
+            job_script,dvr3drjz_input,rotlev_input)
+        blocks.update(block)
+
+    TIMING_FILE = 'states.timing'
+    blocks.order = ['name','jrot','kmin','ipar','npnt1','npnt2','nalf','max3d','neval',
+        'nvib','ibass','ncores','dvr_real','dvr_cpu','dvr_eff','rot_real','rot_cpu','rot_eff',
+        'real','cpu','eff']
+    blocks.floatfmt = '.2f'
+    blocks.tabulate(file=TIMING_FILE)
+    n_timed = len([block for block in blocks.getitems() if block['real'] is not None])
+    print('\nTimings for %d of %d DVR blocks have been saved to "%s"'%\
+        (n_timed,len(states),TIMING_FILE))
@@ -1,5 +1,6 @@
 import re
 import os,sys
+import numpy as np
 import jeanny3
 
 """
@@ -159,18 +160,127 @@ def parse_single_case(path,dipole3b_out,spectra_out):
     
     spectra_col.tabulate()
 
-if __name__=='__main__':
-    
-    col_dipole3b = jeanny3.Collection();
-    col_spectra = jeanny3.Collection();
-    blocks_stat = jeanny3.Collection();
+"""
+=== STREAMING COLLECTION ===
 
-    if len(sys.argv)<2:
-        print('please supply the file containing folder list (see transitions.txt as a sample)\n')
-        sys.exit()
+The line lists are read in chunks of CHUNK_SIZE lines, each chunk is
+converted to typed column arrays and appended to the output file,
+so the memory is bounded by the chunk size, not by the line list size.
+Output is CSV (default) or Parquet (needs pyarrow).
+"""
 
-    # Read transitions file
-    trans_file = sys.argv[1]
+CHUNK_SIZE = 100000
+
+# (column name, dtype, column index in the output line)
+DIPOLE3B_COLUMNS = [
+    ('ie1','i4',0),('ie2','i4',1),('ket_energy','f8',2),('bra_energy','f8',3),
+    ('frequency','f8',4),('z_transition','f8',5),('x_transition','f8',6),
+    ('dipole','f8',7),('s_fi','f8',8),('a_coefficient','f8',9),
+]
+DIPOLE3B_FMT = ['%d','%d','%.3f','%.3f','%.3f','%.6E','%.6E','%.6E','%.6E','%.6E']
+
+SPECTRA_COLUMNS = [
+    ('frequency','f8',9),('intensity','f8',11),('e_lower','f8',8),
+    ('ipar','i4',0),('j','i4',1),('p','i4',2),('i','i4',3),
+    ('j_','i4',4),('p_','i4',5),('i_','i4',6),
+]
+SPECTRA_FMT = ['%.6f','%.6E','%.6f','%d','%d','%d','%d','%d','%d','%d']
+
+REGEXP_HEADER_DIPOLE3B = '\s+ie1\s+ie2\s+ket\s+energy\s+bra\s+energy\s+frequency\s+z\s+transition\s+x\s+transition\s+dipole\s+s\(f-i\)\s+a-coefficient'
+REGEXP_HEADER_SPECTRA = 'ipar\s+j2\s+p2\s+i2\s+j1\s+p1\s+i1\s+e2\s+e1\s+freq\s+s\(f-i\)\s+abs\s+i\(w\)\s+rel\s+i\(w\)\s+a\(if\)'
+
+def is_numeric(vals):
+    try:
+        [float(val) for val in vals]
+        return True
+    except ValueError:
+        return False
+
+def to_columns(rows,columns):
+    """ Convert list of split lines to dict of typed column arrays. """
+    try:
+        vals = np.array(rows,dtype=np.float64)
+    except ValueError: # junk lines in the chunk, filter them out
+        vals = np.array([row for row in rows if is_numeric(row)],dtype=np.float64)
+    vals = vals.reshape(-1,len(rows[0]) if rows else 0)
+    return {name:vals[:,index].astype(dtype) for name,dtype,index in columns}
+
+def iter_chunks(path,regexp_header,columns,chunk_size=CHUNK_SIZE):
+    """
+    Read the table after the header line in chunks.
+    Yield dict of column arrays for each chunk.
+    Lines which do not fit the table are skipped.
+    """
+    ncols = max(index for _,_,index in columns)+1
+    with open(path) as f:
+        for line in f:
+            if re.match(regexp_header,line):
+                break
+        rows = []
+        for line in f:
+            vals = line.split()
+            if len(vals)<ncols:
+                continue
+            vals = vals[:ncols]
+            rows.append(vals)
+            if len(rows)>=chunk_size:
+                yield to_columns(rows,columns)
+                rows = []
+        if rows:
+            yield to_columns(rows,columns)
+
+def iter_dipole3b(path,chunk_size=CHUNK_SIZE):
+    return iter_chunks(path,REGEXP_HEADER_DIPOLE3B,DIPOLE3B_COLUMNS,chunk_size)
+
+def iter_spectra(path,chunk_size=CHUNK_SIZE):
+    return iter_chunks(path,REGEXP_HEADER_SPECTRA,SPECTRA_COLUMNS,chunk_size)
+
+class CsvWriter:
+    """ Appends the chunks to the csv file (semicolon-delimited). """
+
+    def __init__(self,filename,columns,fmt):
+        self.filename = filename
+        self.names = [name for name,_,_ in columns]
+        self.fmt = fmt
+        self.f = open(filename,'w')
+        self.f.write(';'.join(self.names+['dir','job_id'])+'\n')
+
+    def write(self,chunk,dir,job_id):
+        suffix = (';%s;%s'%(dir,job_id)).replace('%','%%')
+        np.savetxt(self.f,np.column_stack([chunk[name] for name in self.names]),
+            fmt=';'.join(self.fmt)+suffix)
+
+    def close(self):
+        self.f.close()
+
+class ParquetWriter:
+    """ Appends the chunks as row groups to the Parquet file. """
+
+    def __init__(self,filename,columns,fmt=None):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.filename = filename
+        self.names = [name for name,_,_ in columns]
+        fields = [pa.field(name,pa.from_numpy_dtype(np.dtype(dtype))) \
+            for name,dtype,_ in columns]
+        fields += [pa.field('dir',pa.string()),pa.field('job_id',pa.string())]
+        self.schema = pa.schema(fields)
+        self.writer = pq.ParquetWriter(filename,self.schema)
+
+    def write(self,chunk,dir,job_id):
+        pa = self.pa
+        n = len(chunk[self.names[0]])
+        arrays = [pa.array(chunk[name]) for name in self.names]
+        arrays += [pa.array([dir]*n,pa.string()),pa.array([job_id]*n,pa.string())]
+        self.writer.write_table(pa.Table.from_arrays(arrays,schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+WRITERS = {'csv':CsvWriter,'parquet':ParquetWriter}
+
+def read_transitions_summary(trans_file):
     trans_summary = []
     with open(trans_file) as f:
         print('skiping 1st line in %s'%trans_file)
@@ -180,32 +290,64 @@ if __name__=='__main__':
             if line.lstrip()[0]=='#': continue
             vals = line.split()
             trans_summary.append({'id':vals[0],'dir':vals[1]})
-        
+    return trans_summary
+
+def collect_transitions(trans_file,fmt='csv',chunk_size=CHUNK_SIZE):
+    """
+    Stream dipole3b.out and spectra.out from all transition folders
+    to dipole3b.<fmt> and spectra.<fmt>, save statistics to transitions.stat.
+    """
+    if fmt not in WRITERS:
+        raise Exception('unknown format "%s" (expected one of: %s)'%(fmt,', '.join(WRITERS)))
+    Writer = WRITERS[fmt]
+    
+    trans_summary = read_transitions_summary(trans_file)
+    blocks_stat = jeanny3.Collection();
+
+    DIP_FILE = 'dipole3b.%s'%fmt
+    SPE_FILE = 'spectra.%s'%fmt
+    dip_writer = Writer(DIP_FILE,DIPOLE3B_COLUMNS,DIPOLE3B_FMT)
+    spe_writer = Writer(SPE_FILE,SPECTRA_COLUMNS,SPECTRA_FMT)
+    
     # Cycle through all folders given in the input file
-    for t in trans_summary:
-        print('reading',t)
-        # parse diplole3b
-        col_dip = parse_dipole3b(os.path.join(t['dir'],'dipole3b.out'))
-        col_dip.assign('job_id',lambda v: t['id'])
-        col_dipole3b.update(col_dip.getitems())
-        # parse spectra
-        col_spe = parse_spectra(os.path.join(t['dir'],'spectra.out'))    
-        col_spe.assign('job_id',lambda v: t['id'])
-        col_spectra.update(col_spe.getitems())
-        # Fill block (state) statistics collection.
-        block = {'id':t['id'],'name':t['dir'],
-            'N_dip':len(col_dip.ids()),'N_spe':len(col_spe.ids())}
-        blocks_stat.update(block)
-    
-    # Save col_dipole3b
-    DIP_FILE = 'dipole3b.csv'
-    col_dipole3b.export_csv(DIP_FILE)
-    print('\nStatistics on DVR dipole blocks has been saved to "%s"'%DIP_FILE)
-    
-    # Save col_spectra
-    SPE_FILE = 'spectra.csv'
-    col_spectra.export_csv(SPE_FILE)
-    print('\nStatistics on DVR spectra blocks has been saved to "%s"'%SPE_FILE)
+    try:
+        for t in trans_summary:
+            print('reading',t)
+            N_dip = 0; N_spe = 0
+            path = os.path.join(t['dir'],'dipole3b.out')
+            if os.path.isfile(path):
+                for chunk in iter_dipole3b(path,chunk_size):
+                    dip_writer.write(chunk,t['dir'],t['id'])
+                    N_dip += len(chunk['ie1'])
+            path = os.path.join(t['dir'],'spectra.out')
+            if os.path.isfile(path):
+                for chunk in iter_spectra(path,chunk_size):
+                    spe_writer.write(chunk,t['dir'],t['id'])
+                    N_spe += len(chunk['frequency'])
+            # Fill block (state) statistics collection.
+            block = {'id':t['id'],'name':t['dir'],'N_dip':N_dip,'N_spe':N_spe}
+            blocks_stat.update(block)
+    finally:
+        dip_writer.close()
+        spe_writer.close()
+    
+    print('\nDipole moments have been saved to "%s"'%DIP_FILE)
+    print('\nTransitions have been saved to "%s"'%SPE_FILE)
+    
+    return blocks_stat
+
+if __name__=='__main__':
+    
+    if len(sys.argv)<2:
+        print('please supply the file containing folder list (see transitions.txt as a sample)\n')
+        print('usage: python -m pydvr3d.parse.collect_transitions transitions.txt [csv|parquet]')
+        sys.exit()
+
+    # Read transitions file
+    trans_file = sys.argv[1]
+    fmt = sys.argv[2] if len(sys.argv)>2 else 'csv'
+    
+    blocks_stat = collect_transitions(trans_file,fmt)
     
     # Save statistics on DVR transition blocks (calc. folders)
     STAT_FILE= 'transitions.stat'
@@ -0,0 +1,160 @@
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import numpy as np
+
+"""
+BINARY COLUMNAR STATES STORE
+
+Directory with one .npy file per column and a JSON header:
+
+    states.store/
+        header.json     ZPE, blocks metadata, provenance
+        n.npy  e.npy  j.npy  p.npy  s.npy
+
+Levels are stored block after block in the order of the states file,
+header["blocks"] keeps the row range of each block:
+
+    {"name": "jki_0100f", "jrot": 1, "kmin": 0, "ipar": 0,
+     "start": 120, "stop": 250, "jmin": 1, "jmax": 1, "error_msg": null}
+
+jmin/jmax (range of the j column in the block) let the reader
+skip the blocks which cannot contain the requested J.
+
+Energies are ZPE-normalized, the same as in states.csv.
+The columns are memory-mapped by the reader, so opening
+the store does not depend on the number of levels.
+"""
+
+COLUMNS = ['n','e','j','p','s']
+HEADER_FILE = 'header.json'
+FORMAT_VERSION = 1
+
+def write_store(path,blocks,ZPE,stats=None,provenance=None):
+    """
+    Save levels to the store.
+    Blocks is the list of (energies,jki,dir), see collect_states.read_energies.
+    Stats is the optional list of block statistics dicts (error_msg is taken from there).
+    The store is written to a temporary directory and then moved in place.
+    """
+    stats = {stat['name']:stat for stat in stats or []}
+    header = {
+        'format_version': FORMAT_VERSION,
+        'ZPE': ZPE,
+        'columns': COLUMNS,
+        'blocks': [],
+        'provenance': {
+            'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'hostname': socket.gethostname(),
+            'cwd': os.getcwd(),
+            'argv': sys.argv,
+        },
+    }
+    header['provenance'].update(provenance or {})
+    start = 0
+    for energies,jki,dir in blocks:
+        stop = start+len(energies)
+        header['blocks'].append({'name':dir,'jrot':jki[0],'kmin':jki[1],'ipar':jki[2],
+            'start':start,'stop':stop,
+            'jmin':int(energies['j'].min()) if len(energies) else None,
+            'jmax':int(energies['j'].max()) if len(energies) else None,
+            'error_msg':stats.get(dir,{}).get('error_msg')})
+        start = stop
+    tmppath = path+'.tmp'
+    if os.path.isdir(tmppath):
+        shutil.rmtree(tmppath)
+    os.makedirs(tmppath)
+    for name in COLUMNS:
+        if blocks:
+            column = np.concatenate([energies[name] for energies,_,_ in blocks])
+        else:
+            column = np.empty(0)
+        np.save(os.path.join(tmppath,name+'.npy'),column)
+    with open(os.path.join(tmppath,HEADER_FILE),'w') as f:
+        json.dump(header,f,indent=1)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.rename(tmppath,path)
+
+class StatesStore:
+    """
+    Reader for the states store.
+    Columns are memory-mapped on the first access:
+
+        store = StatesStore('states.store')
+        store.ZPE, store.blocks
+        e = store['e']
+        levels = store.select(j=[10,11],p=0,emin=1000,emax=2000)
+    """
+
+    def __init__(self,path='states.store'):
+        self.path = path
+        with open(os.path.join(path,HEADER_FILE)) as f:
+            self.header = json.load(f)
+        if self.header['format_version']>FORMAT_VERSION:
+            raise Exception('unsupported states store version: %d'%\
+                self.header['format_version'])
+        self.ZPE = self.header['ZPE']
+        self.blocks = self.header['blocks']
+        self.provenance = self.header['provenance']
+        self.columns = {}
+
+    def __getitem__(self,name):
+        if name not in self.columns:
+            if name not in self.header['columns']:
+                raise KeyError(name)
+            self.columns[name] = np.load(os.path.join(self.path,name+'.npy'),mmap_mode='r')
+        return self.columns[name]
+
+    def __len__(self):
+        return self.blocks[-1]['stop'] if self.blocks else 0
+
+    def get_block(self,name):
+        """ Return dict of the column slices for the block (folder) name. """
+        for block in self.blocks:
+            if block['name']==name:
+                return {col:self[col][block['start']:block['stop']] \
+                    for col in self.header['columns']}
+        raise KeyError(name)
+
+    def get_index(self,j=None,p=None,s=None,emin=None,emax=None):
+        """
+        Return row indices of the levels matching all the given filters.
+        j, p, s are single values or lists of values, energies are inclusive.
+        J filter selects the blocks first (see jmin/jmax), so only their rows are touched.
+        """
+        as_list = lambda val: None if val is None else \
+            list(val) if isinstance(val,(list,tuple,set,np.ndarray)) else [val]
+        j,p,s = as_list(j),as_list(p),as_list(s)
+        if j is None:
+            ranges = [(0,len(self))]
+        else:
+            ranges = [(block['start'],block['stop']) for block in self.blocks \
+                if block['stop']>block['start'] and \
+                any(block['jmin']<=val<=block['jmax'] for val in j)]
+        index = []
+        for start,stop in ranges:
+            mask = np.ones(stop-start,dtype=bool)
+            if j is not None:
+                mask &= np.isin(self['j'][start:stop],j)
+            if p is not None:
+                mask &= np.isin(self['p'][start:stop],p)
+            if s is not None:
+                mask &= np.isin(self['s'][start:stop],s)
+            if emin is not None or emax is not None:
+                e = self['e'][start:stop]
+                if emin is not None:
+                    mask &= e>=emin
+                if emax is not None:
+                    mask &= e<=emax
+            index.append(np.flatnonzero(mask)+start)
+        return np.concatenate(index) if index else np.empty(0,dtype=np.int64)
+
+    def select(self,j=None,p=None,s=None,emin=None,emax=None,columns=None):
+        """ Return dict of the columns (in-memory arrays) for the matching levels. """
+        index = self.get_index(j,p,s,emin,emax)
+        columns = columns or self.header['columns']
+        return {col:self[col][index] for col in columns}
@@ -0,0 +1,231 @@
+import os,sys
+import numpy as np
+
+"""
+READER FOR THE FORTRAN UNFORMATTED WAVEFUNCTION FILES
+(DVR3DRJZ: fort.26, ROTLEV: fort.8, fort.9)
+
+Sequential unformatted files consist of records, each record
+is surrounded by the markers holding its length in bytes:
+
+    | len | ... len bytes of data ... | len |
+
+Markers are 4-byte integers (gfortran, ifort), 8-byte markers
+of the old compilers are detected as well. Records longer than 2 GB
+are split by gfortran into subrecords with the negative markers.
+
+The file is memory-mapped, only the markers are read while indexing,
+so opening a 10+ GB file costs a few pages per record.
+
+LAYOUT OF THE WAVEFUNCTION FILES (as read by DIPOLE3B and ROTLEV)
+
+    record 1:        idia, ipar, lmax, npnt1, npnt2, jrot, kmin, neval, ...
+    records 2..:     model, masses, grids, dimensions
+    then for each k block (ROTLEV files have a single block):
+        eigenvalues  (nlevels x float64, Hartree)
+        eigenvectors (nlevels records of nbass x float64)
+
+The blocks are located from the end of the file: the trailing run of
+equal-sized records are the eigenvectors, the record before them holding
+as many non-decreasing float64 values as there are vectors is the eigenvalues.
+Eigenvectors of the block are returned as a strided view on the map
+(nlevels x nbass), no data is read until the elements are accessed.
+"""
+
+HEADER_FIELDS = ['idia','ipar','lmax','npnt1','npnt2','jrot','kmin','neval']
+HARTREE_TO_CM = 219474.6313705 # cm-1 per Hartree
+
+def get_marker(data,pos,size,dtype):
+    return int(np.frombuffer(data,dtype=dtype,count=1,offset=pos)[0])
+
+class FortranFile:
+    """
+    Index of the records of the unformatted sequential file.
+    Each record is the list of its (offset,length) segments,
+    segments are more than one for the split records only.
+    """
+
+    def __init__(self,path):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.data = np.memmap(path,dtype=np.uint8,mode='r') if self.size else \
+            np.empty(0,dtype=np.uint8)
+        self.marker_size,self.marker_dtype = self.detect_markers()
+        self.byteorder = self.marker_dtype[0]
+        self.records = self.index_records()
+
+    def detect_markers(self):
+        """ Find the marker size and byte order matching the first record. """
+        for size,dtype in [(4,'<i4'),(4,'>i4'),(8,'<i8'),(8,'>i8')]:
+            if self.size<2*size:
+                continue
+            length = abs(get_marker(self.data,0,size,dtype))
+            if length+2*size<=self.size and \
+                    abs(get_marker(self.data,size+length,size,dtype))==length:
+                return size,dtype
+        raise Exception('%s: not a Fortran unformatted sequential file'%self.path)
+
+    def index_records(self):
+        records = []
+        pos = 0
+        size,dtype = self.marker_size,self.marker_dtype
+        while pos<self.size:
+            segments = []
+            while True:
+                if pos+size>self.size:
+                    raise Exception('%s: truncated marker of record %d at byte %d'%\
+                        (self.path,len(records)+1,pos))
+                head = get_marker(self.data,pos,size,dtype)
+                length = abs(head)
+                if pos+2*size+length>self.size:
+                    raise Exception('%s: truncated record %d at byte %d (%d bytes expected, %d left)'%\
+                        (self.path,len(records)+1,pos,length,self.size-pos-size))
+                if abs(get_marker(self.data,pos+size+length,size,dtype))!=length:
+                    raise Exception('%s: corrupted markers of record %d at byte %d'%\
+                        (self.path,len(records)+1,pos))
+                segments.append((pos+size,length))
+                pos += 2*size+length
+                if head>=0: # negative head marker => the record continues
+                    break
+            records.append(segments)
+        return records
+
+    def __len__(self):
+        return len(self.records)
+
+    def get_length(self,i):
+        """ Length of the record in bytes. """
+        return sum(length for _,length in self.records[i])
+
+    def read(self,i,dtype=np.float64):
+        """
+        Return record as the array of dtype.
+        Single-segment records are the views on the map (no copy).
+        """
+        dtype = np.dtype(dtype).newbyteorder(self.byteorder)
+        segments = self.records[i]
+        if len(segments)==1:
+            offset,length = segments[0]
+            return np.frombuffer(self.data,dtype=dtype,
+                count=length//dtype.itemsize,offset=offset)
+        data = np.concatenate([self.data[offset:offset+length] for offset,length in segments])
+        return data.view(dtype)
+
+class WavefunctionFile(FortranFile):
+    """
+    Wavefunction file of the DVR3DRJZ or ROTLEV (see the layout above):
+
+        wfn = WavefunctionFile('jki_0100f/fort.8')
+        wfn.header['jrot'], wfn.header['neval']
+        wfn.get_eigenvalues()           # all blocks, Hartree
+        vecs = wfn.get_eigenvectors(0)  # lazy view (nlevels x nbass)
+        vecs[5]                         # reads the 6th vector only
+    """
+
+    def __init__(self,path):
+        FortranFile.__init__(self,path)
+        self.header = self.read_header()
+        self.blocks = self.find_blocks()
+
+    def read_header(self):
+        if not self.records:
+            raise Exception('%s: empty file'%self.path)
+        vals = self.read(0,np.int32)
+        if len(vals)<len(HEADER_FIELDS):
+            raise Exception('%s: header record is too short (%d values)'%(self.path,len(vals)))
+        header = {name:int(val) for name,val in zip(HEADER_FIELDS,vals)}
+        header['extra'] = [int(val) for val in vals[len(HEADER_FIELDS):]]
+        return header
+
+    def is_eigenvalue_record(self,i,nlevels):
+        """ Check if record i holds nlevels non-decreasing float64 values. """
+        if len(self.records[i])>1 or self.get_length(i)!=8*nlevels:
+            return False
+        values = self.read(i)
+        return bool(np.all(np.isfinite(values)) and np.all(np.diff(values)>=0))
+
+    def find_blocks(self):
+        """
+        Locate the blocks of eigenvalues and eigenvectors, going from the end.
+        Return list of dicts {'record','nlevels','nbass'} in the file order.
+        """
+        blocks = []
+        end = len(self.records) # records of the current block are before end
+        while end>2:
+            vector_length = self.get_length(end-1)
+            if vector_length==0 or vector_length%8:
+                break
+            block = None
+            i = end-2
+            while i>=1 and len(self.records[i+1])==1:
+                if self.is_eigenvalue_record(i,end-1-i):
+                    block = {'record':i,'nlevels':end-1-i,'nbass':vector_length//8}
+                    break
+                if self.get_length(i)!=vector_length:
+                    break
+                i -= 1
+            if block is None:
+                break
+            blocks.insert(0,block)
+            end = i
+        return blocks
+
+    def get_eigenvalues(self,block=None):
+        """ Eigenvalues of the block (all blocks if None), Hartree. """
+        if block is not None:
+            return np.array(self.read(self.blocks[block]['record']))
+        if not self.blocks:
+            return np.empty(0)
+        return np.concatenate([self.read(b['record']) for b in self.blocks])
+
+    def get_eigenvectors(self,block=0):
+        """
+        Strided view (nlevels x nbass) on the eigenvector records of the block.
+        Rows are separated by the record markers, so nothing is copied.
+        """
+        b = self.blocks[block]
+        offset = self.records[b['record']+1][0][0]
+        stride = b['nbass']*8+2*self.marker_size
+        dtype = np.dtype('f8').newbyteorder(self.byteorder)
+        return np.ndarray(shape=(b['nlevels'],b['nbass']),dtype=dtype,
+            buffer=self.data,offset=offset,strides=(stride,8))
+
+    def get_energies(self,ZPE=None):
+        """ Eigenvalues in cm-1, relative to ZPE if given. """
+        energies = self.get_eigenvalues()*HARTREE_TO_CM
+        return energies-ZPE if ZPE is not None else energies
+
+def check_wavefunction_file(path):
+    """
+    Validate the wavefunction file: consistent record markers, the header
+    and at least one complete block of eigenvectors.
+    Return the error message or None if the file is valid.
+    """
+    if not os.path.isfile(path):
+        return '%s: no such file'%path
+    try:
+        wfn = WavefunctionFile(path)
+    except Exception as e:
+        return str(e)
+    if not wfn.blocks:
+        return '%s: no eigenvectors found'%path
+    return None
+
+if __name__=="__main__":
+
+    if len(sys.argv)<2:
+        print('please supply the wavefunction files (fort.8, fort.9, fort.26)\n')
+        sys.exit()
+
+    for path in sys.argv[1:]:
+        error = check_wavefunction_file(path)
+        if error:
+            print('ERROR: %s'%error)
+            continue
+        wfn = WavefunctionFile(path)
+        print('%s: %d records, %d bytes'%(path,len(wfn),wfn.size))
+        print('  '+', '.join('%s=%d'%(name,wfn.header[name]) for name in HEADER_FIELDS))
+        for n,block in enumerate(wfn.blocks):
+            energies = wfn.get_eigenvalues(n)*HARTREE_TO_CM
+            print('  block %d: %d levels, nbass=%d, E=%.3f..%.3f cm-1'%\
+                (n,block['nlevels'],block['nbass'],energies[0],energies[-1]))
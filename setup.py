@@ -7,14 +7,14 @@ setup(
     author_email="",
     description="Python wrapper for DRV3D program suite",
     #url="",
-    python_requires=">=3.5",
+    python_requires=">=3.7",
     packages=find_packages(),
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: GPL-3",
         "Operating System :: OS Independent",
     ],
-    #install_requires=[],
+    install_requires=["numpy>=1.13"],
     entry_points = {
         'console_scripts': ['pydvr3d=pydvr3d.command_line:main']
     }
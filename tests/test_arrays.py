@@ -0,0 +1,83 @@
+import os
+import stat
+
+from pydvr3d.calc.positions import SlurmArray, SlurmPack
+
+SBATCH = """#!/bin/sh
+echo "$@" >> "%s"
+N=$(wc -l < "%s")
+echo "Submitted batch job $((1000+N))"
+"""
+
+def stub_sbatch(tmp_path,monkeypatch):
+    """ Put the fake sbatch to PATH, return the file with its calls. """
+    bindir = tmp_path/'bin'
+    bindir.mkdir()
+    calls = tmp_path/'sbatch.calls'
+    sbatch = bindir/'sbatch'
+    sbatch.write_text(SBATCH%(calls,calls))
+    sbatch.chmod(sbatch.stat().st_mode|stat.S_IEXEC)
+    monkeypatch.setenv('PATH','%s%s%s'%(bindir,os.pathsep,os.environ['PATH']))
+    return calls
+
+def submit_folders(tmp_path,monkeypatch,job_manager,nfolders):
+    folders = []
+    for i in range(nfolders):
+        folder = tmp_path/('jki%02d'%i)
+        folder.mkdir()
+        monkeypatch.chdir(folder)
+        job_manager.submit_job()
+        folders.append(str(folder))
+    monkeypatch.chdir(tmp_path)
+    job_manager.finalize()
+    return folders
+
+def test_array_throttle(tmp_path,monkeypatch):
+    calls = stub_sbatch(tmp_path,monkeypatch)
+    job_manager = SlurmArray('test')
+    job_manager.throttle = 3
+    job_manager.max_array_size = 4
+    folders = submit_folders(tmp_path,monkeypatch,job_manager,10)
+    assert calls.read_text().splitlines() == [
+        '--array=0-3%3 job_array.sh 0',
+        '--array=0-3%3 --dependency=afterany:1001 job_array.sh 4',
+        '--array=0-1%3 --dependency=afterany:1002 job_array.sh 8',
+    ]
+    assert (tmp_path/'job_array.list').read_text().splitlines() == folders
+    script = (tmp_path/'job_array.sh').read_text()
+    assert 'sed -n "${TASK}p" job_array.list' in script
+    assert os.access(str(tmp_path/'job_array.sh'),os.X_OK)
+
+def test_array_no_throttle(tmp_path,monkeypatch):
+    calls = stub_sbatch(tmp_path,monkeypatch)
+    job_manager = SlurmArray('test')
+    job_manager.max_array_size = 4
+    submit_folders(tmp_path,monkeypatch,job_manager,5)
+    assert calls.read_text().splitlines() == [
+        '--array=0-3 job_array.sh 0',
+        '--array=0-0 job_array.sh 4',
+    ]
+
+def test_pack_scripts(tmp_path,monkeypatch):
+    calls = stub_sbatch(tmp_path,monkeypatch)
+    job_manager = SlurmPack('test')
+    job_manager.nnodes = 2
+    job_manager.ncores = 4
+    job_manager.memory = 8000
+    job_manager.ntasks = 2
+    job_manager.pack_size = 3
+    folders = submit_folders(tmp_path,monkeypatch,job_manager,5)
+    assert calls.read_text().splitlines() == ['job_pack_000.sh','job_pack_001.sh']
+    packs = [folders[:3],folders[3:]]
+    for i,pack in enumerate(packs):
+        script = (tmp_path/('job_pack_%03d.sh'%i)).read_text()
+        assert '#SBATCH -N 2\n' in script
+        assert '#SBATCH -n 2\n' in script
+        assert '#SBATCH -c 4\n' in script
+        assert '#SBATCH --mem-per-cpu 2000\n' in script
+        steps = [line for line in script.splitlines() if 'srun' in line]
+        assert len(steps) == len(pack)
+        for line,folder in zip(steps,pack):
+            assert line.startswith('(cd "%s" && srun --exclusive -N1 -n1 -c 4 ./job.sh '%folder)
+            assert line.endswith(') &')
+        assert script.endswith('\nwait\n')
@@ -0,0 +1,73 @@
+import numpy as np
+
+from pydvr3d.parse.collect_states import read_energies, to_records, ENERGY_DTYPE
+from pydvr3d.parse.collect_states_ht import read_hose_taylor_out
+
+WITH_ZPE = """   1492.92262424527     
+*          #   energy (cm-1)                   j  VTET_parity VTET_symmetry
+           2   700.949022793575                0           2           2
+           3   1103.15319361678                0           2           2
+           4   1399.25751556154                0           2           2
+"""
+
+WITHOUT_ZPE = """*
+*          #   energy (cm-1)                   j  VTET_parity VTET_symmetry
+           1   2534.99843377645                0           2           1
+           2   3219.45040885377                0           2           1
+"""
+
+ROTLEV = """* energies calculated by the ROTLEV3B code
+*          #   energy (cm-1)                   j  VTET_parity VTET_symmetry
+           1   1495.44043477715                2           2           2
+           2   1507.97500367807                2           2           2
+           3   2196.37998712616                2           2           2
+"""
+
+def write_energies(tmp_path,text):
+    (tmp_path/'energies.out').write_text(text)
+    return str(tmp_path)
+
+def test_energies_with_zpe(tmp_path):
+    ZPE,energies = read_energies(write_energies(tmp_path,WITH_ZPE),0,0,0)
+    assert ZPE == 1492.92262424527
+    assert energies.dtype == ENERGY_DTYPE
+    assert energies['n'].tolist() == [2,3,4]
+    assert energies['e'].tolist() == [700.949022793575,1103.15319361678,1399.25751556154]
+    assert energies[['j','p','s']].tolist() == [(0,2,2)]*3
+
+def test_energies_without_zpe(tmp_path):
+    ZPE,energies = read_energies(write_energies(tmp_path,WITHOUT_ZPE),0,0,1)
+    assert ZPE is None
+    assert energies['n'].tolist() == [1,2]
+    assert energies['s'].tolist() == [1,1]
+    ZPE,energies = read_energies(write_energies(tmp_path,ROTLEV),2,1,0)
+    assert ZPE is None
+    assert energies['j'].tolist() == [2,2,2]
+    assert len(energies) == 3
+
+def test_energies_absent(tmp_path):
+    ZPE,energies = read_energies(str(tmp_path),0,0,0)
+    assert ZPE is None and len(energies) == 0
+
+def test_truncated_line(tmp_path,capsys):
+    # the job was killed while writing the last line
+    ZPE,energies = read_energies(write_energies(tmp_path,ROTLEV+'           4   2209.134\n'),2,1,0)
+    assert energies['n'].tolist() == [1,2,3]
+    assert "energies.out, line 6: 2 values instead of 5, skipped" in capsys.readouterr().out
+
+def test_bad_lines(capsys):
+    data = '1 10.5 0 2 2\n2 11.5 0 2 2 7\n\n3 ****** 0 2 2\n4 12.5 0 2 1\n'
+    energies = to_records(data,ENERGY_DTYPE,'energies.out')
+    # the extra value does not shift the following columns
+    assert energies.tolist() == [(1,10.5,0,2,2),(4,12.5,0,2,1)]
+    out = capsys.readouterr().out
+    assert 'energies.out, line 2: 6 values instead of 5, skipped' in out
+    assert 'energies.out, line 4: non-numeric values, skipped' in out
+
+def test_hose_taylor_out(tmp_path):
+    (tmp_path/'fort.8.hose-taylor.out').write_text(
+        ' 1       3.98439   1  0   1.00000  1  0  0\n'
+        ' 1     704.71567   1  0   1.00000  1  0  0\n')
+    energies = read_hose_taylor_out(str(tmp_path),'fort.8')
+    assert energies['energy'].tolist() == [3.98439,704.71567]
+    assert np.all(energies['ka']==1)
@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+import pytest
+
+from pydvr3d.calc import ledger as job_ledger
+from pydvr3d.calc import estimate
+from pydvr3d.calc.estimate import Estimator, get_estimator, get_block_costs, get_state_basis
+
+def get_rovib_state():
+    dvr3drjz = SimpleNamespace(jrot=0,kmin=0,ipar=0,idia=-2,npnt1=0,npnt2=30,nalf=40,
+        max2d=600,max3d=1500,neval=150)
+    rotlev = SimpleNamespace(kmin=0,nvib=9999,ibass=0)
+    return SimpleNamespace(dvr3drjz=dvr3drjz,rotlev=rotlev)
+
+STATES = [
+    {'name':'jki_0000','jrot':0,'kmin':0,'ipar':0},
+    {'name':'jki_0510','jrot':5,'kmin':1,'ipar':0},
+    {'name':'jki_1020','jrot':10,'kmin':2,'ipar':0},
+]
+
+def test_state_basis():
+    rovib_state = get_rovib_state()
+    bases = [get_state_basis(rovib_state,state) for state in STATES]
+    assert [basis['jrot'] for basis in bases] == [0,5,10]
+    assert bases[0]['npnt1'] == 30 # idia=-2: same grid in r1 and r2
+    assert estimate.get_rotlev_size(bases[0]) == 0
+    assert estimate.get_rotlev_size(bases[1]) == 150*6
+    assert estimate.get_rotlev_size(bases[2]) == 150*21
+    assert (rovib_state.dvr3drjz.jrot,rovib_state.rotlev.kmin) == (0,0) # not changed
+
+def test_estimate_limits():
+    estimator = Estimator(ncores=8,memory=4000,walltime=24,flop_rate=1e6)
+    bases = [get_state_basis(get_rovib_state(),state) for state in STATES]
+    resources = [estimator.estimate(basis) for basis in bases]
+    for basis,res in zip(bases,resources):
+        assert 1<=res['ncores']<=8
+        assert 1<=res['walltime']<=24
+        assert res['memory']<=4000
+    # larger J blocks are more expensive
+    flops = [estimate.estimate_flops(basis) for basis in bases]
+    assert flops == sorted(flops)
+    assert resources[-1]['ncores'] == 8
+
+def test_calibrate_and_costs(tmp_path,monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    ledger = str(tmp_path/'ledger.db')
+    rovib_state = get_rovib_state()
+    basis = get_state_basis(rovib_state,STATES[1])
+    folder = tmp_path/'jki_0510'
+    folder.mkdir()
+    (folder/'job.sh').write_text('#!/bin/sh\n#SBATCH -c 4\nexport OMP_NUM_THREADS=2\n')
+    id = job_ledger.start(ledger,'jki_0510')
+    job_ledger.end(ledger,id,0)
+    job_ledger.execute(ledger,'UPDATE jobs SET start=?, end=? WHERE id=?',(0.,100.,id))
+    failed = job_ledger.start(ledger,'jki_1020')
+    job_ledger.end(ledger,failed,1) # failed runs are not used
+    VARSPACE = {
+        'CALCULATE':{'ncores':8,'memory':4000,'walltime':24},
+        'CREATE':{'ledger':ledger,'job_script':'job.sh'},
+    }
+    estimator = get_estimator(VARSPACE,rovib_state,STATES)
+    assert estimator.flop_rate == pytest.approx(estimate.estimate_flops(basis)/200)
+    costs = get_block_costs(rovib_state,STATES)
+    assert list(costs) == [state['name'] for state in STATES]
+    assert costs['jki_0510'] == estimate.estimate_flops(basis)
+    assert rovib_state.dvr3drjz.jrot == 0 # not changed
@@ -0,0 +1,85 @@
+import pytest
+
+from pydvr3d.calc import intensities
+from pydvr3d.calc import transitions as trans_gen
+
+STATES = """name   jrot kmin ipar
+jki_0000  0  0  0
+jki_0001  0  0  1
+jki_0100  1  0  0
+jki_0110  1  1  0
+jki_0111  1  1  1
+jki_0200  2  0  0
+jki_0220  2  2  0
+jki_0221  2  2  1
+jki_0310  3  1  0
+jki_0320  3  2  0
+"""
+
+FILTERS = [
+    'True',
+    'abs(jrot-jrot_)<=1 and kmin==kmin_',
+    "fort=='fort.8' or name_ in ['jki_0100','jki_0220']",
+    'not (ipar!=ipar_) and 0<kmin<=kmin_',
+    "kmin_==1 if kmin==1 else fort_!='fort.26'",
+    "name.startswith('jki_02') and fort_ in ('fort.8','fort.9')", # evaluated pair by pair
+]
+
+def generate_baseline(states,project_name,filter,J_min,J_max,J_diff_min,J_diff_max):
+    """ The original double loop of intensities.generate. """
+    filter = eval('lambda jrot,kmin,ipar,jrot_,kmin_,ipar_,fort,fort_,name,name_: %s'%filter)
+    fmt_head = '%10s  %34s   %2s %1s %1s   %2s %1s %1s   %7s %7s   %8s  %8s\n'
+    fmt = '%10s  %34s   %02d %1d %1d   %02d %1d %1d   %7s %7s   %8s  %8s\n'
+    lines = [fmt_head%('id','name','J','k','i','J','k','i','fort','fort','state','state')]
+    count = 0
+    for state_bra in states:
+        name,jrot,kmin,ipar,frts = intensities.get_case_params(state_bra)
+        for state_ket in states:
+            name_,jrot_,kmin_,ipar_,frts_ = intensities.get_case_params(state_ket)
+            if jrot<J_min: continue
+            if jrot>J_max: continue
+            if jrot-jrot_<J_diff_min: continue
+            if jrot-jrot_>J_diff_max: continue
+            for fort in frts:
+                for fort_ in frts_:
+                    pars = (jrot,kmin,ipar,jrot_,kmin_,ipar_,fort,fort_,name,name_)
+                    if not filter(*pars): continue
+                    count += 1
+                    id = '%s%s'%(project_name,count)
+                    tname = intensities.create_transition_folder_name(name,fort,name_,fort_)
+                    lines.append(fmt%(id,tname,*pars))
+    return ''.join(lines)
+
+def get_varspace(tmp_path,filter,limits):
+    (tmp_path/'states.txt').write_text(STATES)
+    J_min,J_max,J_diff_min,J_diff_max = limits
+    return {
+        'INIT':{'states':str(tmp_path/'states.txt'),'project':'TEST'},
+        'GENERATE':{'output':str(tmp_path/'transitions.txt'),'filter':filter,
+            'j_min':str(J_min),'j_max':str(J_max),
+            'j_diff_min':str(J_diff_min),'j_diff_max':str(J_diff_max),
+            'selection_rules':'false'},
+    }
+
+@pytest.mark.parametrize('filter',FILTERS)
+@pytest.mark.parametrize('limits',[(0,3,-1,1),(1,2,0,1),(0,3,-3,3)])
+def test_generate_as_baseline(tmp_path,filter,limits):
+    VARSPACE = get_varspace(tmp_path,filter,limits)
+    intensities.generate(VARSPACE)
+    states = intensities.read_states(VARSPACE['INIT']['states'])
+    expected = generate_baseline(states,'TEST',filter,*limits)
+    assert (tmp_path/'transitions.txt').read_text() == expected
+    assert len(expected.splitlines())>1
+
+def test_filter_compilation():
+    assert trans_gen.compile_filter('abs(jrot-jrot_)<=1 and kmin in [0,1]')[1] is not None
+    assert trans_gen.compile_filter("name.startswith('jki')")[1] is None
+
+def test_filter_errors():
+    states = [{'name':'jki_0000','jrot':0,'kmin':0,'ipar':0},
+        {'name':'jki_0100','jrot':1,'kmin':0,'ipar':0}]
+    rows = trans_gen.expand_states(states,intensities.get_case_params)
+    for expression in ['jrot_x==1','fort+1>0']: # misspelled key, wrong types
+        filters = [trans_gen.get_filter(expression)]
+        with pytest.raises((NameError,TypeError)):
+            trans_gen.generate_pairs(rows,0,1,-1,1,filters)
@@ -0,0 +1,76 @@
+import os
+import stat
+import socket
+import subprocess
+import sys
+
+from pydvr3d.calc import ledger as job_ledger
+
+def test_start_end(tmp_path,monkeypatch):
+    monkeypatch.setenv('SLURM_JOB_ID','101')
+    monkeypatch.delenv('SLURM_ARRAY_JOB_ID',raising=False)
+    ledger = str(tmp_path/'ledger.db')
+    first = job_ledger.start(ledger,'jki_0000')
+    job_ledger.end(ledger,first,0)
+    second = job_ledger.start(ledger,'jki_0000') # resubmitted
+    job_ledger.end(ledger,second,2)
+    ok = job_ledger.start(ledger,'jki_0100')
+    job_ledger.end(ledger,ok,0)
+    running = job_ledger.start(ledger,'jki_0110')
+    runs = job_ledger.get_last_runs(ledger)
+    assert list(runs) == ['jki_0000','jki_0100','jki_0110']
+    run = runs['jki_0000']
+    assert (run['id'],run['jobid'],run['hostname'],run['exit_code']) == \
+        (second,'101',socket.gethostname(),2)
+    assert run['start']<=run['end']
+    assert [job_ledger.get_run_status(run) for run in runs.values()] == [5,0,1]
+    assert job_ledger.get_run_status(None) == 2
+    assert list(job_ledger.get_last_runs(ledger,['jki_0110','absent'])) == ['jki_0110']
+    assert job_ledger.get_failed(ledger) == ['jki_0000']
+    assert runs['jki_0110']['id'] == running
+
+def test_reconcile(tmp_path,monkeypatch):
+    ledger = str(tmp_path/'ledger.db')
+    # Slurm jobs: 201 was killed by the time limit, 202 is still running
+    bindir = tmp_path/'bin'
+    bindir.mkdir()
+    sacct = bindir/'sacct'
+    sacct.write_text('#!/bin/sh\necho "201|TIMEOUT"\necho "202|RUNNING"\n')
+    sacct.chmod(sacct.stat().st_mode|stat.S_IEXEC)
+    monkeypatch.setenv('PATH','%s%s%s'%(bindir,os.pathsep,os.environ['PATH']))
+    monkeypatch.delenv('SLURM_ARRAY_JOB_ID',raising=False)
+    for name,jobid in [('killed','201'),('alive','202')]:
+        monkeypatch.setenv('SLURM_JOB_ID',jobid)
+        job_ledger.start(ledger,name)
+    # local jobs: the run is open while the job script (pid in jobid) is alive
+    monkeypatch.delenv('SLURM_JOB_ID')
+    proc = subprocess.Popen(['true'])
+    proc.wait() # finished without the "end" call
+    orphan = job_ledger.execute(ledger,'INSERT INTO jobs (name,jobid,hostname,start) VALUES (?,?,?,?)',
+        ('orphan','local-%d'%proc.pid,socket.gethostname(),0.))
+    job_ledger.execute(ledger,'INSERT INTO jobs (name,jobid,hostname,start) VALUES (?,?,?,?)',
+        ('local','local-%d'%os.getpid(),socket.gethostname(),0.))
+    closed = job_ledger.reconcile(ledger)
+    assert sorted(closed) == [('killed','TIMEOUT'),('orphan','GONE')]
+    runs = job_ledger.get_last_runs(ledger)
+    assert runs['killed']['exit_code'] == job_ledger.EXIT_CODE_KILLED
+    assert runs['orphan']['id'] == orphan and runs['orphan']['end'] is not None
+    assert runs['alive']['end'] is None and runs['local']['end'] is None
+    assert sorted(job_ledger.get_failed(ledger)) == ['killed','orphan']
+    assert job_ledger.reconcile(ledger) == [] # closed runs are not probed again
+
+def test_job_commands(tmp_path):
+    ledger = str(tmp_path/'ledger.db')
+    folder = tmp_path/'jki_0000'
+    folder.mkdir()
+    script = '\n'.join(job_ledger.get_job_commands(ledger,['true',"sh -c 'exit 3'",'true']))
+    root = os.path.abspath(os.path.join(os.path.dirname(job_ledger.__file__),'..','..'))
+    env = dict(os.environ,PYTHONPATH=root)
+    env.pop('SLURM_JOB_ID',None); env.pop('SLURM_ARRAY_JOB_ID',None)
+    subprocess.run(['bash','-c',script],cwd=str(folder),env=env,check=True)
+    run = job_ledger.get_last_runs(ledger)['jki_0000']
+    assert run['exit_code'] == 3 and run['end'] is not None
+    # "end" without the run id ("start" failed) does not fail the job
+    result = subprocess.run([sys.executable,'-m','pydvr3d.calc.ledger',ledger,'end','','0'],
+        env=env,stderr=subprocess.PIPE,universal_newlines=True)
+    assert result.returncode == 0 and 'no run id' in result.stderr
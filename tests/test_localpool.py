@@ -0,0 +1,58 @@
+import os
+import time
+
+from pydvr3d.calc.positions import LocalPool
+from pydvr3d.calc.campaign import Campaign
+
+JOB = """#!/bin/sh
+touch ===RUNNING===
+sleep %s
+touch ===DONE===
+rm ===RUNNING===
+echo OMP_NUM_THREADS=$OMP_NUM_THREADS
+exit %d
+"""
+
+def make_folder(tmp_path,name,exit_code=0,sleep=0.5):
+    folder = tmp_path/name
+    folder.mkdir()
+    job = folder/'job.sh'
+    job.write_text(JOB%(sleep,exit_code))
+    job.chmod(0o755)
+    return str(folder)
+
+def test_submit_does_not_block(tmp_path,monkeypatch):
+    pool = LocalPool('test')
+    pool.nslots = 1; pool.ncores_total = 2
+    folders = [make_folder(tmp_path,'jki%02d'%i,exit_code=i%2) for i in range(3)]
+    start = time.time()
+    for folder in folders:
+        monkeypatch.chdir(folder)
+        pool.submit_job()
+    assert time.time()-start<0.4
+    assert len(pool.running) == 1 and len(pool.queued) == 2
+    monkeypatch.chdir(tmp_path)
+    pool.finalize()
+    assert not pool.running and not pool.queued
+    assert pool.failed == [(folders[1],1)]
+    for folder in folders:
+        logs = [name for name in os.listdir(folder) if name.startswith('slurm-local-')]
+        assert len(logs) == 1
+        with open(os.path.join(folder,logs[0])) as f:
+            assert f.read() == 'OMP_NUM_THREADS=2\n'
+
+def test_campaign_with_pool(tmp_path,monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    blocks = LocalPool('blocks'); blocks.nslots = 1
+    transitions = LocalPool('transitions'); transitions.nslots = 1
+    campaign = Campaign()
+    for name in ['A','B','C']:
+        campaign.add_node(name,make_folder(tmp_path,name,sleep=0.2),blocks)
+    campaign.add_node('AB',make_folder(tmp_path,'AB',sleep=0),transitions,deps=['A','B'])
+    campaign.add_node('BC',make_folder(tmp_path,'BC',sleep=0),transitions,deps=['B','C'])
+    assert campaign.run(interval=0.1) == []
+    for name in campaign.nodes:
+        assert os.path.isfile(os.path.join(str(tmp_path),name,'===DONE==='))
+    # AB is released while C is still waiting for the slot or running
+    C_done = os.path.getmtime(os.path.join(str(tmp_path),'C','===DONE==='))
+    assert campaign.nodes['AB'].submit_time<C_done
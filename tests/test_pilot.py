@@ -0,0 +1,59 @@
+import os
+import sqlite3
+
+import pydvr3d
+from pydvr3d.calc import pilot
+from pydvr3d.calc.positions import get_job_manager
+
+JOB = """#!/bin/sh
+echo OMP_NUM_THREADS=$OMP_NUM_THREADS
+exit %d
+"""
+
+def test_pilot_local(tmp_path,monkeypatch):
+    # The workers are started as "python -m pydvr3d.calc.pilot".
+    root = os.path.dirname(os.path.dirname(os.path.abspath(pydvr3d.__file__)))
+    monkeypatch.setenv('PYTHONPATH',root)
+    job_manager = get_job_manager('pilotlocal','job.sh')
+    job_manager.ncores = 2
+    job_manager.nslots = 2
+    job_manager.npilots = 2
+    exit_codes = {}
+    for i,exit_code in enumerate([0,0,3,0,1]):
+        folder = tmp_path/('jki%02d'%i)
+        folder.mkdir()
+        job = folder/'job.sh'
+        job.write_text(JOB%exit_code)
+        job.chmod(0o755)
+        monkeypatch.chdir(folder)
+        job_manager.submit_job()
+        exit_codes[str(folder)] = exit_code
+    monkeypatch.chdir(tmp_path)
+    job_manager.finalize()
+
+    queue = str(tmp_path/'pilot_queue.db')
+    counts = pilot.get_counts(queue)
+    assert dict(counts) == {'pending':0,'running':0,'done':3,'failed':2}
+    conn = sqlite3.connect(queue)
+    rows = conn.execute('SELECT path,state,exit_code,worker FROM queue').fetchall()
+    conn.close()
+    assert len(rows) == len(exit_codes)
+    for path,state,exit_code,worker in rows:
+        assert exit_code == exit_codes[path]
+        assert state == ('failed' if exit_code else 'done')
+        assert worker
+        logs = [name for name in os.listdir(path) if name.startswith('slurm-pilot-')]
+        assert len(logs) == 1
+        with open(os.path.join(path,logs[0])) as f:
+            assert f.read() == 'OMP_NUM_THREADS=2\n'
+
+def test_requeue(tmp_path):
+    queue = str(tmp_path/'pilot_queue.db')
+    pilot.put(queue,[str(tmp_path/'a'),str(tmp_path/'b')],'job.sh')
+    id,path,job_file = pilot.claim(queue,'worker')
+    assert (path,job_file) == (str(tmp_path/'a'),'job.sh')
+    # Putting the folders again keeps the running one.
+    pilot.put(queue,[str(tmp_path/'a'),str(tmp_path/'b')],'job.sh')
+    assert dict(pilot.get_counts(queue)) == {'pending':1,'running':1,'done':0,'failed':0}
+    assert pilot.requeue(queue) == 1
+    assert dict(pilot.get_counts(queue)) == {'pending':2,'running':0,'done':0,'failed':0}
@@ -0,0 +1,81 @@
+import os
+import stat
+
+import pytest
+
+from pydvr3d.calc import positions
+from pydvr3d.calc.positions import classify_failure, escalate, \
+    read_resubmit_log, write_resubmit_log, get_failed_blocks
+
+SETTINGS = {'memory':8000,'walltime':24,'max3d':1000,'neval':100}
+
+@pytest.mark.parametrize('error,signature',[
+    ('time limit','walltime'),
+    ('out of memory','memory'),
+    ('severe (41): insufficient virtual memory','memory'),
+    ('segmentation fault','segfault'),
+    ('severe (174): SIGSEGV, segmentation fault occurred','segfault'),
+    ('severe (67): input statement requires too much data, unit 26','basis'),
+    ('severe (24): end-of-file during read, unit 26','eigenvectors'),
+    ('severe (29): file not found, unit 5','unknown'),
+])
+def test_classify_failure(error,signature):
+    assert classify_failure(error) == signature
+
+@pytest.mark.parametrize('signature,changes',[
+    ('walltime',{'walltime':48}),
+    ('memory',{'memory':16000}),
+    ('segfault',{}),
+    ('basis',{'max3d':1500,'memory':16000}),
+    ('eigenvectors',{'neval':150}),
+    ('unknown',{}),
+])
+def test_escalate(signature,changes):
+    settings = escalate(SETTINGS,signature)
+    assert settings == dict(SETTINGS,**changes)
+    assert SETTINGS['memory'] == 8000 # the input is not changed
+
+def test_resubmit_log(tmp_path):
+    dirname = str(tmp_path)
+    assert read_resubmit_log(dirname) == (0,None)
+    write_resubmit_log(dirname,1,'memory',escalate(SETTINGS,'memory'),'out of memory\n')
+    settings = escalate(SETTINGS,'walltime')
+    write_resubmit_log(dirname,2,'walltime',settings,'time limit')
+    assert read_resubmit_log(dirname) == (2,settings)
+
+SACCT = """#!/bin/sh
+echo "101|TIMEOUT"
+echo "102|RUNNING"
+echo "103_4|CANCELLED by 1000"
+"""
+
+def make_block(tmp_path,name,label,output=None,text=''):
+    folder = tmp_path/name
+    folder.mkdir()
+    (folder/label).write_text('')
+    if output:
+        (folder/output).write_text(text)
+
+def test_killed_blocks(tmp_path,monkeypatch):
+    bindir = tmp_path/'bin'
+    bindir.mkdir()
+    sacct = bindir/'sacct'
+    sacct.write_text(SACCT)
+    sacct.chmod(sacct.stat().st_mode|stat.S_IEXEC)
+    monkeypatch.setenv('PATH','%s%s%s'%(bindir,os.pathsep,os.environ['PATH']))
+    monkeypatch.chdir(tmp_path)
+    running,done = positions.LABEL_RUNNING,positions.LABEL_DONE
+    make_block(tmp_path,'jki_0000',running,'slurm-101.out','step 1\n')
+    make_block(tmp_path,'jki_0001',running,'slurm-102.out','step 1\n')
+    make_block(tmp_path,'jki_0010',running,'slurm-103_4.out','step 1\n')
+    make_block(tmp_path,'jki_0011',done,'slurm-104.out','segmentation fault\n')
+    make_block(tmp_path,'jki_0100',done,'slurm-105.out','all done\n')
+    states = [{'name':name} for name in ['jki_0000','jki_0001','jki_0010','jki_0011','jki_0100']]
+    failed = get_failed_blocks({'CREATE':{'ledger':None}},states)
+    assert dict(failed) == {
+        'jki_0000':'time limit',
+        'jki_0010':'job 103_4 ended (CANCELLED) without the DONE label',
+        'jki_0011':'segmentation fault',
+    }
+    assert [classify_failure(error) for error in failed.values()] == \
+        ['walltime','unknown','segfault']
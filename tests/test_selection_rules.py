@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+from pydvr3d.calc import intensities
+from pydvr3d.calc import transitions as trans_gen
+
+# (J, kmin, file): DVR3D e/f label of the wavefunction file
+LABELS = {
+    (0,0,'fort.26'):'e',
+    (1,0,'fort.26'):'f',
+    (1,1,'fort.8'):'e',
+    (2,0,'fort.8'):'f',
+    (2,1,'fort.8'):'e',
+    (2,2,'fort.8'):'e',
+    (2,2,'fort.9'):'f',
+    (3,2,'fort.8'):'e',
+    (3,2,'fort.9'):'f',
+}
+
+def get_files(jrot,kmin):
+    return [fort for (jrot_,kmin_,fort) in LABELS if (jrot_,kmin_)==(jrot,kmin)]
+
+def drop_rule(bra,ket,spin_weights=None):
+    """ First rule rejecting the pair (None => kept), straight from the definitions. """
+    (jrot,kmin,ipar,fort),(jrot_,kmin_,ipar_,fort_) = bra,ket
+    same = LABELS[jrot,kmin,fort]==LABELS[jrot_,kmin_,fort_]
+    if abs(jrot-jrot_)>1:
+        return 'delta J'
+    if jrot==0 and jrot_==0:
+        return 'J=0 -> 0'
+    if same==(jrot==jrot_): # e <-> f for dJ=0, e <-> e and f <-> f for dJ=1
+        return 'parity'
+    if ipar!=ipar_:
+        return 'nuclear spin'
+    if spin_weights is not None and spin_weights[ipar]==0:
+        return 'spin weight'
+    return None
+
+CASES = [
+    ((0,0,0,'fort.26'),(1,1,0,'fort.8'),None), # e <-> e
+    ((0,0,0,'fort.26'),(1,0,0,'fort.26'),'parity'), # e <-> f, dJ=1
+    ((0,0,0,'fort.26'),(0,0,0,'fort.26'),'J=0 -> 0'),
+    ((2,2,0,'fort.8'),(0,0,0,'fort.26'),'delta J'),
+    ((1,1,0,'fort.8'),(1,0,0,'fort.26'),None), # e <-> f, dJ=0
+    ((1,1,0,'fort.8'),(1,1,0,'fort.8'),'parity'),
+    ((2,2,0,'fort.8'),(2,2,0,'fort.9'),None),
+    ((2,2,0,'fort.9'),(2,2,0,'fort.9'),'parity'),
+    ((2,2,0,'fort.9'),(1,0,0,'fort.26'),None), # f <-> f
+    ((2,2,0,'fort.9'),(1,1,0,'fort.8'),'parity'),
+    ((2,0,0,'fort.8'),(3,2,0,'fort.9'),None),
+    ((2,1,0,'fort.8'),(3,2,0,'fort.9'),'parity'),
+    ((2,2,0,'fort.8'),(2,2,1,'fort.9'),'nuclear spin'),
+    ((2,2,1,'fort.8'),(2,2,1,'fort.9'),None),
+]
+
+def get_pair_rule(bra,ket,spin_weights=None):
+    """ First selection rule rejecting the pair, see transitions.get_selection_rules. """
+    rows = {key:np.array(vals) for key,vals in zip(['jrot','kmin','ipar','fort','name'],
+        zip(*[state+('jki_%02d%d%d'%state[:3],) for state in [bra,ket]]))}
+    rows['p'] = np.array([trans_gen.get_parity(jrot,kmin,fort) \
+        for jrot,kmin,fort in zip(rows['jrot'],rows['kmin'],rows['fort'])])
+    params = trans_gen.get_pair_params(rows,np.array([0]),np.array([1]))
+    for name,predicate in trans_gen.get_selection_rules(spin_weights):
+        if not predicate(params)[0]:
+            return name
+    return None
+
+def test_wavefunction_files():
+    for jrot,kmin in set((jrot,kmin) for jrot,kmin,_ in LABELS):
+        assert trans_gen.get_wavefunction_files(jrot,kmin) == get_files(jrot,kmin)
+
+@pytest.mark.parametrize('bra,ket,rule',CASES)
+def test_selection_rules(bra,ket,rule):
+    assert drop_rule(bra,ket) == rule
+    assert get_pair_rule(bra,ket) == rule
+    assert get_pair_rule(ket,bra) == rule
+
+@pytest.mark.parametrize('spin_weights',[(1,3),(0,1),(1,0)])
+def test_spin_weight(spin_weights):
+    bra,ket = (2,2,0,'fort.8'),(2,2,0,'fort.9')
+    bra1,ket1 = (2,2,1,'fort.8'),(2,2,1,'fort.9')
+    assert get_pair_rule(bra,ket,spin_weights) == (None if spin_weights[0] else 'spin weight')
+    assert get_pair_rule(bra1,ket1,spin_weights) == (None if spin_weights[1] else 'spin weight')
+
+@pytest.mark.parametrize('spin_weights',[None,(0,1)])
+def test_rule_counts(spin_weights):
+    states = [{'name':'jki_%02d%d%d'%(jrot,kmin,ipar),'jrot':jrot,'kmin':kmin,'ipar':ipar} \
+        for jrot,kmin in sorted(set((jrot,kmin) for jrot,kmin,_ in LABELS)) for ipar in [0,1]]
+    rows = trans_gen.expand_states(states,intensities.get_case_params)
+    filters = trans_gen.get_selection_rules(spin_weights)
+    counts = {}
+    bra,ket = trans_gen.generate_pairs(rows,0,3,-2,2,filters,counts)
+    kept = set(zip(bra.tolist(),ket.tolist()))
+    expected = {}
+    nrows = len(rows['jrot'])
+    for n in range(nrows):
+        for n_ in range(nrows):
+            pair = [(int(rows['jrot'][i]),int(rows['kmin'][i]),int(rows['ipar'][i]),str(rows['fort'][i])) \
+                for i in (n,n_)]
+            if abs(pair[0][0]-pair[1][0])>2:
+                continue
+            rule = drop_rule(*pair,spin_weights=spin_weights)
+            assert ((n,n_) in kept) == (rule is None)
+            if rule:
+                expected[rule] = expected.get(rule,0)+1
+    assert counts == expected
+    assert sorted(counts) == sorted(name for name,_ in filters)